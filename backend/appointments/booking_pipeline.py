@@ -0,0 +1,118 @@
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+from fastapi import HTTPException, status
+
+
+class BookingTicket:
+    """1 request đặt lịch nằm trong hàng đợi gom lô"""
+
+    __slots__ = ("patient_id", "req", "has_insurances", "channel",
+                 "result", "error", "done", "lead", "_event")
+
+    def __init__(self, patient_id: int, req: Any, has_insurances: bool, channel: str):
+        self.patient_id = patient_id
+        self.req = req
+        self.has_insurances = has_insurances
+        self.channel = channel
+        self.result: Optional[dict] = None
+        self.error: Optional[BaseException] = None
+        self.done = False
+        self.lead = False
+        self._event = threading.Event()
+
+    def resolve(self, result: dict) -> None:
+        self.result = result
+        self.done = True
+        self._event.set()
+
+    def reject(self, error: BaseException) -> None:
+        self.error = error
+        self.done = True
+        self._event.set()
+
+
+class GroupCommitQueue:
+    """
+    Gom các request đặt lịch đồng thời theo key (schedule_id) thành 1 transaction.
+    - Request đầu tiên của key làm "leader": chờ `window` giây để gom thêm, rồi commit cả lô.
+    - Còn request chờ sau lô -> chuyển quyền leader cho request đứng đầu hàng.
+    - Mỗi request vẫn nhận kết quả/lỗi riêng (commit_batch phải resolve/reject từng ticket).
+    """
+
+    def __init__(
+        self,
+        commit_batch: Callable[[Hashable, List[BookingTicket]], None],
+        *,
+        window: float = 0.005,
+        max_batch: int = 50,
+    ):
+        self._commit_batch = commit_batch
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: Dict[Hashable, List[BookingTicket]] = {}
+        self._leaders: set = set()
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "batches": 0, "max_batch_seen": 0}
+
+    def submit(self, key: Hashable, ticket: BookingTicket) -> dict:
+        with self._lock:
+            self._stats["requests"] += 1
+            self._pending.setdefault(key, []).append(ticket)
+            if key not in self._leaders:
+                self._leaders.add(key)
+                ticket.lead = True
+
+        if ticket.lead:
+            time.sleep(self.window)  # gom thêm request đến cùng lúc
+            self._drain(key)
+
+        while not ticket.done:
+            ticket._event.wait()
+            if ticket.lead and not ticket.done:
+                self._drain(key)
+
+        if ticket.error is not None:
+            raise ticket.error
+        return ticket.result
+
+    def _drain(self, key: Hashable) -> None:
+        with self._lock:
+            queue = self._pending.get(key, [])
+            batch, self._pending[key] = queue[:self.max_batch], queue[self.max_batch:]
+            self._stats["batches"] += 1
+            self._stats["max_batch_seen"] = max(self._stats["max_batch_seen"], len(batch))
+
+        try:
+            self._commit_batch(key, batch)
+        except HTTPException as e:
+            for t in batch:
+                if not t.done:
+                    t.reject(e)
+        except Exception as e:
+            err = HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, f"Database error: {e}")
+            for t in batch:
+                if not t.done:
+                    t.reject(err)
+        finally:
+            for t in batch:
+                if not t.done:
+                    t.reject(HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, "Không xử lý được yêu cầu đặt lịch"))
+            with self._lock:
+                rest = self._pending.get(key)
+                if rest:
+                    nxt = rest[0]
+                    nxt.lead = True
+                    nxt._event.set()
+                else:
+                    self._pending.pop(key, None)
+                    self._leaders.discard(key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self._stats)
+            data["avg_batch"] = round(data["requests"] / data["batches"], 2) if data["batches"] else 0.0
+            data["window_ms"] = self.window * 1000
+            data["max_batch"] = self.max_batch
+        return data
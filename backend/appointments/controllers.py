@@ -1,42 +1,131 @@
 from fastapi import HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from backend.database.connector import DatabaseConnector
-from typing import Dict, Any, List
+from backend.database.unit_of_work import UnitOfWork, after_commit
+from backend.database.keyset import keyset_predicate, keyset_page
+from backend.appointments.seat_reservations import seat_engine
+from backend.appointments.booking_pipeline import BookingTicket, GroupCommitQueue
+from backend.appointments.sequence_allocator import sequence_allocator
+from backend.appointments.queue_board import queue_board
+from backend.appointments.ticket_cache import ticket_cache, ticket_digest
+from backend.appointments.tickets import render_pool
+from backend.schedule_doctors.availability_cache import availability_cache, availability_topic
+from backend.realtime.broker import broker
+from typing import Dict, Any, List, Optional, Tuple
 from backend.appointments.models import (
     BookByShiftRequestModel,
     AppointmentFilterModel,
-    AppointmentPaymentFilterModel
+    AppointmentPaymentFilterModel,
+    DoctorAppointmentFeedFilterModel,
+    TicketBatchPrintFilterModel,
 )
 from datetime import datetime, timedelta, timezone
-
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.units import mm
-from reportlab.lib.utils import ImageReader
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-import qrcode
-from io import BytesIO
-from pathlib import Path
-from reportlab.lib import colors
+import hashlib
+import os
 
 db = DatabaseConnector()
 VN_TZ = timezone(timedelta(hours=7))
 
+_APPOINTMENT_DETAIL_SQL = """
+    SELECT a.id, a.patient_id, a.clinic_id, a.service_id, a.doctor_id, a.schedule_id,
+           a.queue_number, a.shift_number, a.estimated_time, a.printed, a.status,
+           a.booking_channel, a.cur_price,
+           s.name  AS service_name, s.price AS service_price,
+           d.full_name AS doctor_name, c.name AS clinic_name
+    FROM appointments a
+    JOIN services s ON a.service_id = s.id
+    JOIN doctors  d ON a.doctor_id = d.id
+    JOIN clinics  c ON a.clinic_id = c.id
+"""
+
+def _shift_is_over(ds: dict, now_vn: datetime) -> bool:
+    work_date = ds["work_date"]               # date/datetime
+    end_td = ds["end_time"]                   # TIME -> timedelta
+    end_minutes = int(end_td.total_seconds() // 60)
+    end_dt_vn = datetime(
+        work_date.year, work_date.month, work_date.day,
+        end_minutes // 60, end_minutes % 60, tzinfo=VN_TZ
+    )
+    return work_date < now_vn.date() or (work_date == now_vn.date() and end_dt_vn <= now_vn)
+
+def _estimated_time(ds: dict, shift_number: int) -> datetime:
+    work_date = ds["work_date"]
+    start_td = ds["start_time"]                       # timedelta
+    start_minutes = int(start_td.total_seconds() // 60)
+    offset_min = (shift_number - 1) * int(ds["avg_minutes_per_patient"])
+    return datetime(
+        work_date.year, work_date.month, work_date.day,
+        start_minutes // 60, start_minutes % 60,
+    ) + timedelta(minutes=offset_min)
+
+_SHIFT_CAPACITY_SQL = """
+    SELECT id, doctor_id, clinic_id, work_date, max_patients, booked_patients, capacity_version
+    FROM doctor_schedules WHERE id=%s
+"""
+
+def _notify_capacity_change(shift: Optional[dict]) -> None:
+    """
+    Gọi sau commit với booked/max/capacity_version đọc (hoặc vừa ghi) trong transaction:
+    cập nhật cache lịch khám + đẩy chỗ trống mới cho các màn hình đang nghe (SSE).
+    Hook của các transaction có thể chạy lệch thứ tự commit -> capacity_version quyết định bản nào mới hơn.
+    """
+    if not shift:
+        return
+    availability_cache.capacity_changed(
+        shift["id"], shift["doctor_id"], shift["clinic_id"], shift["work_date"],
+        booked_patients=shift["booked_patients"], max_patients=shift["max_patients"],
+        version=shift["capacity_version"],
+    )
+    broker.publish(
+        availability_topic(shift["doctor_id"], shift["clinic_id"], shift["work_date"]),
+        {
+            "type": "capacity",
+            "schedule_id": int(shift["id"]),
+            "work_date": str(shift["work_date"]),
+            "max_patients": int(shift["max_patients"]),
+            "booked_patients": int(shift["booked_patients"]),
+            "remaining": max(int(shift["max_patients"]) - int(shift["booked_patients"]), 0),
+            "version": int(shift["capacity_version"]),
+        },
+    )
+
 def _book_by_shift_core(
     patient_id: int,
     req: BookByShiftRequestModel,
-    *, has_insurances: bool, channel: str  # "online" | "offline"
+    *, has_insurances: bool, channel: str,  # "online" | "offline"
+    uow: Optional[UnitOfWork] = None,
 ) -> dict:
-    conn = db.get_connection()
+    if not req.schedule_id:
+        raise HTTPException(404, "Không tìm thấy ca hợp lệ")
+
+    # Lấy token chỗ trống trong bộ nhớ trước: ca đã đầy -> 409 ngay, không khóa doctor_schedules
+    with seat_engine.reserve(req.schedule_id):
+        return _book_by_shift_tx(patient_id, req, has_insurances=has_insurances, channel=channel, uow=uow)
+
+
+def _book_by_shift_tx(
+    patient_id: int,
+    req: BookByShiftRequestModel,
+    *, has_insurances: bool, channel: str,
+    uow: Optional[UnitOfWork] = None,
+) -> dict:
+    conn = (uow or db).get_connection()
+    queue_taken: list = []
     try:
         with conn:
+            # STT toàn ngày (theo clinic): lấy trước khi khóa ca; hết block thì giữ block mới
+            # bằng transaction ngắn trên chính connection này (commit ngay, chưa giữ khóa nào)
+            queue_day = datetime.now(VN_TZ).date()
+            queue_taken = sequence_allocator.take_queue_numbers(req.clinic_id, queue_day, 1, conn)
+            queue_number = queue_taken[0]
+
             cur = conn.cursor()
 
             # 0) Lấy & khóa ca
             cur.execute(
                 """
                 SELECT id, doctor_id, clinic_id, work_date, start_time, end_time,
-                       avg_minutes_per_patient, max_patients, booked_patients, status
+                       avg_minutes_per_patient, max_patients, booked_patients, capacity_version, status
                 FROM doctor_schedules
                 WHERE id=%s AND doctor_id=%s AND clinic_id=%s AND status=1
                 FOR UPDATE
@@ -46,17 +135,10 @@ def _book_by_shift_core(
             ds = cur.fetchone()
             if not ds:
                 raise HTTPException(404, "Không tìm thấy ca hợp lệ")
+            seat_engine.observe(ds["id"], ds["max_patients"], ds["booked_patients"])
 
             # 0.1) Chặn ca quá khứ (theo VN)
-            now_vn = datetime.now(VN_TZ)
-            work_date = ds["work_date"]               # date/datetime
-            end_td = ds["end_time"]                   # TIME -> timedelta
-            end_minutes = int(end_td.total_seconds() // 60)
-            end_dt_vn = datetime(
-                work_date.year, work_date.month, work_date.day,
-                end_minutes // 60, end_minutes % 60, tzinfo=VN_TZ
-            )
-            if work_date < now_vn.date() or (work_date == now_vn.date() and end_dt_vn <= now_vn):
+            if _shift_is_over(ds, datetime.now(VN_TZ)):
                 raise HTTPException(status.HTTP_409_CONFLICT, "Ca đã qua, vui lòng chọn ca khác")
 
             # 0.2) Chặn đặt trùng ca cho cùng bệnh nhân
@@ -74,56 +156,20 @@ def _book_by_shift_core(
             if ds["booked_patients"] >= ds["max_patients"]:
                 raise HTTPException(409, "Ca đã hết chỗ")
 
-            # 1) Giá dịch vụ (snapshot)
-            price_row = db.query_one(
-                "SELECT price FROM services WHERE id=%s", (req.service_id,)
-            )
+            # 1) Giá dịch vụ (snapshot) - đọc trong cùng transaction
+            cur.execute("SELECT price FROM services WHERE id=%s", (req.service_id,))
+            price_row = cur.fetchone()
             if not price_row:
                 raise HTTPException(404, "Không tìm thấy dịch vụ")
             base_price = float(price_row["price"])
             cur_price = base_price / 2 if has_insurances else base_price
 
-            # 2) STT toàn ngày (theo clinic)
-            cur.execute(
-                """
-                INSERT INTO clinic_daily_counters (clinic_id, counter_date, last_number)
-                VALUES (%s, CURDATE(), 1)
-                ON DUPLICATE KEY UPDATE last_number = last_number + 1
-                """,
-                (req.clinic_id,),
-            )
-            cur.execute(
-                """
-                SELECT last_number FROM clinic_daily_counters
-                WHERE clinic_id=%s AND counter_date=CURDATE() FOR UPDATE
-                """,
-                (req.clinic_id,),
-            )
-            queue_number = cur.fetchone()["last_number"]
-
-            # 3) STT trong ca
-            cur.execute(
-                """
-                INSERT INTO doctor_shift_counters (schedule_id, last_number)
-                VALUES (%s, 1)
-                ON DUPLICATE KEY UPDATE last_number = last_number + 1
-                """,
-                (req.schedule_id,),
-            )
-            cur.execute(
-                "SELECT last_number FROM doctor_shift_counters WHERE schedule_id=%s FOR UPDATE",
-                (req.schedule_id,),
-            )
-            shift_number = cur.fetchone()["last_number"]
+            # 2) STT toàn ngày đã lấy ở đầu hàm
+            # 3) STT trong ca: counter trong transaction đang khóa ca (rollback thì không để lại khoảng trống)
+            shift_number = _take_shift_numbers(cur, req.schedule_id, 1)[0]
 
             # 4) estimated_time
-            start_td = ds["start_time"]                       # timedelta
-            start_minutes = int(start_td.total_seconds() // 60)
-            offset_min = (shift_number - 1) * int(ds["avg_minutes_per_patient"])
-            estimated_time = datetime(
-                work_date.year, work_date.month, work_date.day,
-                start_minutes // 60, start_minutes % 60,
-            ) + timedelta(minutes=offset_min)
+            estimated_time = _estimated_time(ds, shift_number)
 
             # 5) INSERT appointment (KHÔNG còn qr_code)
             cur.execute(
@@ -145,7 +191,7 @@ def _book_by_shift_core(
             cur.execute(
                 """
                 UPDATE doctor_schedules
-                SET booked_patients = booked_patients + 1
+                SET booked_patients = booked_patients + 1, capacity_version = capacity_version + 1
                 WHERE id=%s AND booked_patients < max_patients
                 """,
                 (req.schedule_id,),
@@ -154,34 +200,217 @@ def _book_by_shift_core(
                 raise HTTPException(409, "Ca vừa hết chỗ")
 
             # 7) Trả chi tiết (không chọn qr_code)
-            cur.execute(
-                """
-                SELECT a.id, a.patient_id, a.clinic_id, a.service_id, a.doctor_id, a.schedule_id,
-                       a.queue_number, a.shift_number, a.estimated_time, a.printed, a.status,
-                       a.booking_channel, a.cur_price,
-                       s.name  AS service_name, s.price AS service_price,
-                       d.full_name AS doctor_name, c.name AS clinic_name
-                FROM appointments a
-                JOIN services s ON a.service_id = s.id
-                JOIN doctors  d ON a.doctor_id = d.id
-                JOIN clinics  c ON a.clinic_id = c.id
-                WHERE a.id = %s
-                """,
-                (appt_id,),
-            )
+            cur.execute(_APPOINTMENT_DETAIL_SQL + " WHERE a.id = %s", (appt_id,))
             row = cur.fetchone()
+            queue_taken = []  # từ đây STT thuộc về lịch hẹn (commit lỗi -> thành khoảng trống)
             conn.commit()
-            return row
 
     except HTTPException:
         try: conn.rollback()
         except: pass
+        sequence_allocator.give_back_queue_numbers(req.clinic_id, queue_day, queue_taken)
         raise
     except Exception as e:
         try: conn.rollback()
         except: pass
+        sequence_allocator.give_back_queue_numbers(req.clinic_id, queue_day, queue_taken)
         raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, f"Database error: {e}")
 
+    after_commit(_notify_capacity_change, {**ds, "booked_patients": int(ds["booked_patients"]) + 1,
+                                           "capacity_version": int(ds["capacity_version"]) + 1})
+    after_commit(queue_board.appointments_booked, [row])
+    return row
+
+
+def _take_shift_numbers(cur, schedule_id: int, n: int) -> List[int]:
+    """
+    N STT liên tiếp trong ca, trên cursor của transaction đang khóa ca (FOR UPDATE doctor_schedules).
+    shift_number quyết định estimated_time -> phải liền mạch, đúng thứ tự, rollback cùng lịch hẹn.
+    """
+    cur.execute(
+        """
+        INSERT INTO doctor_shift_counters (schedule_id, last_number)
+        VALUES (%s, %s)
+        ON DUPLICATE KEY UPDATE last_number = last_number + %s
+        """,
+        (schedule_id, n, n),
+    )
+    cur.execute(
+        "SELECT last_number FROM doctor_shift_counters WHERE schedule_id=%s FOR UPDATE",
+        (schedule_id,),
+    )
+    last = int(cur.fetchone()["last_number"])
+    return list(range(last - n + 1, last + 1))
+
+
+def _book_batch_tx(schedule_id: int, tickets: List[BookingTicket]) -> None:
+    """
+    Group commit: đặt lịch cho cả lô request cùng 1 ca trong 1 transaction.
+    - STT toàn ngày: lấy cho cả lô từ sequence_allocator trước khi khóa ca, số không dùng được trả lại.
+    - Khóa ca 1 lần, kiểm tra trùng/giá theo lô (IN (...)).
+    - STT trong ca: 1 dải liên tiếp từ doctor_shift_counters, trong transaction đang khóa ca.
+    - INSERT nhiều dòng vào appointments, tăng booked_patients thêm N.
+    Mỗi ticket được resolve/reject riêng.
+    """
+    conn = db.get_connection()
+    with conn:
+        cur = conn.cursor()
+
+        # STT toàn ngày: clinic của ca đọc không khóa; hết block thì giữ block mới trên connection này
+        cur.execute("SELECT clinic_id FROM doctor_schedules WHERE id=%s", (schedule_id,))
+        row = cur.fetchone()
+        if not row:
+            raise HTTPException(404, "Không tìm thấy ca hợp lệ")
+        conn.commit()  # kết thúc snapshot đọc: các lần đọc sau phải thấy dữ liệu sau khi khóa ca
+        queue_day = datetime.now(VN_TZ).date()
+        queue_numbers = sequence_allocator.take_queue_numbers(row["clinic_id"], queue_day, len(tickets), conn)
+        used = 0  # số STT đã thuộc về lịch hẹn; phần còn lại trả về allocator
+        try:
+            # 0) Lấy & khóa ca
+            cur.execute(
+                """
+                SELECT id, doctor_id, clinic_id, work_date, start_time, end_time,
+                       avg_minutes_per_patient, max_patients, booked_patients, capacity_version, status
+                FROM doctor_schedules
+                WHERE id=%s AND status=1
+                FOR UPDATE
+                """,
+                (schedule_id,),
+            )
+            ds = cur.fetchone()
+            if not ds:
+                raise HTTPException(404, "Không tìm thấy ca hợp lệ")
+            seat_engine.observe(ds["id"], ds["max_patients"], ds["booked_patients"])
+            if _shift_is_over(ds, datetime.now(VN_TZ)):
+                raise HTTPException(status.HTTP_409_CONFLICT, "Ca đã qua, vui lòng chọn ca khác")
+
+            pending: List[BookingTicket] = []
+            for t in tickets:
+                if int(t.req.doctor_id) != int(ds["doctor_id"]) or int(t.req.clinic_id) != int(ds["clinic_id"]):
+                    t.reject(HTTPException(404, "Không tìm thấy ca hợp lệ"))
+                else:
+                    pending.append(t)
+
+            # 0.2) Chặn đặt trùng ca (với DB và trong cùng lô)
+            if pending:
+                ph = ",".join(["%s"] * len(pending))
+                cur.execute(
+                    f"""
+                    SELECT DISTINCT patient_id FROM appointments
+                    WHERE schedule_id=%s AND patient_id IN ({ph}) AND status IN (0,1,2)
+                    """,
+                    (schedule_id, *[t.patient_id for t in pending]),
+                )
+                booked = {int(r["patient_id"]) for r in cur.fetchall()}
+                kept = []
+                for t in pending:
+                    if int(t.patient_id) in booked:
+                        t.reject(HTTPException(409, "Bạn đã đặt lịch cho ca này rồi"))
+                    else:
+                        booked.add(int(t.patient_id))
+                        kept.append(t)
+                pending = kept
+
+            # 1) Giá dịch vụ (snapshot)
+            prices: Dict[int, float] = {}
+            if pending:
+                service_ids = sorted({int(t.req.service_id) for t in pending})
+                ph = ",".join(["%s"] * len(service_ids))
+                cur.execute(f"SELECT id, price FROM services WHERE id IN ({ph})", tuple(service_ids))
+                prices = {int(r["id"]): float(r["price"]) for r in cur.fetchall()}
+                kept = []
+                for t in pending:
+                    if int(t.req.service_id) not in prices:
+                        t.reject(HTTPException(404, "Không tìm thấy dịch vụ"))
+                    else:
+                        kept.append(t)
+                pending = kept
+
+            # Chỗ còn lại: ai đến trước được trước
+            free = max(int(ds["max_patients"]) - int(ds["booked_patients"]), 0)
+            for t in pending[free:]:
+                t.reject(HTTPException(409, "Ca đã hết chỗ"))
+            accepted = pending[:free]
+            n = len(accepted)
+            if n == 0:
+                conn.commit()
+                return
+
+            # 2) STT toàn ngày đã lấy ở đầu hàm
+            # 3) STT trong ca: dải liên tiếp, rollback cùng lịch hẹn
+            shift_numbers = _take_shift_numbers(cur, schedule_id, n)
+
+            # 4) INSERT nhiều dòng
+            rows = []
+            by_shift_number: Dict[int, BookingTicket] = {}
+            for t, queue_number, shift_number in zip(accepted, queue_numbers, shift_numbers):
+                base_price = prices[int(t.req.service_id)]
+                rows.append((
+                    t.patient_id, ds["clinic_id"], t.req.service_id, ds["doctor_id"], schedule_id,
+                    queue_number, shift_number, _estimated_time(ds, shift_number), 0, 1,
+                    t.channel, base_price / 2 if t.has_insurances else base_price,
+                ))
+                by_shift_number[shift_number] = t
+            # executemany chỉ gộp thành 1 câu multi-row khi VALUES toàn placeholder
+            cur.executemany(
+                """
+                INSERT INTO appointments
+                    (patient_id, clinic_id, service_id, doctor_id, schedule_id,
+                     queue_number, shift_number, estimated_time, printed, status,
+                     booking_channel, cur_price)
+                VALUES (%s,%s,%s,%s,%s, %s,%s,%s,%s,%s, %s,%s)
+                """,
+                rows,
+            )
+
+            # 5) Giữ chỗ ca cho cả lô
+            cur.execute(
+                """
+                UPDATE doctor_schedules
+                SET booked_patients = booked_patients + %s, capacity_version = capacity_version + 1
+                WHERE id=%s AND booked_patients + %s <= max_patients
+                """,
+                (n, schedule_id, n),
+            )
+            if cur.rowcount == 0:
+                raise HTTPException(409, "Ca vừa hết chỗ")
+
+            # 6) Trả chi tiết cho từng request
+            ph = ",".join(["%s"] * n)
+            cur.execute(
+                _APPOINTMENT_DETAIL_SQL + f" WHERE a.schedule_id = %s AND a.shift_number IN ({ph})",
+                (schedule_id, *shift_numbers),
+            )
+            details = {int(r["shift_number"]): r for r in cur.fetchall()}
+            used = n  # commit lỗi -> STT toàn ngày đã dùng thành khoảng trống, không cấp lại
+            conn.commit()
+        finally:
+            sequence_allocator.give_back_queue_numbers(row["clinic_id"], queue_day, queue_numbers[used:])
+
+    # Trả kết quả cho request trước: hook lỗi không được làm lô đã commit bị báo thất bại
+    for shift_number, t in by_shift_number.items():
+        t.resolve(details.get(shift_number))
+    after_commit(_notify_capacity_change, {**ds, "booked_patients": int(ds["booked_patients"]) + n,
+                                           "capacity_version": int(ds["capacity_version"]) + 1})
+    after_commit(queue_board.appointments_booked, list(details.values()))
+
+
+booking_queue = GroupCommitQueue(
+    _book_batch_tx,
+    window=float(os.getenv("BOOKING_BATCH_WINDOW_MS", "5")) / 1000,
+    max_batch=int(os.getenv("BOOKING_BATCH_MAX", "50")),
+)
+
+def _book_by_shift_grouped(patient_id: int, req: BookByShiftRequestModel, *, has_insurances: bool, channel: str) -> dict:
+    """Đặt lịch qua hàng đợi group commit (kiosk đặt dồn dập vào cùng 1 ca)"""
+    if not req.schedule_id:
+        raise HTTPException(404, "Không tìm thấy ca hợp lệ")
+    with seat_engine.reserve(req.schedule_id):
+        return booking_queue.submit(
+            int(req.schedule_id),
+            BookingTicket(patient_id, req, has_insurances, channel),
+        )
+
 
 def _pick_schedule_for_offline(cur, clinic_id: int, doctor_id: int, *, today, now_time):
     # Không đổi – chỉ chọn ca còn chỗ trong hôm nay
@@ -190,7 +419,7 @@ def _pick_schedule_for_offline(cur, clinic_id: int, doctor_id: int, *, today, no
         SELECT id, doctor_id, clinic_id, work_date, start_time, end_time,
                avg_minutes_per_patient, max_patients, booked_patients, status
         FROM doctor_schedules
-        WHERE clinic_id=%s AND doctor_id=%s AND DATE(work_date)=%s
+        WHERE clinic_id=%s AND doctor_id=%s AND work_date=%s
               AND status=1 AND booked_patients < max_patients
               AND start_time <= %s AND %s < end_time
         ORDER BY start_time LIMIT 1
@@ -205,7 +434,7 @@ def _pick_schedule_for_offline(cur, clinic_id: int, doctor_id: int, *, today, no
         SELECT id, doctor_id, clinic_id, work_date, start_time, end_time,
                avg_minutes_per_patient, max_patients, booked_patients, status
         FROM doctor_schedules
-        WHERE clinic_id=%s AND doctor_id=%s AND DATE(work_date)=%s
+        WHERE clinic_id=%s AND doctor_id=%s AND work_date=%s
               AND status=1 AND booked_patients < max_patients
               AND start_time > %s
         ORDER BY start_time LIMIT 1
@@ -215,12 +444,18 @@ def _pick_schedule_for_offline(cur, clinic_id: int, doctor_id: int, *, today, no
     return cur.fetchone()
 
 
-def book_by_shift_online(patient_id: int, req: BookByShiftRequestModel, has_insurances: bool) -> dict:
-    return _book_by_shift_core(patient_id, req, has_insurances=has_insurances, channel="online")
+def book_by_shift_online(
+    patient_id: int, req: BookByShiftRequestModel, has_insurances: bool,
+    uow: Optional[UnitOfWork] = None,
+) -> dict:
+    return _book_by_shift_core(patient_id, req, has_insurances=has_insurances, channel="online", uow=uow)
 
-def book_by_shift_offline(patient_id: int, req: BookByShiftRequestModel, has_insurances: bool) -> dict:
+def book_by_shift_offline(
+    patient_id: int, req: BookByShiftRequestModel, has_insurances: bool,
+    uow: Optional[UnitOfWork] = None,
+) -> dict:
     if getattr(req, "schedule_id", None):
-        return _book_by_shift_core(patient_id, req, has_insurances=has_insurances, channel="offline")
+        return _book_by_shift_grouped(patient_id, req, has_insurances=has_insurances, channel="offline")
 
     if not getattr(req, "clinic_id", None) or not getattr(req, "doctor_id", None):
         raise HTTPException(status.HTTP_400_BAD_REQUEST, "Thiếu clinic_id hoặc doctor_id")
@@ -228,7 +463,7 @@ def book_by_shift_offline(patient_id: int, req: BookByShiftRequestModel, has_ins
     now_vn = datetime.now(VN_TZ)
     today, now_time = now_vn.date(), now_vn.time()
 
-    conn = db.get_connection()
+    conn = (uow or db).get_connection()
     try:
         with conn:
             cur = conn.cursor()
@@ -242,23 +477,29 @@ def book_by_shift_offline(patient_id: int, req: BookByShiftRequestModel, has_ins
     except Exception as e:
         raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, f"Database error: {e}")
 
-    return _book_by_shift_core(patient_id, req, has_insurances=has_insurances, channel="offline")
+    return _book_by_shift_grouped(patient_id, req, has_insurances=has_insurances, channel="offline")
 
 
-def get_my_appointments(patient_id: int, filters: AppointmentFilterModel):
+def get_my_appointments(
+    patient_id: int, filters: AppointmentFilterModel, uow: Optional[UnitOfWork] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
     where = ["a.patient_id = %s"]
     params = [patient_id]
     if filters.from_date:
-        where.append("DATE(a.estimated_time) >= %s"); params.append(filters.from_date)
+        where.append("a.estimated_time >= %s"); params.append(filters.from_date)
     if filters.to_date:
-        where.append("DATE(a.estimated_time) <= %s"); params.append(filters.to_date)
+        # nửa mở [from, to + 1 ngày) -> range scan trên (patient_id, estimated_time)
+        where.append("a.estimated_time < %s"); params.append(filters.to_date + timedelta(days=1))
     if filters.status_filter is not None:
         where.append("a.status = %s"); params.append(filters.status_filter)
+    if filters.cursor:
+        cond, cond_params = keyset_predicate("a.sort_at", "a.id", filters.cursor)
+        where.append(cond); params.extend(cond_params)
 
     sql = f"""
         SELECT a.id, a.patient_id, a.clinic_id, a.service_id, a.doctor_id, a.schedule_id,
                a.queue_number, a.shift_number, a.estimated_time, a.printed, a.status,
-               a.booking_channel, a.cur_price,
+               a.booking_channel, a.cur_price, a.sort_at,
                s.name AS service_name, s.price AS service_price,
                d.full_name AS doctor_name, c.name AS clinic_name
         FROM appointments a
@@ -266,25 +507,31 @@ def get_my_appointments(patient_id: int, filters: AppointmentFilterModel):
         JOIN doctors  d ON a.doctor_id = d.id
         JOIN clinics  c ON a.clinic_id = c.id
         WHERE {" AND ".join(where)}
-        ORDER BY COALESCE(a.estimated_time, a.created_at) DESC, a.id DESC
+        ORDER BY a.sort_at DESC, a.id DESC
         LIMIT %s OFFSET %s
     """
-    params.extend([filters.limit, filters.offset])
-    return db.query_get(sql, tuple(params))
+    # lấy dư 1 dòng để biết còn trang sau; có cursor thì không dùng offset
+    params.extend([filters.limit + 1, 0 if filters.cursor else filters.offset])
+    rows = (uow or db).query_get(sql, tuple(params))
+    return keyset_page(rows, filters.limit, id_key="id")
 
 def list_patient_appointments_by_payment(
     patient_id: int,
-    filters: AppointmentPaymentFilterModel
-) -> List[Dict[str, Any]]:
+    filters: AppointmentPaymentFilterModel,
+    uow: Optional[UnitOfWork] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
     where = ["a.patient_id = %s"]
     params: list = [patient_id]
 
     if filters.from_date:
-        where.append("DATE(COALESCE(a.estimated_time, a.created_at)) >= %s")
+        where.append("a.sort_at >= %s")
         params.append(filters.from_date)
     if filters.to_date:
-        where.append("DATE(COALESCE(a.estimated_time, a.created_at)) <= %s")
-        params.append(filters.to_date)
+        where.append("a.sort_at < %s")
+        params.append(filters.to_date + timedelta(days=1))
+    if filters.cursor:
+        cond, cond_params = keyset_predicate("a.sort_at", "a.id", filters.cursor)
+        where.append(cond); params.extend(cond_params)
 
     sql = f"""
         SELECT
@@ -304,6 +551,7 @@ def list_patient_appointments_by_payment(
             a.queue_number,
             CAST(a.cur_price AS SIGNED) AS price_vnd,
             a.estimated_time,
+            a.sort_at,
 
             -- Thanh toán (bản ghi mới nhất)
             po.status        AS pay_status,
@@ -314,15 +562,7 @@ def list_patient_appointments_by_payment(
         JOIN services  s ON s.id = a.service_id
         JOIN clinics   c ON c.id = a.clinic_id
         JOIN doctors   d ON d.id = a.doctor_id
-        LEFT JOIN (
-            SELECT t.*
-            FROM payment_orders t
-            JOIN (
-                SELECT appointment_id, MAX(id) AS max_id
-                FROM payment_orders
-                GROUP BY appointment_id
-            ) z ON z.max_id = t.id
-        ) po ON po.appointment_id = a.id
+        LEFT JOIN appointment_latest_payments po ON po.appointment_id = a.id
         WHERE {" AND ".join(where)}
     """
     if filters.pay_status:
@@ -330,16 +570,75 @@ def list_patient_appointments_by_payment(
         params.append(filters.pay_status.upper())
 
     sql += """
-        ORDER BY COALESCE(a.estimated_time, a.created_at) DESC, a.id DESC
+        ORDER BY a.sort_at DESC, a.id DESC
         LIMIT %s OFFSET %s
     """
-    params.extend([filters.limit, filters.offset])
+    params.extend([filters.limit + 1, 0 if filters.cursor else filters.offset])
+
+    rows = (uow or db).query_get(sql, tuple(params))
+    return keyset_page(rows, filters.limit, id_key="appointment_id")
+
+
+def get_doctor_id_of_user(user_id: int) -> int:
+    doc = db.query_one("SELECT id FROM doctors WHERE user_id=%s", (user_id,))
+    if not doc:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Không tìm thấy bác sĩ ứng với user")
+    return int(doc["id"])
 
-    return db.query_get(sql, tuple(params))
+def _doctor_feed_where(doctor_id: int, filters: DoctorAppointmentFeedFilterModel) -> Tuple[List[str], list]:
+    where = ["a.doctor_id = %s"]
+    params: list = [doctor_id]
+    if filters.from_date:
+        where.append("a.created_at >= %s"); params.append(filters.from_date)
+    if filters.to_date:
+        where.append("a.created_at < %s"); params.append(filters.to_date + timedelta(days=1))
+    if filters.since:
+        where.append("a.updated_at >= %s"); params.append(filters.since)
+    return where, params
 
+def doctor_feed_probe(doctor_id: int) -> Dict[str, Any]:
+    """
+    Probe rẻ để làm ETag / watermark: chỉ đọc index (doctor_id, updated_at, status).
+    updated_at chỉ chính xác tới giây -> thêm checksum (id, status, updated_at):
+    2 lần đổi trạng thái trong cùng 1 giây vẫn làm đổi ETag.
+    Sửa giờ ca / tên, SĐT bệnh nhân / tên phòng khám cũng chạm updated_at (trigger, migration 008).
+    """
+    row = db.query_one(
+        """
+        SELECT COUNT(*) AS total, MAX(updated_at) AS max_updated_at,
+               COALESCE(SUM(CRC32(CONCAT_WS('|', id, status, updated_at))), 0) AS checksum
+        FROM appointments
+        WHERE doctor_id = %s
+        """,
+        (doctor_id,),
+    )
+    return row or {"total": 0, "max_updated_at": None, "checksum": 0}
+
+def doctor_feed_etag(doctor_id: int, filters: DoctorAppointmentFeedFilterModel, probe: Dict[str, Any]) -> str:
+    key = "|".join(str(v) for v in (
+        doctor_id, probe["total"], probe["max_updated_at"], probe["checksum"],
+        filters.from_date, filters.to_date, filters.since, filters.limit, filters.cursor,
+    ))
+    return '"' + hashlib.sha1(key.encode()).hexdigest() + '"'
+
+def get_doctor_appointment_feed(
+    doctor_id: int, filters: DoctorAppointmentFeedFilterModel,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Lịch hẹn của bác sĩ, phân trang keyset.
+    - Mặc định: mới tạo trước (created_at DESC, id DESC).
+    - Có since: đồng bộ tăng dần theo thay đổi (updated_at ASC, id ASC) để client nối tiếp an toàn.
+    """
+    where, params = _doctor_feed_where(doctor_id, filters)
+    if filters.since:
+        sort_col, order = "a.updated_at", "a.updated_at ASC, a.id ASC"
+    else:
+        sort_col, order = "a.created_at", "a.created_at DESC, a.id DESC"
+    if filters.cursor:
+        cond, cond_params = keyset_predicate(sort_col, "a.id", filters.cursor, descending=not filters.since)
+        where.append(cond); params.extend(cond_params)
 
-def get_my_appointments_of_doctor_user(user_id: int) -> List[Dict[str, Any]]:
-    sql = """
+    sql = f"""
         SELECT
             a.id AS appointment_id,
             a.patient_id,
@@ -352,23 +651,24 @@ def get_my_appointments_of_doctor_user(user_id: int) -> List[Dict[str, Any]]:
             TIME_FORMAT(ds.start_time, '%%H:%%i') AS start_time,
             TIME_FORMAT(ds.end_time,   '%%H:%%i') AS end_time,
             a.status AS appointment_status,
-            a.created_at
+            a.created_at,
+            a.updated_at,
+            {sort_col} AS sort_at
         FROM appointments a
-        JOIN doctors d              ON d.id = a.doctor_id
         LEFT JOIN doctor_schedules ds ON ds.id = a.schedule_id
         JOIN patients p             ON p.id = a.patient_id
         JOIN clinics c              ON c.id = a.clinic_id
-        WHERE d.user_id = %s
-        ORDER BY a.created_at DESC
+        WHERE {" AND ".join(where)}
+        ORDER BY {order}
+        LIMIT %s
     """
-    return db.query_get(sql, (user_id,))
+    params.append(filters.limit + 1)
+    rows = db.query_get(sql, tuple(params))
+    return keyset_page(rows, filters.limit, id_key="appointment_id")
 
 def update_appointment_status_by_doctor(user_id: int, appointment_id: int, new_status: int) -> dict:
     # Lấy doctor_id từ user_id
-    doc = db.query_one("SELECT id FROM doctors WHERE user_id=%s", (user_id,))
-    if not doc:
-        raise HTTPException(status.HTTP_404_NOT_FOUND, "Không tìm thấy bác sĩ ứng với user")
-    doctor_id = int(doc["id"])
+    doctor_id = get_doctor_id_of_user(user_id)
 
     conn = db.get_connection()
     try:
@@ -377,7 +677,7 @@ def update_appointment_status_by_doctor(user_id: int, appointment_id: int, new_s
 
             # Lock lịch hẹn
             cur.execute("""
-                SELECT id, doctor_id, schedule_id, status
+                SELECT id, doctor_id, clinic_id, schedule_id, status
                 FROM appointments
                 WHERE id=%s
                 FOR UPDATE
@@ -406,19 +706,17 @@ def update_appointment_status_by_doctor(user_id: int, appointment_id: int, new_s
             """, (new_status, appointment_id))
 
             # Nếu hủy -> trả slot
+            shift = None
             if new_status == 4 and appt["schedule_id"]:
                 cur.execute("""
                     UPDATE doctor_schedules
-                    SET booked_patients = GREATEST(booked_patients - 1, 0)
+                    SET booked_patients = GREATEST(booked_patients - 1, 0), capacity_version = capacity_version + 1
                     WHERE id=%s
                 """, (appt["schedule_id"],))
+                cur.execute(_SHIFT_CAPACITY_SQL, (appt["schedule_id"],))
+                shift = cur.fetchone()
 
             conn.commit()
-            return {
-                "message": "Cập nhật trạng thái thành công",
-                "old_status": old_status,
-                "new_status": new_status
-            }
 
     except HTTPException:
         try: conn.rollback()
@@ -429,18 +727,31 @@ def update_appointment_status_by_doctor(user_id: int, appointment_id: int, new_s
         except: pass
         raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Lỗi cơ sở dữ liệu: {e}")
 
+    if new_status == 4 and appt["schedule_id"]:
+        after_commit(seat_engine.seat_returned, appt["schedule_id"])
+        after_commit(_notify_capacity_change, shift)
+    after_commit(queue_board.status_changed, appt["clinic_id"], appointment_id, new_status)
+    return {
+        "message": "Cập nhật trạng thái thành công",
+        "old_status": old_status,
+        "new_status": new_status
+    }
+
 def list_all_appointments_by_payment_admin(
     filters: AppointmentPaymentFilterModel
-) -> List[Dict[str, Any]]:
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
     where = ["1=1"]
     params: list = []
 
     if filters.from_date:
-        where.append("DATE(COALESCE(a.estimated_time, a.created_at)) >= %s")
+        where.append("a.sort_at >= %s")
         params.append(filters.from_date)
     if filters.to_date:
-        where.append("DATE(COALESCE(a.estimated_time, a.created_at)) <= %s")
-        params.append(filters.to_date)
+        where.append("a.sort_at < %s")
+        params.append(filters.to_date + timedelta(days=1))
+    if filters.cursor:
+        cond, cond_params = keyset_predicate("a.sort_at", "a.id", filters.cursor)
+        where.append(cond); params.extend(cond_params)
 
     sql = f"""
         SELECT
@@ -460,6 +771,7 @@ def list_all_appointments_by_payment_admin(
             a.queue_number,
             CAST(a.cur_price AS SIGNED) AS price_vnd,
             a.estimated_time,
+            a.sort_at,
 
             -- Thanh toán (bản ghi mới nhất)
             COALESCE(po.status, 'UNPAID') AS pay_status,
@@ -471,15 +783,7 @@ def list_all_appointments_by_payment_admin(
         JOIN services  s ON s.id = a.service_id
         JOIN clinics   c ON c.id = a.clinic_id
         JOIN doctors   d ON d.id = a.doctor_id
-        LEFT JOIN (
-            SELECT t.*
-            FROM payment_orders t
-            JOIN (
-                SELECT appointment_id, MAX(id) AS max_id
-                FROM payment_orders
-                GROUP BY appointment_id
-            ) z ON z.max_id = t.id
-        ) po ON po.appointment_id = a.id
+        LEFT JOIN appointment_latest_payments po ON po.appointment_id = a.id
         WHERE {" AND ".join(where)}
     """
     if filters.pay_status:
@@ -487,21 +791,22 @@ def list_all_appointments_by_payment_admin(
         params.append(filters.pay_status.upper())
 
     sql += """
-        ORDER BY COALESCE(a.estimated_time, a.created_at) DESC, a.id DESC
+        ORDER BY a.sort_at DESC, a.id DESC
         LIMIT %s OFFSET %s
     """
-    params.extend([filters.limit, filters.offset])
+    params.extend([filters.limit + 1, 0 if filters.cursor else filters.offset])
 
-    return db.query_get(sql, tuple(params))
+    rows = db.query_get(sql, tuple(params))
+    return keyset_page(rows, filters.limit, id_key="appointment_id")
 
 
-def cancel_my_appointment(appointment_id: int, patient_id: int) -> dict:
-    conn = db.get_connection()
+def cancel_my_appointment(appointment_id: int, patient_id: int, uow: Optional[UnitOfWork] = None) -> dict:
+    conn = (uow or db).get_connection()
     try:
         with conn:
             cur = conn.cursor()
             cur.execute(
-                "SELECT id, patient_id, schedule_id, status FROM appointments WHERE id=%s AND patient_id=%s FOR UPDATE",
+                "SELECT id, patient_id, clinic_id, schedule_id, status FROM appointments WHERE id=%s AND patient_id=%s FOR UPDATE",
                 (appointment_id, patient_id),
             )
             appt = cur.fetchone()
@@ -510,14 +815,17 @@ def cancel_my_appointment(appointment_id: int, patient_id: int) -> dict:
             if appt["status"] not in (1,):
                 raise HTTPException(status.HTTP_409_CONFLICT, "Trạng thái hiện tại không cho phép hủy")
 
-            cur.execute("UPDATE appointments SET status=4 WHERE id=%s", (appointment_id,))
+            cur.execute("UPDATE appointments SET status=4, updated_at=NOW() WHERE id=%s", (appointment_id,))
+            shift = None
             if appt["schedule_id"]:
                 cur.execute(
-                    "UPDATE doctor_schedules SET booked_patients = GREATEST(booked_patients - 1, 0) WHERE id=%s",
+                    "UPDATE doctor_schedules SET booked_patients = GREATEST(booked_patients - 1, 0), "
+                    "capacity_version = capacity_version + 1 WHERE id=%s",
                     (appt["schedule_id"],),
                 )
+                cur.execute(_SHIFT_CAPACITY_SQL, (appt["schedule_id"],))
+                shift = cur.fetchone()
             conn.commit()
-            return {"message": "Hủy lịch hẹn thành công"}
     except HTTPException:
         try: conn.rollback()
         except: pass
@@ -527,96 +835,44 @@ def cancel_my_appointment(appointment_id: int, patient_id: int) -> dict:
         except: pass
         raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, f"Lỗi cơ sở dữ liệu: {e}")
 
-UI = {
-    "title":        colors.HexColor("#0F172A"),
-    "muted":        colors.HexColor("#64748B"),
-    "patient_bg":   colors.HexColor("#EAF2FF"),
-    "patient_bd":   colors.HexColor("#D6E3FF"),
-    "exam_bg":      colors.HexColor("#F0FAF4"),
-    "exam_bd":      colors.HexColor("#CDE7D6"),
-    "chip_bg":      colors.HexColor("#E8F5E9"),
-    "chip_bd":      colors.HexColor("#43A047"),
-    "chip_txt":     colors.HexColor("#2E7D32"),
-    "price":        colors.HexColor("#16A34A"),
-    "danger":       colors.HexColor("#EF4444"),
-    "hint_bg":      colors.HexColor("#FFF7D6"),
-    "hint_bd":      colors.HexColor("#FDE68A"),
-    "icon_green":   colors.HexColor("#10B981"),
-}
-
-# fonts
-_FONTS_REGISTERED = False
-def _ensure_fonts():
-    global _FONTS_REGISTERED
-    if _FONTS_REGISTERED: return
-    fonts_dir = Path(__file__).resolve().parents[1] / "fonts"
-    pdfmetrics.registerFont(TTFont("DejaVu",      str(fonts_dir / "DejaVuSans.ttf")))
-    pdfmetrics.registerFont(TTFont("DejaVu-Bold", str(fonts_dir / "DejaVuSans-Bold.ttf")))
-    _FONTS_REGISTERED = True
-
-# helpers
-def _fmt_vnd(n: int | float) -> str:
-    try: n = int(n)
-    except: return str(n)
-    return f"{n:,}".replace(",", ".") + " ₫"
-
-def _qr_reader(payload: str) -> ImageReader:
-    img = qrcode.make(payload)
-    pil = img.get_image() if hasattr(img, "get_image") else img
-    b = BytesIO(); pil.save(b, format="PNG"); b.seek(0)
-    return ImageReader(b)
-
-def _round_rect(cv, x, y_top, w, h, r, fill, stroke, lw=1):
-    cv.setFillColor(fill); cv.setStrokeColor(stroke); cv.setLineWidth(lw)
-    cv.roundRect(x, y_top - h, w, h, r, stroke=1, fill=1)
-
-def _section_header(cv, x, y, text, dot_color):
-    cv.setFillColor(dot_color); cv.circle(x + 2.2*mm, y - 2.6*mm, 1.6*mm, stroke=0, fill=1)
-    cv.setFillColor(UI["title"]); cv.setFont("DejaVu-Bold", 12); cv.drawString(x + 6*mm, y, text)
-
-def _pair(cv, x, y, label, value, label_w, value_w, *, value_bold=False, value_color=None):
-    """
-    Label & value đều căn trái. Giá trị bắt đầu tại:
-        x + max(label_w, measured(label)+gap)
-    -> tránh bị dính khi label dài.
-    """
-    lbl_font, lbl_size, gap = "DejaVu-Bold", 10, 2*mm
-    cv.setFont(lbl_font, lbl_size); cv.setFillColor(UI["title"]); cv.drawString(x, y, label)
-    measured = cv.stringWidth(label, lbl_font, lbl_size)
-    value_x = x + max(label_w, measured + gap)
-    cv.setFont("DejaVu-Bold" if value_bold else "DejaVu", 10)
-    cv.setFillColor(value_color or UI["title"])
-    cv.drawString(value_x, y, str(value))
+    if appt["schedule_id"]:
+        after_commit(seat_engine.seat_returned, appt["schedule_id"])
+        after_commit(_notify_capacity_change, shift)
+    after_commit(queue_board.status_changed, appt["clinic_id"], appointment_id, 4)
+    return {"message": "Hủy lịch hẹn thành công"}
 
 # data
-def _fetch_paid_appointment_for_print(appointment_id: int, patient_id: int) -> Dict[str, Any]:
-    rows = db.query_get(
-        """
-        SELECT
-            a.id, a.patient_id, a.clinic_id, a.service_id, a.doctor_id, a.schedule_id,
-            a.queue_number, a.shift_number, a.estimated_time, a.status, a.cur_price,
-            p.full_name AS patient_name, p.national_id,
-            DATE_FORMAT(p.date_of_birth,'%%Y-%%m-%%d') AS dob,
-            p.gender, p.phone,
-            s.name AS service_name,
-            d.full_name AS doctor_name,
-            c.name AS clinic_name,
-            po.order_code, po.status AS pay_status, po.paid_at, po.qr_code_url
-        FROM appointments a
-        JOIN patients  p ON p.id = a.patient_id
-        JOIN services  s ON s.id = a.service_id
-        JOIN doctors   d ON d.id = a.doctor_id
-        JOIN clinics   c ON c.id = a.clinic_id
-        LEFT JOIN (
-            SELECT t.*
-            FROM payment_orders t
-            JOIN (SELECT appointment_id, MAX(id) AS max_id
-                  FROM payment_orders GROUP BY appointment_id) z ON z.max_id = t.id
-        ) po ON po.appointment_id = a.id
-        WHERE a.id=%s AND a.patient_id=%s
+_PRINT_SELECT_SQL = """
+    SELECT
+        a.id, a.patient_id, a.clinic_id, a.service_id, a.doctor_id, a.schedule_id,
+        a.queue_number, a.shift_number, a.estimated_time, a.status, a.cur_price,
+        p.full_name AS patient_name, p.national_id,
+        DATE_FORMAT(p.date_of_birth,'%%Y-%%m-%%d') AS dob,
+        p.gender, p.phone,
+        s.name AS service_name,
+        d.full_name AS doctor_name,
+        c.name AS clinic_name,
+        po.order_code, po.status AS pay_status, po.paid_at, po.qr_code_url
+    FROM appointments a
+    JOIN patients  p ON p.id = a.patient_id
+    JOIN services  s ON s.id = a.service_id
+    JOIN doctors   d ON d.id = a.doctor_id
+    JOIN clinics   c ON c.id = a.clinic_id
+    LEFT JOIN appointment_latest_payments po ON po.appointment_id = a.id
+"""
+
+TICKET_BATCH_MAX = int(os.getenv("TICKET_BATCH_MAX", "300"))
+
+def _fetch_paid_appointment_for_print(
+    appointment_id: int, patient_id: Optional[int], uow: Optional[UnitOfWork] = None
+) -> Dict[str, Any]:
+    """patient_id=None: bỏ kiểm tra chủ lịch hẹn (chỉ dùng cho render nền)"""
+    rows = (uow or db).query_get(
+        _PRINT_SELECT_SQL + """
+        WHERE a.id=%s AND (%s IS NULL OR a.patient_id=%s)
         LIMIT 1
         """,
-        (appointment_id, patient_id),
+        (appointment_id, patient_id, patient_id),
     )
     if not rows: raise HTTPException(status.HTTP_404_NOT_FOUND, "Không tìm thấy lịch hẹn")
     info = rows[0]
@@ -624,123 +880,92 @@ def _fetch_paid_appointment_for_print(appointment_id: int, patient_id: int) -> D
         raise HTTPException(status.HTTP_409_CONFLICT, "Lịch hẹn chưa thanh toán xong")
     return info
 
-# render
-def generate_visit_ticket_pdf(appointment_id: int, patient_id: int) -> tuple[bytes, str]:
-    _ensure_fonts()
-    data = _fetch_paid_appointment_for_print(appointment_id, patient_id)
-
-    est = data.get("estimated_time")
-    est_str  = est.strftime("%H:%M %d/%m/%Y") if isinstance(est, datetime) else "-"
-    paid_at  = data.get("paid_at")
-    paid_str = paid_at.strftime("%H:%M %d/%m/%Y") if isinstance(paid_at, datetime) else "-"
-
-    buf = BytesIO()
-    cv = canvas.Canvas(buf, pagesize=A4)
-    w, h = A4
-    margin = 16*mm
-    content_w = w - 2*margin
-    y = h - margin
-    row = 6*mm
-
-    # Title
-    cv.setFont("DejaVu-Bold", 18); cv.setFillColor(UI["title"]); cv.drawCentredString(w/2, y, "Hoàn Thành Đăng Ký")
-    y -= 7*mm
-    cv.setFont("DejaVu", 11); cv.setFillColor(UI["muted"]); cv.drawCentredString(w/2, y, "Kiểm tra thông tin và in phiếu khám")
-    y -= 10*mm
-
-    # Card patient
-    card1_h = 42*mm
-    _round_rect(cv, margin, y, content_w, card1_h, 8, UI["patient_bg"], UI["patient_bd"])
-    inner = 9*mm
-    x = margin + inner
-    y1 = y - inner
-    _section_header(cv, x, y1, "Thông Tin Bệnh Nhân", UI["icon_green"])
-    y1 -= 9*mm
-
-    col_w = (content_w - 2*inner) / 2
-    label_w = 24*mm
-    value_w = col_w - label_w - 2*mm
-
-    _pair(cv, x,           y1,           "Họ tên:",     data["patient_name"],            label_w, value_w, value_bold=True)
-    _pair(cv, x,           y1 - row,     "Ngày sinh:",  data.get("dob") or "-",          label_w, value_w)
-    _pair(cv, x,           y1 - 2*row,   "SĐT:",        data.get("phone") or "-",        label_w, value_w)
-
-    x2 = x + col_w
-    _pair(cv, x2,          y1,           "CCCD:",       data.get("national_id") or "-",  label_w, value_w)
-    _pair(cv, x2,          y1 - row,     "Giới tính:",  (data.get("gender") or "-"),     label_w, value_w)
-
-    y = y - card1_h - 7*mm
-
-    # Card exam
-    card2_h = 58*mm
-    _round_rect(cv, margin, y, content_w, card2_h, 8, UI["exam_bg"], UI["exam_bd"])
-    x = margin + inner
-    y2 = y - inner
-    _section_header(cv, x, y2, "Thông Tin Khám", UI["icon_green"])
-    y2 -= 9*mm
-
-    col_w = (content_w - 2*inner) / 2
-    label_w = 26*mm
-    value_w = col_w - label_w - 2*mm
-
-    _pair(cv, x,           y2,           "Dịch vụ:",    data["service_name"],            label_w, value_w)
-    _pair(cv, x,           y2 - row,     "Bác sĩ:",     data["doctor_name"],             label_w, value_w)
-    _pair(cv, x,           y2 - 2*row,   "Giá:",        _fmt_vnd(data["cur_price"]),     label_w, value_w,
-          value_bold=True, value_color=UI["price"])
-
-    x2 = x + col_w
-    _pair(cv, x2,          y2,           "Phòng:",          data["clinic_name"],          label_w, value_w)
-    _pair(cv, x2,          y2 - row,     "Số thứ tự:",      str(data.get("queue_number") or "-"), label_w, value_w, value_bold=True)
-
-    # thời gian dự kiến (đo bề rộng label -> value không dính)
-    cv.setFont("DejaVu-Bold", 10); cv.setFillColor(UI["title"])
-    lbl = "Thời gian khám:"
-    cv.drawString(x2, y2 - 2*row, lbl)
-    value_x = x2 + max(label_w, cv.stringWidth(lbl, "DejaVu-Bold", 10) + 2*mm)
-    cv.setFont("DejaVu-Bold", 10); cv.setFillColor(UI["danger"])
-    cv.drawString(value_x, y2 - 2*row, est_str)
-
-    # chip + thời gian thanh toán (cũng đo bề rộng label)
-    chip_w, chip_h = 36*mm, 8*mm
-    chip_x = x; chip_y_top = y2 - 3*row + 2
-    _round_rect(cv, chip_x, chip_y_top, chip_w, chip_h, 3, UI["chip_bg"], UI["chip_bd"])
-    cv.setFont("DejaVu-Bold", 9); cv.setFillColor(UI["chip_txt"])
-    cv.drawCentredString(chip_x + chip_w/2, chip_y_top - chip_h/2 + 3, "ĐÃ THANH TOÁN")
-
-    cv.setFont("DejaVu-Bold", 10); cv.setFillColor(UI["title"])
-    lbl2 = "Thời gian thanh toán:"
-    cv.drawString(x2, y2 - 3*row, lbl2)
-    value_x2 = x2 + max(label_w, cv.stringWidth(lbl2, "DejaVu-Bold", 10) + 2*mm)
-    cv.setFont("DejaVu", 10); cv.setFillColor(UI["title"])
-    cv.drawString(value_x2, y2 - 3*row, paid_str)
-
-    y = y - card2_h - 8*mm
-
-    # QR
-    qr_payload = f"APPT:{data['id']}|ORDER:{data['order_code']}|PAID_AT:{paid_str}"
-    qr_img = _qr_reader(qr_payload)
-    qr_size = 48*mm
-    cv.drawImage(qr_img, (w - qr_size)/2, y - qr_size, qr_size, qr_size, preserveAspectRatio=True, mask='auto')
-    y -= (qr_size + 7*mm)
-    cv.setFont("DejaVu", 9); cv.setFillColor(UI["muted"])
-    cv.drawCentredString(w/2, y, "Mã QR dùng để check-in tại quầy")
-    y -= 10*mm
-
-    # Hint
-    hint_h = 28*mm
-    _round_rect(cv, margin, y, content_w, hint_h, 6, UI["hint_bg"], UI["hint_bd"])
-    cv.setFont("DejaVu-Bold", 10); cv.setFillColor(UI["title"])
-    cv.drawString(margin + 9*mm, y - 9, "Hướng dẫn:")
-    cv.setFont("DejaVu", 9)
-    for t in [
-        "Vui lòng mang theo phiếu khám tới quầy/triển khai tự động.",
-        "Nếu dùng BHYT, nhớ mang thẻ và giấy tờ liên quan.",
-        "Mọi thắc mắc vui lòng liên hệ quầy hướng dẫn.",
-    ]:
-        y -= 5*mm
-        cv.drawString(margin + 12*mm, y, f"• {t}")
-
-    cv.setTitle(f"PhieuKham-{data['id']}")
-    cv.showPage(); cv.save()
-    pdf_bytes = buf.getvalue(); buf.close()
-    return pdf_bytes, f"phieu_kham_{data['id']}.pdf"
\ No newline at end of file
+# cache
+def _ticket_etag(digest: str, fmt: str) -> str:
+    return f'"{digest}"' if fmt == "pdf" else f'"{digest}.{fmt}"'
+
+def _ticket_filename(appointment_id: int, fmt: str) -> str:
+    return f"phieu_kham_{appointment_id}.{'pdf' if fmt == 'pdf' else 'bin'}"
+
+def visit_ticket_etag(appointment_id: int, patient_id: int, fmt: str = "pdf") -> Optional[str]:
+    """ETag của phiếu đã có trong chỉ mục (không chạm DB); None nếu chưa biết"""
+    hit = ticket_cache.lookup(appointment_id)
+    if hit is None or hit[1] != int(patient_id):
+        return None
+    return _ticket_etag(hit[0], fmt)
+
+async def _cached_ticket(data: Dict[str, Any], since: int, fmt: str = "pdf") -> tuple[bytes, str, str]:
+    """since: ticket_cache.snapshot() lấy trước khi đọc data từ DB"""
+    digest = ticket_digest(data)
+    blob = await run_in_threadpool(ticket_cache.read, digest, fmt)
+    if blob is None:
+        blob = await (render_pool.render(data) if fmt == "pdf" else render_pool.render_escpos(data))
+        await run_in_threadpool(ticket_cache.write, digest, blob, fmt)
+    ticket_cache.remember(data["id"], data["patient_id"], digest, _ticket_filename(data["id"], "pdf"), since)
+    return blob, _ticket_filename(data["id"], fmt), _ticket_etag(digest, fmt)
+
+async def generate_visit_ticket(
+    appointment_id: int, patient_id: int, uow: Optional[UnitOfWork] = None, fmt: str = "pdf"
+) -> tuple[bytes, str, str]:
+    """
+    (nội dung, filename, etag). fmt: "pdf" (A4) | "escpos" (máy in nhiệt 80mm).
+    In lại: đọc theo chỉ mục, không join DB, không render.
+    """
+    hit = ticket_cache.lookup(appointment_id)
+    if hit is not None and hit[1] == int(patient_id):
+        blob = await run_in_threadpool(ticket_cache.read, hit[0], fmt)
+        if blob is not None:
+            return blob, _ticket_filename(appointment_id, fmt), _ticket_etag(hit[0], fmt)
+    since = ticket_cache.snapshot()
+    data = await run_in_threadpool(_fetch_paid_appointment_for_print, appointment_id, patient_id, uow)
+    return await _cached_ticket(data, since, fmt)
+
+async def prerender_visit_ticket(appointment_id: int) -> None:
+    """Gọi nền sau khi đơn chuyển PAID: kiosk in lần đầu đã có sẵn PDF"""
+    since = ticket_cache.snapshot()
+    data = await run_in_threadpool(_fetch_paid_appointment_for_print, appointment_id, None)
+    await _cached_ticket(data, since)
+    ticket_cache.count_prerender()
+
+def list_paid_appointments_for_print(filters: TicketBatchPrintFilterModel) -> List[Dict[str, Any]]:
+    """1 query cho cả lô: lịch hẹn đã thanh toán của phòng khám trong khoảng ngày, theo thứ tự gọi"""
+    to_date = filters.to_date or filters.from_date
+    if to_date < filters.from_date:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "to_date phải >= from_date")
+    where = [
+        "a.clinic_id = %s",
+        "a.estimated_time >= %s", "a.estimated_time < %s",
+        "a.status <> 4",
+        "po.status = 'PAID'", "po.order_code IS NOT NULL",
+    ]
+    params: list = [filters.clinic_id, filters.from_date, to_date + timedelta(days=1)]
+    if filters.schedule_id:
+        where.append("a.schedule_id = %s"); params.append(filters.schedule_id)
+    if filters.doctor_id:
+        where.append("a.doctor_id = %s"); params.append(filters.doctor_id)
+    params.append(TICKET_BATCH_MAX + 1)
+    rows = db.query_get(
+        _PRINT_SELECT_SQL + f"""
+        WHERE {" AND ".join(where)}
+        ORDER BY a.estimated_time, a.queue_number, a.id
+        LIMIT %s
+        """,
+        tuple(params),
+    )
+    if not rows:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Không có lịch hẹn đã thanh toán để in")
+    if len(rows) > TICKET_BATCH_MAX:
+        raise HTTPException(
+            status.HTTP_400_BAD_REQUEST,
+            f"Quá {TICKET_BATCH_MAX} phiếu, vui lòng thu hẹp khoảng ngày hoặc chọn ca",
+        )
+    return rows
+
+async def generate_visit_tickets_batch(filters: TicketBatchPrintFilterModel) -> tuple[str, str, int]:
+    """(đường dẫn PDF tạm, filename, số phiếu). Caller stream file rồi xóa"""
+    rows = await run_in_threadpool(list_paid_appointments_for_print, filters)
+    to_date = filters.to_date or filters.from_date
+    suffix = f"{filters.from_date:%Y%m%d}" + (f"-{to_date:%Y%m%d}" if to_date != filters.from_date else "")
+    title = f"PhieuKham-PK{filters.clinic_id}-{suffix}"
+    path = await render_pool.render_batch(rows, title)
+    return path, f"phieu_kham_pk{filters.clinic_id}_{suffix}.pdf", len(rows)
@@ -0,0 +1,124 @@
+import unicodedata
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+# Phiếu khám cho máy in nhiệt 80mm (ESC/POS). Chạy được trong process render: không import DB.
+#   - Dòng chỉ có ASCII: gửi text thẳng (font máy in, vài byte/dòng).
+#   - Dòng có dấu tiếng Việt: ghép bitmap glyph đã cache thành 1 ảnh raster (GS v 0),
+#     cắt theo bề rộng chữ thay vì cả khổ 576 chấm.
+#   - QR: lệnh QR gốc của máy in (GS ( k), máy tự vẽ -> chỉ gửi payload.
+
+PAPER_DOTS = 576          # 80mm @ 203dpi
+ESC, GS = b"\x1b", b"\x1d"
+INIT = ESC + b"@"
+ALIGN_LEFT, ALIGN_CENTER = ESC + b"a\x00", ESC + b"a\x01"
+BOLD_ON, BOLD_OFF = ESC + b"E\x01", ESC + b"E\x00"
+SIZE_NORMAL, SIZE_DOUBLE, SIZE_QUAD = GS + b"!\x00", GS + b"!\x11", GS + b"!\x33"
+FEED_CUT = GS + b"V\x42\x03"   # đẩy giấy 3 dòng rồi cắt
+
+_FONTS_DIR = Path(__file__).resolve().parents[1] / "fonts"
+
+
+@lru_cache(maxsize=8)
+def _font(size: int, bold: bool) -> ImageFont.FreeTypeFont:
+    name = "DejaVuSans-Bold.ttf" if bold else "DejaVuSans.ttf"
+    return ImageFont.truetype(str(_FONTS_DIR / name), size)
+
+
+@lru_cache(maxsize=4096)
+def _glyph(ch: str, size: int, bold: bool) -> Tuple[int, Image.Image]:
+    """(advance, bitmap 1-bit) của 1 ký tự; dùng lại cho mọi phiếu trong process"""
+    font = _font(size, bold)
+    advance = max(1, round(font.getlength(ch)))
+    ascent, descent = font.getmetrics()
+    img = Image.new("1", (advance, ascent + descent), 1)
+    ImageDraw.Draw(img).text((0, 0), ch, font=font, fill=0)
+    return advance, img
+
+
+def _raster_line(text: str, size: int, bold: bool) -> bytes:
+    """GS v 0: ghép glyph từ cache thành 1 dòng ảnh, bề rộng làm tròn lên bội 8 chấm"""
+    glyphs = [_glyph(ch, size, bold) for ch in text]
+    width = (sum(adv for adv, _ in glyphs) + 7) // 8 * 8
+    ascent, descent = _font(size, bold).getmetrics()
+    line = Image.new("1", (width, ascent + descent), 1)
+    x = 0
+    for adv, img in glyphs:
+        line.paste(img, (x, 0))
+        x += adv
+    # PIL "1": bit 1 = trắng; ESC/POS: bit 1 = chấm đen -> đảo bit
+    data = bytes(b ^ 0xFF for b in line.tobytes())
+    xb, h = width // 8, line.height
+    return GS + b"v0\x00" + bytes((xb & 0xFF, xb >> 8, h & 0xFF, h >> 8)) + data
+
+
+def _wrap(text: str, size: int, bold: bool) -> List[str]:
+    """Ngắt dòng theo từ cho vừa khổ giấy (đo bằng advance của glyph đã cache)"""
+    lines, cur, cur_w = [], "", 0
+    space = _glyph(" ", size, bold)[0]
+    for word in text.split(" "):
+        w = sum(_glyph(ch, size, bold)[0] for ch in word)
+        if cur and cur_w + space + w > PAPER_DOTS:
+            lines.append(cur); cur, cur_w = word, w
+        else:
+            cur, cur_w = (f"{cur} {word}", cur_w + space + w) if cur else (word, w)
+    lines.append(cur)
+    return lines
+
+
+def _line(text: str, *, size: int = 20, bold: bool = False) -> bytes:
+    text = unicodedata.normalize("NFC", str(text))
+    if text.isascii():
+        return (BOLD_ON if bold else b"") + text.encode("ascii") + b"\n" + (BOLD_OFF if bold else b"")
+    return b"".join(_raster_line(part, size, bold) for part in _wrap(text, size, bold))
+
+
+def _qr(payload: str, module: int = 6) -> bytes:
+    data = payload.encode("utf-8")
+    n = len(data) + 3
+    return b"".join([
+        GS + b"(k\x04\x001A2\x00",                           # model 2
+        GS + b"(k\x03\x001C" + bytes((module,)),             # cỡ module (chấm)
+        GS + b"(k\x03\x001E1",                               # mức sửa lỗi M (giống bản PDF)
+        GS + b"(k" + bytes((n & 0xFF, n >> 8)) + b"1P0" + data,
+        GS + b"(k\x03\x001Q0",                               # in
+    ])
+
+
+def _fmt_dt(v) -> str:
+    return v.strftime("%H:%M %d/%m/%Y") if isinstance(v, datetime) else "-"
+
+
+def _fmt_vnd(n) -> str:
+    try: n = int(n)
+    except: return str(n)
+    return f"{n:,}".replace(",", ".") + " VND"
+
+
+def render_visit_ticket_escpos(data: Dict[str, Any]) -> bytes:
+    """Cùng dữ liệu với phiếu PDF (_fetch_paid_appointment_for_print), vài KB"""
+    paid_str = _fmt_dt(data.get("paid_at"))
+    out: List[bytes] = [INIT, ALIGN_CENTER]
+    out.append(_line("PHIẾU KHÁM BỆNH", size=28, bold=True))
+    out.append(_line(data["clinic_name"], size=22, bold=True))
+    out += [b"\n", _line("Số thứ tự"), SIZE_QUAD, BOLD_ON,
+            str(data.get("queue_number") or "-").encode("ascii"), b"\n", BOLD_OFF, SIZE_NORMAL]
+    out += [SIZE_DOUBLE, _fmt_dt(data.get("estimated_time")).encode("ascii"), b"\n", SIZE_NORMAL]
+    out += [b"-" * 48 + b"\n", ALIGN_LEFT]
+    for label, value, bold in (
+        ("Họ tên", data["patient_name"], True),
+        ("Ngày sinh", data.get("dob") or "-", False),
+        ("Dịch vụ", data["service_name"], False),
+        ("Bác sĩ", data["doctor_name"], False),
+        ("Giá", _fmt_vnd(data["cur_price"]), True),
+        ("Thanh toán", paid_str, False),
+    ):
+        out.append(_line(f"{label}: {value}", bold=bold))
+    out += [b"-" * 48 + b"\n", ALIGN_CENTER, _line("ĐÃ THANH TOÁN", size=22, bold=True)]
+    out.append(_qr(f"APPT:{data['id']}|ORDER:{data['order_code']}|PAID_AT:{paid_str}"))
+    out += [_line("Mã QR dùng để check-in tại quầy", size=18), FEED_CUT]
+    return b"".join(out)
@@ -42,6 +42,16 @@ class AppointmentFilterModel(BaseModel):
     status_filter: Optional[int] = Field(None, description="Lọc theo trạng thái (1=confirmed, 4=canceled,...)")
     limit: int = Field(100, ge=1, le=500, description="Số bản ghi tối đa")
     offset: int = Field(0, ge=0, description="Bỏ qua N bản ghi đầu")
+    cursor: Optional[str] = Field(None, description="Token trang tiếp theo (header X-Next-Cursor); có cursor thì bỏ qua offset")
+
+class DoctorAppointmentFeedFilterModel(BaseModel):
+    # cửa sổ ngày theo created_at (optional)
+    from_date: Optional[date] = Field(None, description="Từ ngày tạo lịch hẹn")
+    to_date: Optional[date] = Field(None, description="Đến ngày tạo lịch hẹn")
+    # đồng bộ tăng dần: chỉ lấy lịch hẹn thay đổi từ mốc này (updated_at >= since)
+    since: Optional[datetime] = Field(None, description="Mốc đồng bộ lần trước (header X-Sync-Watermark)")
+    limit: int = Field(100, ge=1, le=500)
+    cursor: Optional[str] = Field(None, description="Token trang tiếp theo (header X-Next-Cursor)")
 
 class AppointmentPaymentFilterModel(BaseModel):
     # lọc theo ngày (optional)
@@ -55,6 +65,15 @@ class AppointmentPaymentFilterModel(BaseModel):
     )
     limit: int = Field(100, ge=1, le=500)
     offset: int = Field(0, ge=0)
+    cursor: Optional[str] = Field(None, description="Token trang tiếp theo (header X-Next-Cursor); có cursor thì bỏ qua offset")
+
+# IN PHIẾU KHÁM THEO LÔ (quầy lễ tân)
+class TicketBatchPrintFilterModel(BaseModel):
+    clinic_id: int = Field(..., ge=1)
+    from_date: date = Field(..., description="Từ ngày khám (theo giờ dự kiến)")
+    to_date: Optional[date] = Field(None, description="Đến ngày khám; bỏ trống = chỉ from_date")
+    schedule_id: Optional[int] = Field(None, ge=1, description="Chỉ in 1 ca")
+    doctor_id: Optional[int] = Field(None, ge=1)
 
 class AppointmentPatientItem(BaseModel):
     appointment_id: int
@@ -0,0 +1,184 @@
+import os
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, Optional
+
+from backend.database.connector import DatabaseConnector
+from backend.realtime.broker import broker
+
+db = DatabaseConnector()
+VN_TZ = timezone(timedelta(hours=7))
+
+WAITING = {0, 1}   # chờ khám
+SERVED = {2, 3}    # đã khám / vắng mặt
+# 4 = đã hủy -> bỏ khỏi bảng
+
+
+def queue_topic(clinic_id: int) -> tuple:
+    return ("queue_board", int(clinic_id))
+
+
+class _ClinicBoard:
+    __slots__ = ("day", "entries", "version")
+
+    def __init__(self, day: date, entries: Dict[int, dict]):
+        self.day = day
+        self.entries = entries      # appointment_id -> entry
+        self.version = 0
+
+
+def _entry(row: dict) -> dict:
+    return {
+        "appointment_id": int(row["id"]),
+        "queue_number": row["queue_number"],
+        "shift_number": row["shift_number"],
+        "estimated_time": row["estimated_time"],
+        "doctor_id": row["doctor_id"],
+        "status": int(row["status"]),
+    }
+
+
+def _public(e: dict) -> dict:
+    out = dict(e)
+    if out["estimated_time"] is not None:
+        out["estimated_time"] = out["estimated_time"].isoformat()
+    return out
+
+
+class QueueBoard:
+    """
+    Bảng gọi số theo phòng khám cho màn hình phòng chờ (trong ngày, giờ VN).
+    - Nạp 1 lần từ appointments khi có người xem; sau đó cập nhật theo đặt lịch/đổi trạng thái/hủy.
+    - Thứ tự gọi: estimated_time, rồi queue_number. now_serving = lượt chờ đầu tiên.
+    - Mỗi thay đổi phát snapshot gọn (now_serving + next N) qua broker, không join lại DB.
+    - Giữ tối đa max_boards bảng (LRU theo lượt xem); bảng của ngày cũ bị bỏ khi nạp bảng mới.
+    """
+
+    def __init__(self, next_count: int = 5, max_boards: int = 500):
+        self.next_count = next_count
+        self.max_boards = max_boards
+        self._boards: "OrderedDict[int, _ClinicBoard]" = OrderedDict()
+        self._writes: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._stats = {"seeds": 0, "updates": 0, "broadcasts": 0, "evictions": 0}
+
+    # ---------- đọc ----------
+
+    def snapshot(self, clinic_id: int) -> dict:
+        clinic_id = int(clinic_id)
+        today = datetime.now(VN_TZ).date()
+        with self._lock:
+            board = self._boards.get(clinic_id)
+            if board is not None and board.day == today:
+                self._boards.move_to_end(clinic_id)
+                return self._render(clinic_id, board)
+        board = self._seed(clinic_id, today)
+        with self._lock:
+            return self._render(clinic_id, board)
+
+    def _seed(self, clinic_id: int, today: date) -> _ClinicBoard:
+        # Có ghi chen giữa lúc đang nạp -> nạp lại (tối đa 3 lần)
+        for _ in range(3):
+            with self._lock:
+                writes_before = self._writes.get(clinic_id, 0)
+            rows = db.query_get(
+                """
+                SELECT id, doctor_id, queue_number, shift_number, estimated_time, status
+                FROM appointments
+                WHERE clinic_id=%s
+                  AND estimated_time >= %s AND estimated_time < %s
+                  AND status IN (0,1,2,3)
+                """,
+                (clinic_id, today, today + timedelta(days=1)),
+            )
+            board = _ClinicBoard(today, {int(r["id"]): _entry(r) for r in rows})
+            with self._lock:
+                self._stats["seeds"] += 1
+                if self._writes.get(clinic_id, 0) == writes_before:
+                    break
+        with self._lock:
+            self._boards[clinic_id] = board
+            self._boards.move_to_end(clinic_id)
+            for cid in [cid for cid, b in self._boards.items() if b.day != today]:
+                del self._boards[cid]
+            while len(self._boards) > self.max_boards:
+                self._boards.popitem(last=False)
+                self._stats["evictions"] += 1
+        return board
+
+    def _render(self, clinic_id: int, board: _ClinicBoard) -> dict:
+        order = lambda e: (e["estimated_time"] or datetime.max, e["queue_number"] or 0)
+        waiting = sorted((e for e in board.entries.values() if e["status"] in WAITING), key=order)
+        served = [e for e in board.entries.values() if e["status"] in SERVED]
+        return {
+            "type": "queue",
+            "clinic_id": clinic_id,
+            "day": str(board.day),
+            "version": board.version,
+            "now_serving": _public(waiting[0]) if waiting else None,
+            "next": [_public(e) for e in waiting[1:1 + self.next_count]],
+            "waiting_count": len(waiting),
+            "served_count": len(served),
+        }
+
+    # ---------- cập nhật (gọi sau commit) ----------
+
+    def appointments_booked(self, rows: Iterable[Optional[dict]]) -> None:
+        today = datetime.now(VN_TZ).date()
+        changed: Dict[int, _ClinicBoard] = {}
+        with self._lock:
+            for row in rows:
+                if not row or not row.get("estimated_time") or row["estimated_time"].date() != today:
+                    continue
+                clinic_id = int(row["clinic_id"])
+                self._writes[clinic_id] = self._writes.get(clinic_id, 0) + 1
+                board = self._boards.get(clinic_id)
+                if board is None or board.day != today:
+                    continue
+                board.entries[int(row["id"])] = _entry(row)
+                changed[clinic_id] = board
+            self._bump(changed)
+        self._broadcast(changed)
+
+    def status_changed(self, clinic_id: int, appointment_id: int, new_status: int) -> None:
+        clinic_id = int(clinic_id)
+        changed: Dict[int, _ClinicBoard] = {}
+        with self._lock:
+            self._writes[clinic_id] = self._writes.get(clinic_id, 0) + 1
+            board = self._boards.get(clinic_id)
+            entry = board.entries.get(int(appointment_id)) if board else None
+            if entry is None:
+                return
+            if int(new_status) in WAITING | SERVED:
+                entry["status"] = int(new_status)
+            else:
+                del board.entries[int(appointment_id)]
+            changed[clinic_id] = board
+            self._bump(changed)
+        self._broadcast(changed)
+
+    def _bump(self, changed: Dict[int, _ClinicBoard]) -> None:
+        for board in changed.values():
+            board.version += 1
+            self._stats["updates"] += 1
+
+    def _broadcast(self, changed: Dict[int, _ClinicBoard]) -> None:
+        for clinic_id, board in changed.items():
+            with self._lock:
+                event = self._render(clinic_id, board)
+                self._stats["broadcasts"] += 1
+            broker.publish(queue_topic(clinic_id), event)
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self._stats)
+            data["clinics"] = len(self._boards)
+            data["entries"] = sum(len(b.entries) for b in self._boards.values())
+        return data
+
+
+queue_board = QueueBoard(
+    next_count=int(os.getenv("QUEUE_BOARD_NEXT", "5")),
+    max_boards=int(os.getenv("QUEUE_BOARD_MAX", "500")),
+)
@@ -1,9 +1,15 @@
-from fastapi import APIRouter, Depends, status, Query, Path, HTTPException, Response
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Depends, status, Query, Path, HTTPException, Response, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.encoders import jsonable_encoder
-from typing import Annotated, List
+import os
+from typing import Annotated, List, Literal, Optional
 from backend.auth.providers.auth_providers import AuthProvider
 from backend.auth.providers.partient_provider import PatientProvider
+from backend.database.unit_of_work import UnitOfWork, get_unit_of_work
+from backend.appointments.queue_board import queue_board, queue_topic
+from backend.clinics.controllers import get_clinic_by_id
+from backend.realtime.broker import broker, sse_stream
 from backend.appointments.models import (
     BookByShiftRequestModel, 
     AppointmentResponseModel,
@@ -13,6 +19,8 @@ from backend.appointments.models import (
     AppointmentPatientItem,
     AppointmentPaymentFilterModel,
     AppointmentAdminPaymentItem,
+    DoctorAppointmentFeedFilterModel,
+    TicketBatchPrintFilterModel,
 )
 from backend.appointments.controllers import (
     book_by_shift_online,
@@ -20,24 +28,69 @@ from backend.appointments.controllers import (
     get_my_appointments,
     cancel_my_appointment,
     update_appointment_status_by_doctor,
-    get_my_appointments_of_doctor_user,
+    get_doctor_id_of_user,
+    doctor_feed_probe,
+    doctor_feed_etag,
+    get_doctor_appointment_feed,
     list_patient_appointments_by_payment,
-    generate_visit_ticket_pdf,
+    generate_visit_ticket,
+    visit_ticket_etag,
+    generate_visit_tickets_batch,
     list_all_appointments_by_payment_admin,
 )
 
 router = APIRouter(prefix="/appointments", tags=["Appointments"])
+ESCPOS_MEDIA_TYPE = "application/vnd.escpos"
 auth_handler = AuthProvider()
 patient_handler = PatientProvider()
 
+
+def _page_response(items, next_cursor):
+    """Body giữ nguyên dạng list; token trang sau trả qua header X-Next-Cursor"""
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return JSONResponse(status_code=status.HTTP_200_OK, content=jsonable_encoder(items), headers=headers)
+
+
+def _unlink_quietly(path: str) -> None:
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def _iter_file(path: str, chunk_size: int = 64 * 1024):
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+
+
+class _TempFileStreamingResponse(StreamingResponse):
+    """
+    Stream file tạm theo từng chunk rồi xóa.
+    Xóa ở mức cả response (không chỉ trong generator): client ngắt trước khi stream bắt đầu
+    hoặc gửi header lỗi thì generator không chạy nhưng file vẫn được dọn.
+    """
+
+    def __init__(self, path: str, **kwargs):
+        self.path = path
+        super().__init__(_iter_file(path), **kwargs)
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            _unlink_quietly(self.path)
+
+
 # API: Đặt lịch khám online (bệnh nhân) - sử dụng lịch theo ca, có thể chọn BHYT
 @router.post("/book-online", response_model=AppointmentResponseModel)
 def api_book_by_shift_online(
     data: BookByShiftRequestModel,
     has_insurances: bool = Query(False, description="BHYT: true/false"),
-    current_user: Annotated[dict, Depends(patient_handler.get_current_patient_user)] = None,
+    current_user: Annotated[dict, Depends(patient_handler.get_current_patient_user_scoped)] = None,
+    uow: Annotated[UnitOfWork, Depends(get_unit_of_work)] = None,
 ):
-    detail = book_by_shift_online(current_user["id"], data, has_insurances)
+    detail = book_by_shift_online(current_user["id"], data, has_insurances, uow)
     return JSONResponse(status_code=status.HTTP_201_CREATED, content=jsonable_encoder(detail))
 
 
@@ -46,9 +99,10 @@ def api_book_by_shift_online(
 def api_book_by_shift_offline(
     data: BookByShiftRequestModel,
     has_insurances: bool = Query(False, description="BHYT: true/false"),
-    current_user: Annotated[dict, Depends(patient_handler.get_current_patient_user)] = None,
+    current_user: Annotated[dict, Depends(patient_handler.get_current_patient_user_scoped)] = None,
+    uow: Annotated[UnitOfWork, Depends(get_unit_of_work)] = None,
 ):
-    detail = book_by_shift_offline(current_user["id"], data, has_insurances)
+    detail = book_by_shift_offline(current_user["id"], data, has_insurances, uow)
     return JSONResponse(status_code=status.HTTP_201_CREATED, content=jsonable_encoder(detail))
 
 
@@ -56,25 +110,32 @@ def api_book_by_shift_offline(
 @router.get("/partient/me", response_model=list[AppointmentResponseModel])
 def api_get_my_appointments(
     filters: AppointmentFilterModel = Depends(),
-    current_user: Annotated[dict, Depends(patient_handler.get_current_patient_user)] = None,
+    current_user: Annotated[dict, Depends(patient_handler.get_current_patient_user_scoped)] = None,
+    uow: Annotated[UnitOfWork, Depends(get_unit_of_work)] = None,
 ):
-    items = get_my_appointments(current_user["id"], filters)
-    return JSONResponse(status_code=status.HTTP_200_OK, content=jsonable_encoder(items))
+    items, next_cursor = get_my_appointments(current_user["id"], filters, uow)
+    return _page_response(items, next_cursor)
 
 
 # API: Lấy danh sách lịch hẹn của bệnh nhân theo trạng thái thanh toán
 @router.get("/patient/payment/me", response_model=List[AppointmentPatientItem])
 def api_patient_my_appointments_payment(
     filters: AppointmentPaymentFilterModel = Depends(),
-    current_user: Annotated[dict, Depends(patient_handler.get_current_patient_user)] = None,
+    current_user: Annotated[dict, Depends(patient_handler.get_current_patient_user_scoped)] = None,
+    uow: Annotated[UnitOfWork, Depends(get_unit_of_work)] = None,
 ):
-    data = list_patient_appointments_by_payment(current_user["id"], filters)
-    return JSONResponse(status_code=status.HTTP_200_OK, content=jsonable_encoder(data))
+    data, next_cursor = list_patient_appointments_by_payment(current_user["id"], filters, uow)
+    return _page_response(data, next_cursor)
 
 
 # API: Lấy danh sách lịch hẹn của bác sĩ đang đăng nhập
+# - Phân trang keyset (X-Next-Cursor), lọc from_date/to_date theo ngày tạo
+# - since = X-Sync-Watermark lần trước -> chỉ trả lịch hẹn thay đổi từ mốc đó
+# - If-None-Match khớp ETag -> 304, không chạy query danh sách
 @router.get("/doctor/me")
 def api_get_my_appointments_for_doctor(
+    request: Request,
+    filters: DoctorAppointmentFeedFilterModel = Depends(),
     current_user = Depends(auth_handler.get_current_doctor_user)
 ):
     user_id = current_user.get("user_id", current_user.get("id")) if isinstance(current_user, dict) \
@@ -82,8 +143,19 @@ def api_get_my_appointments_for_doctor(
     if not user_id:
         raise HTTPException(status_code=401, detail="Token thiếu user_id")
 
-    data = get_my_appointments_of_doctor_user(int(user_id))
-    return JSONResponse(status_code=status.HTTP_200_OK, content=jsonable_encoder(data))
+    doctor_id = get_doctor_id_of_user(int(user_id))
+    probe = doctor_feed_probe(doctor_id)
+    etag = doctor_feed_etag(doctor_id, filters, probe)
+    headers = {"ETag": etag}
+    if probe["max_updated_at"] is not None:
+        headers["X-Sync-Watermark"] = probe["max_updated_at"].isoformat()
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    items, next_cursor = get_doctor_appointment_feed(doctor_id, filters)
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    return JSONResponse(status_code=status.HTTP_200_OK, content=jsonable_encoder(items), headers=headers)
 
 
 # API: Bác sĩ cập nhật trạng thái lịch hẹn (confirmed, completed, cancelled, ...)
@@ -108,29 +180,95 @@ def api_admin_list_appointments_by_payment(
     filters: AppointmentPaymentFilterModel = Depends(),
     current_admin = Depends(auth_handler.get_current_admin_user),
 ):
-    data = list_all_appointments_by_payment_admin(filters)
-    return JSONResponse(status_code=200, content=jsonable_encoder(data))
+    data, next_cursor = list_all_appointments_by_payment_admin(filters)
+    return _page_response(data, next_cursor)
 
 
 # API: Bệnh nhân hủy lịch hẹn của chính mình
 @router.post("/{appointment_id}/cancel", response_model=AppointmentCancelResponse)
 def api_cancel_my_appointment(
     appointment_id: int = Path(..., ge=1),
-    current_user: Annotated[dict, Depends(patient_handler.get_current_patient_user)] = None,
+    current_user: Annotated[dict, Depends(patient_handler.get_current_patient_user_scoped)] = None,
+    uow: Annotated[UnitOfWork, Depends(get_unit_of_work)] = None,
 ):
-    res = cancel_my_appointment(appointment_id, current_user["id"])
+    res = cancel_my_appointment(appointment_id, current_user["id"], uow)
     return JSONResponse(status_code=status.HTTP_200_OK, content=jsonable_encoder(res))
 
 
-# API: Bệnh nhân in phiếu khám (xuất file PDF cho lịch hẹn)
+def _ensure_clinic_exists(clinic_id: int) -> None:
+    # route không cần đăng nhập: chỉ tạo bảng cho phòng khám có thật (tra qua cache danh mục)
+    if get_clinic_by_id(clinic_id) is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Không tìm thấy phòng khám")
+
+
+# API: Bảng gọi số phòng chờ theo phòng khám (snapshot hiện tại)
+@router.get("/queue-board/{clinic_id}")
+def api_queue_board(clinic_id: int = Path(..., ge=1)):
+    _ensure_clinic_exists(clinic_id)
+    data = queue_board.snapshot(clinic_id)
+    return JSONResponse(status_code=status.HTTP_200_OK, content=jsonable_encoder(data))
+
+
+# API: Bảng gọi số phòng chờ - stream SSE (snapshot + mỗi lần đặt lịch/đổi trạng thái/hủy)
+@router.get("/queue-board/{clinic_id}/stream")
+async def api_queue_board_stream(request: Request, clinic_id: int = Path(..., ge=1)):
+    await run_in_threadpool(_ensure_clinic_exists, clinic_id)
+    sub = broker.subscribe(queue_topic(clinic_id))
+    try:
+        snapshot = await run_in_threadpool(queue_board.snapshot, clinic_id)
+    except Exception:
+        sub.close()
+        raise
+    return StreamingResponse(
+        sse_stream(sub, initial=[jsonable_encoder(snapshot)], is_disconnected=request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# API: Bệnh nhân in phiếu khám - PDF A4 (mặc định) hoặc ESC/POS cho máy in nhiệt kiosk
+#      chọn bằng ?format=escpos hoặc header Accept: application/vnd.escpos
 @router.get("/{appointment_id}/print-ticket", response_class=Response)
-def api_print_ticket_pdf(
+async def api_print_ticket_pdf(
     appointment_id: int,
-    current_user = Depends(patient_handler.get_current_patient_user),
+    request: Request,
+    format: Optional[Literal["pdf", "escpos"]] = Query(None, description="pdf | escpos"),
+    current_user = Depends(patient_handler.get_current_patient_user_scoped),
+    uow: UnitOfWork = Depends(get_unit_of_work),
 ):
-    pdf_bytes, filename = generate_visit_ticket_pdf(appointment_id, current_user["id"])
+    fmt = format or ("escpos" if ESCPOS_MEDIA_TYPE in request.headers.get("accept", "") else "pdf")
+    media_type = ESCPOS_MEDIA_TYPE if fmt == "escpos" else "application/pdf"
+
+    # kiosk in lại cùng phiếu -> 304 theo ETag, không đọc DB/PDF
+    etag = visit_ticket_etag(appointment_id, current_user["id"], fmt)
+    if etag is not None and request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag, "Vary": "Accept"})
+
+    content, filename, etag = await generate_visit_ticket(appointment_id, current_user["id"], uow, fmt)
     return Response(
-        content=pdf_bytes,
-        media_type="application/pdf",
-        headers={"Content-Disposition": f'inline; filename="{filename}"'}
+        content=content,
+        media_type=media_type,
+        headers={"Content-Disposition": f'inline; filename="{filename}"', "ETag": etag, "Vary": "Accept"}
     )
+
+
+# API: Admin/lễ tân in phiếu khám theo lô (cả ca/buổi) - 1 file PDF nhiều trang
+@router.get("/admin/print-tickets", response_class=Response)
+async def api_admin_print_tickets_batch(
+    filters: TicketBatchPrintFilterModel = Depends(),
+    current_admin = Depends(auth_handler.get_current_admin_user),
+):
+    path, filename, count = await generate_visit_tickets_batch(filters)
+    try:
+        return _TempFileStreamingResponse(
+            path,
+            media_type="application/pdf",
+            headers={
+                "Content-Disposition": f'inline; filename="{filename}"',
+                "Content-Length": str(os.path.getsize(path)),
+                "X-Ticket-Count": str(count),
+            },
+        )
+    except BaseException:
+        _unlink_quietly(path)
+        raise
@@ -0,0 +1,166 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+
+from fastapi import HTTPException, status
+from backend.database.connector import DatabaseConnector
+
+db = DatabaseConnector()
+
+
+class _SeatCounter:
+    __slots__ = ("remaining", "inflight", "loaded_at", "used_at")
+
+    def __init__(self):
+        self.remaining: Optional[int] = None  # None = chưa biết / ca không hợp lệ -> không chặn
+        self.inflight = 0
+        self.loaded_at = 0.0
+        self.used_at = time.monotonic()
+
+
+class SeatReservationEngine:
+    """
+    Bộ đếm chỗ trống theo ca (doctor_schedules) trong bộ nhớ process.
+    - Mỗi request đặt lịch phải lấy 1 "token" trước khi vào transaction khóa ca.
+    - Hết chỗ (remaining <= 0) -> trả 409 ngay, không chạm DB.
+      Token đang giữ (inflight) KHÔNG tính là chỗ đã mất: request giữ chỗ cuối có thể thất bại
+      (trùng lịch, ca đã qua, lỗi DB) -> request vượt số chỗ vẫn vào xếp hàng ở khóa ca, DB quyết định.
+    - DB vẫn là nguồn sự thật: bộ đếm được đối soát lại theo lô (1 query cho mọi ca cũ)
+      sau mỗi `reconcile_interval` giây, và được cập nhật theo giá trị đọc dưới khóa ca.
+    Giới hạn: hủy lịch ở worker khác chỉ được thấy sau tối đa `reconcile_interval` giây;
+    trong khoảng đó worker này có thể trả 409 cho chỗ vừa được trả. Không bao giờ đặt quá chỗ.
+    """
+
+    def __init__(self, reconcile_interval: float = 5.0, idle_ttl: float = 3600.0):
+        self.reconcile_interval = reconcile_interval
+        self.idle_ttl = idle_ttl
+        self._counters: Dict[int, _SeatCounter] = {}
+        self._lock = threading.Lock()
+        self._stats = {"admitted": 0, "rejected": 0, "reconciles": 0, "reconciled_rows": 0}
+
+    # ---------- admission ----------
+
+    def try_acquire(self, schedule_id: int) -> bool:
+        schedule_id = int(schedule_id)
+        now = time.monotonic()
+        with self._lock:
+            counter = self._counters.get(schedule_id)
+            stale = counter is None or now - counter.loaded_at > self.reconcile_interval
+        if stale:
+            self.reconcile(extra_ids=[schedule_id])
+
+        with self._lock:
+            counter = self._counters.setdefault(schedule_id, _SeatCounter())
+            counter.used_at = now
+            if counter.remaining is not None and counter.remaining <= 0:
+                self._stats["rejected"] += 1
+                return False
+            counter.inflight += 1
+            self._stats["admitted"] += 1
+            return True
+
+    def commit(self, schedule_id: int, seats: int = 1) -> None:
+        """Đặt lịch thành công: token đã dùng -> giảm chỗ trống"""
+        with self._lock:
+            counter = self._counters.get(int(schedule_id))
+            if counter is None:
+                return
+            counter.inflight = max(counter.inflight - seats, 0)
+            if counter.remaining is not None:
+                counter.remaining = max(counter.remaining - seats, 0)
+
+    def release(self, schedule_id: int, seats: int = 1) -> None:
+        """Đặt lịch thất bại: trả token, chỗ trống không đổi"""
+        with self._lock:
+            counter = self._counters.get(int(schedule_id))
+            if counter is not None:
+                counter.inflight = max(counter.inflight - seats, 0)
+
+    @contextmanager
+    def reserve(self, schedule_id: int):
+        if not self.try_acquire(schedule_id):
+            raise HTTPException(status.HTTP_409_CONFLICT, "Ca đã hết chỗ")
+        try:
+            yield
+        except BaseException:
+            self.release(schedule_id)
+            raise
+        else:
+            self.commit(schedule_id)
+
+    # ---------- đồng bộ với DB ----------
+
+    def observe(self, schedule_id: int, max_patients: int, booked_patients: int) -> None:
+        """Cập nhật theo giá trị vừa đọc dưới khóa ca (chính xác tại thời điểm đó)"""
+        with self._lock:
+            counter = self._counters.setdefault(int(schedule_id), _SeatCounter())
+            counter.remaining = max(int(max_patients) - int(booked_patients), 0)
+            counter.loaded_at = time.monotonic()
+
+    def seat_returned(self, schedule_id: int, seats: int = 1) -> None:
+        """Hủy lịch -> trả chỗ"""
+        with self._lock:
+            counter = self._counters.get(int(schedule_id))
+            if counter is not None and counter.remaining is not None:
+                counter.remaining += seats
+
+    def invalidate(self, schedule_ids: Iterable[int]) -> None:
+        """Ca bị sửa/xóa -> lần sau đọc lại từ DB"""
+        with self._lock:
+            for sid in schedule_ids:
+                counter = self._counters.get(int(sid))
+                if counter is not None:
+                    counter.loaded_at = 0.0
+
+    def reconcile(self, extra_ids: Iterable[int] = ()) -> None:
+        """Đối soát theo lô: 1 query cho mọi ca đã quá reconcile_interval (+ extra_ids)"""
+        now = time.monotonic()
+        with self._lock:
+            for sid in [s for s, c in self._counters.items()
+                        if c.inflight == 0 and now - c.used_at > self.idle_ttl]:
+                del self._counters[sid]
+            ids: List[int] = [s for s, c in self._counters.items()
+                              if now - c.loaded_at > self.reconcile_interval]
+        ids = sorted(set(ids) | {int(s) for s in extra_ids})
+        if not ids:
+            return
+
+        placeholders = ",".join(["%s"] * len(ids))
+        rows = db.query_get(
+            f"""
+            SELECT id, max_patients, booked_patients, status
+            FROM doctor_schedules
+            WHERE id IN ({placeholders})
+            """,
+            tuple(ids),
+        )
+        by_id = {int(r["id"]): r for r in rows}
+
+        loaded_at = time.monotonic()
+        with self._lock:
+            for sid in ids:
+                counter = self._counters.setdefault(sid, _SeatCounter())
+                r = by_id.get(sid)
+                if r is None or int(r["status"]) != 1:
+                    # ca không tồn tại/không mở: để transaction trả lỗi chuẩn (404)
+                    counter.remaining = None
+                else:
+                    counter.remaining = max(int(r["max_patients"]) - int(r["booked_patients"]), 0)
+                counter.loaded_at = loaded_at
+            self._stats["reconciles"] += 1
+            self._stats["reconciled_rows"] += len(ids)
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self._stats)
+            data["schedules_tracked"] = len(self._counters)
+            data["inflight"] = sum(c.inflight for c in self._counters.values())
+            data["reconcile_interval_seconds"] = self.reconcile_interval
+        return data
+
+
+seat_engine = SeatReservationEngine(
+    reconcile_interval=float(os.getenv("SEAT_RECONCILE_INTERVAL", "5")),
+)
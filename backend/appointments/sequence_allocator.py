@@ -0,0 +1,107 @@
+import heapq
+import os
+import threading
+from datetime import date
+from typing import Dict, Hashable, Iterable, List
+
+from fastapi import HTTPException, status
+
+
+class _Sequence:
+    __slots__ = ("available",)
+
+    def __init__(self):
+        self.available: List[int] = []  # heap: số còn trong block + số trả lại (ưu tiên số nhỏ)
+
+
+class SequenceAllocator:
+    """
+    Cấp STT toàn ngày theo clinic (clinic_daily_counters) theo block thay vì khóa counter mỗi lần đặt lịch.
+    - Hết số -> giữ trước 1 block bằng 1 transaction ngắn trên chính connection đặt lịch
+      (gọi trước khi khóa ca, không mượn thêm connection từ pool).
+    - Số đã cấp mà đặt lịch thất bại được trả lại và cấp lại trước (lấp khoảng trống).
+    - Số còn dư khi qua ngày được ghi nhận là khoảng trống.
+    STT trong ca (shift_number) quyết định giờ khám dự kiến nên KHÔNG cấp ở đây:
+    lấy từ doctor_shift_counters trong transaction đang khóa ca.
+    """
+
+    def __init__(self, block_size: int = 20):
+        self.block_size = block_size
+        self._queues: Dict[Hashable, _Sequence] = {}
+        self._lock = threading.Lock()
+        self._stats = {"blocks_reserved": 0, "numbers_reserved": 0, "numbers_issued": 0,
+                       "numbers_returned": 0, "gaps_abandoned": 0}
+
+    # ---------- API ----------
+
+    def take_queue_numbers(self, clinic_id: int, day: date, n: int, conn) -> List[int]:
+        """conn: connection của request đặt lịch, chưa mở transaction (block được commit ngay)"""
+        key = (int(clinic_id), day)
+        self._evict_old_days(day)
+        while True:
+            with self._lock:
+                seq = self._queues.setdefault(key, _Sequence())
+                if len(seq.available) >= n:
+                    numbers = [heapq.heappop(seq.available) for _ in range(n)]
+                    self._stats["numbers_issued"] += n
+                    return numbers
+                size = max(n - len(seq.available), self.block_size)
+
+            last = self._reserve_queue_block(conn, key, size)  # transaction ngắn, ngoài lock
+            with self._lock:
+                seq = self._queues.setdefault(key, _Sequence())
+                for num in range(last - size + 1, last + 1):
+                    heapq.heappush(seq.available, num)
+                self._stats["blocks_reserved"] += 1
+                self._stats["numbers_reserved"] += size
+
+    def give_back_queue_numbers(self, clinic_id: int, day: date, numbers: Iterable[int]) -> None:
+        with self._lock:
+            seq = self._queues.setdefault((int(clinic_id), day), _Sequence())
+            for num in numbers:
+                heapq.heappush(seq.available, int(num))
+                self._stats["numbers_returned"] += 1
+
+    # ---------- nội bộ ----------
+
+    def _evict_old_days(self, today: date) -> None:
+        with self._lock:
+            for key in [k for k in self._queues if k[1] < today]:
+                self._stats["gaps_abandoned"] += len(self._queues.pop(key).available)
+
+    def _reserve_queue_block(self, conn, key, size: int) -> int:
+        clinic_id, day = key
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    INSERT INTO clinic_daily_counters (clinic_id, counter_date, last_number)
+                    VALUES (%s, %s, %s)
+                    ON DUPLICATE KEY UPDATE last_number = last_number + %s
+                    """,
+                    (clinic_id, day, size, size),
+                )
+                cur.execute(
+                    "SELECT last_number FROM clinic_daily_counters WHERE clinic_id=%s AND counter_date=%s",
+                    (clinic_id, day),
+                )
+                last = int(cur.fetchone()["last_number"])
+            conn.commit()
+            return last
+        except Exception as e:
+            try: conn.rollback()
+            except: pass
+            raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, f"Database error: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self._stats)
+            data["block_size"] = self.block_size
+            data["queue_sequences"] = len(self._queues)
+            data["numbers_available"] = sum(len(s.available) for s in self._queues.values())
+        return data
+
+
+sequence_allocator = SequenceAllocator(
+    block_size=int(os.getenv("SEQUENCE_BLOCK_SIZE", "20")),
+)
@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from backend.appointments.tickets import TICKET_QR_MODE, TICKET_TEMPLATE_VERSION
+from backend.database.cache import TTLCache
+
+
+def ticket_digest(data: Dict[str, Any]) -> str:
+    """Địa chỉ nội dung: hash của dữ liệu in + phiên bản layout/kiểu QR (gồm cả trạng thái thanh toán)"""
+    raw = json.dumps(data, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(f"{TICKET_TEMPLATE_VERSION}|{TICKET_QR_MODE}|{raw}".encode()).hexdigest()
+
+
+class TicketCache:
+    """
+    Cache PDF phiếu khám theo địa chỉ nội dung (digest = ticket_digest(data)).
+    - Nội dung: bộ nhớ (LRU) + đĩa (dir/ab/abcd....pdf|.escpos), ghi nguyên tử nên nhiều worker dùng chung được.
+    - Chỉ mục appointment_id -> (digest, patient_id, filename): lần in lại không cần join DB.
+      Chỉ mục mất khi restart thì lần đầu join lại rồi đọc file theo digest (không render lại).
+    - Dữ liệu in đổi (sửa thông tin bệnh nhân...) -> bỏ chỉ mục; TTL chỉ mục là lưới an toàn.
+    - remember() mang mốc snapshot() lấy trước khi đọc DB: có forget chen giữa (cùng lịch hẹn/bệnh nhân)
+      thì bỏ qua, không ghi lại dữ liệu cũ vào chỉ mục.
+    - Chỉ mục theo bệnh nhân được tỉa theo các lịch hẹn còn trong chỉ mục chính khi vượt ngưỡng.
+    """
+
+    def __init__(self, directory: Optional[str], maxsize: int = 500, index_ttl: float = 86400.0,
+                 forget_window: float = 600.0):
+        self.directory = Path(directory) if directory else None
+        self._blobs = TTLCache(maxsize=maxsize, ttl=index_ttl)
+        self._index = TTLCache(maxsize=maxsize * 20, ttl=index_ttl)
+        self._by_patient: Dict[int, set] = {}
+        self._by_patient_limit = 1024
+        # ("appointment", id) | ("patient", id) -> mốc forget; chỉ cần sống lâu hơn 1 lượt đọc DB + render
+        self._forgotten = TTLCache(maxsize=maxsize * 20, ttl=forget_window)
+        self._forget_seq = 0
+        self._lock = threading.Lock()
+        self._stats = {"renders": 0, "disk_hits": 0, "disk_writes": 0, "prerenders": 0, "stale_remembers": 0}
+
+    # ---------- chỉ mục ----------
+
+    def lookup(self, appointment_id: int) -> Optional[Tuple[str, int, str]]:
+        return self._index.get(int(appointment_id))
+
+    def snapshot(self) -> int:
+        """Mốc lấy TRƯỚC khi đọc dữ liệu in từ DB, truyền lại cho remember()"""
+        with self._lock:
+            return self._forget_seq
+
+    def remember(self, appointment_id: int, patient_id: int, digest: str, filename: str, since: int) -> None:
+        appointment_id, patient_id = int(appointment_id), int(patient_id)
+        with self._lock:
+            if any(self._forgotten.peek(k, -1) > since
+                   for k in (("appointment", appointment_id), ("patient", patient_id))):
+                self._stats["stale_remembers"] += 1
+                return
+            self._index.set(appointment_id, (digest, patient_id, filename))
+            self._by_patient.setdefault(patient_id, set()).add(appointment_id)
+            if len(self._by_patient) > self._by_patient_limit:
+                self._prune_by_patient()
+
+    def forget(self, appointment_ids: Iterable[int]) -> None:
+        with self._lock:
+            self._forget_seq += 1
+            for appointment_id in appointment_ids:
+                self._forgotten.set(("appointment", int(appointment_id)), self._forget_seq)
+                hit = self._index.peek(int(appointment_id))
+                self._index.pop(int(appointment_id))
+                if hit is not None and hit[1] in self._by_patient:
+                    self._by_patient[hit[1]].discard(int(appointment_id))
+
+    def forget_patient(self, patient_id: int) -> None:
+        with self._lock:
+            self._forget_seq += 1
+            self._forgotten.set(("patient", int(patient_id)), self._forget_seq)
+            for appointment_id in self._by_patient.pop(int(patient_id), set()):
+                self._index.pop(appointment_id)
+
+    def _prune_by_patient(self) -> None:
+        """Bỏ lịch hẹn đã hết TTL/bị LRU đẩy khỏi chỉ mục chính (gọi khi giữ self._lock, chi phí chia đều)"""
+        pruned: Dict[int, set] = {}
+        for patient_id, ids in self._by_patient.items():
+            live = {aid for aid in ids if (self._index.peek(aid) or (None, None))[1] == patient_id}
+            if live:
+                pruned[patient_id] = live
+        self._by_patient = pruned
+        self._by_patient_limit = max(1024, 2 * len(self._by_patient))
+
+    # ---------- nội dung ----------
+
+    def _path(self, digest: str, kind: str) -> Path:
+        return self.directory / digest[:2] / f"{digest}.{kind}"
+
+    def read(self, digest: str, kind: str = "pdf") -> Optional[bytes]:
+        """kind: "pdf" | "escpos" (cùng digest dữ liệu, khác định dạng)"""
+        blob = self._blobs.get((digest, kind))
+        if blob is not None or self.directory is None:
+            return blob
+        try:
+            blob = self._path(digest, kind).read_bytes()
+        except OSError:
+            return None
+        self._blobs.set((digest, kind), blob)
+        with self._lock:
+            self._stats["disk_hits"] += 1
+        return blob
+
+    def write(self, digest: str, blob: bytes, kind: str = "pdf") -> None:
+        self._blobs.set((digest, kind), blob)
+        with self._lock:
+            self._stats["renders"] += 1
+        if self.directory is None:
+            return
+        path = self._path(digest, kind)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(blob)
+            os.replace(tmp, path)
+        except OSError:
+            # đĩa lỗi/đầy: vẫn phục vụ từ bộ nhớ
+            return
+        with self._lock:
+            self._stats["disk_writes"] += 1
+
+    def count_prerender(self) -> None:
+        with self._lock:
+            self._stats["prerenders"] += 1
+
+    def stats(self) -> dict:
+        data = {"blobs": self._blobs.stats(), "index": self._index.stats()}
+        with self._lock:
+            data.update(self._stats)
+            data["indexed_patients"] = len(self._by_patient)
+        data["directory"] = str(self.directory) if self.directory else None
+        return data
+
+
+ticket_cache = TicketCache(
+    directory=os.getenv("TICKET_CACHE_DIR", os.path.join(tempfile.gettempdir(), "visit_tickets")) or None,
+    maxsize=int(os.getenv("TICKET_CACHE_SIZE", "500")),
+    index_ttl=float(os.getenv("TICKET_CACHE_TTL", "86400")),
+)
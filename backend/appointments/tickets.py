@@ -0,0 +1,366 @@
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from functools import lru_cache
+from io import BytesIO
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import qrcode
+from fastapi import HTTPException, status
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+from backend.appointments.escpos import render_visit_ticket_escpos
+
+# Module này chạy được trong process render riêng: không import DB/controller.
+
+# Đổi khi sửa layout phiếu khám -> digest mới, PDF cache cũ tự bỏ
+TICKET_TEMPLATE_VERSION = "2"
+# QR: "vector" (path, mặc định) | "raster" (PNG qua Pillow như trước)
+TICKET_QR_MODE = os.getenv("TICKET_QR_MODE", "vector").lower()
+
+UI = {
+    "title":        colors.HexColor("#0F172A"),
+    "muted":        colors.HexColor("#64748B"),
+    "patient_bg":   colors.HexColor("#EAF2FF"),
+    "patient_bd":   colors.HexColor("#D6E3FF"),
+    "exam_bg":      colors.HexColor("#F0FAF4"),
+    "exam_bd":      colors.HexColor("#CDE7D6"),
+    "chip_bg":      colors.HexColor("#E8F5E9"),
+    "chip_bd":      colors.HexColor("#43A047"),
+    "chip_txt":     colors.HexColor("#2E7D32"),
+    "price":        colors.HexColor("#16A34A"),
+    "danger":       colors.HexColor("#EF4444"),
+    "hint_bg":      colors.HexColor("#FFF7D6"),
+    "hint_bd":      colors.HexColor("#FDE68A"),
+    "icon_green":   colors.HexColor("#10B981"),
+}
+
+# fonts
+_FONTS_REGISTERED = False
+def _ensure_fonts():
+    global _FONTS_REGISTERED
+    if _FONTS_REGISTERED: return
+    fonts_dir = Path(__file__).resolve().parents[1] / "fonts"
+    pdfmetrics.registerFont(TTFont("DejaVu",      str(fonts_dir / "DejaVuSans.ttf")))
+    pdfmetrics.registerFont(TTFont("DejaVu-Bold", str(fonts_dir / "DejaVuSans-Bold.ttf")))
+    _FONTS_REGISTERED = True
+
+# helpers
+def _fmt_vnd(n: int | float) -> str:
+    try: n = int(n)
+    except: return str(n)
+    return f"{n:,}".replace(",", ".") + " ₫"
+
+def _qr_reader(payload: str) -> ImageReader:
+    img = qrcode.make(payload)
+    pil = img.get_image() if hasattr(img, "get_image") else img
+    b = BytesIO(); pil.save(b, format="PNG"); b.seek(0)
+    return ImageReader(b)
+
+@lru_cache(maxsize=int(os.getenv("TICKET_QR_CACHE_SIZE", "1024")))
+def _qr_runs(payload: str) -> tuple:
+    """
+    Ma trận QR (cùng thông số qrcode.make: mức M, viền 4) dưới dạng các đoạn đen liền nhau
+    theo hàng: (n_modules, ((row, col, length), ...)). In lại cùng payload -> không encode lại.
+    """
+    qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M, border=4)
+    qr.add_data(payload)
+    qr.make(fit=True)
+    matrix = qr.get_matrix()
+    runs = []
+    for r, line in enumerate(matrix):
+        c, n = 0, len(line)
+        while c < n:
+            if line[c]:
+                start = c
+                while c < n and line[c]:
+                    c += 1
+                runs.append((r, start, c - start))
+            else:
+                c += 1
+    return len(matrix), tuple(runs)
+
+def _draw_qr_vector(cv, payload: str, x: float, y: float, size: float) -> None:
+    """Vẽ QR thành 1 path vector (không PNG/ImageReader); sắc nét ở mọi độ phân giải máy in"""
+    n, runs = _qr_runs(payload)
+    cell = size / n
+    path = cv.beginPath()
+    for r, c, length in runs:
+        path.rect(x + c * cell, y + size - (r + 1) * cell, length * cell, cell)
+    cv.setFillColor(colors.black)
+    cv.drawPath(path, stroke=0, fill=1)
+
+def _round_rect(cv, x, y_top, w, h, r, fill, stroke, lw=1):
+    cv.setFillColor(fill); cv.setStrokeColor(stroke); cv.setLineWidth(lw)
+    cv.roundRect(x, y_top - h, w, h, r, stroke=1, fill=1)
+
+def _section_header(cv, x, y, text, dot_color):
+    cv.setFillColor(dot_color); cv.circle(x + 2.2*mm, y - 2.6*mm, 1.6*mm, stroke=0, fill=1)
+    cv.setFillColor(UI["title"]); cv.setFont("DejaVu-Bold", 12); cv.drawString(x + 6*mm, y, text)
+
+def _label(cv, x, y, label):
+    cv.setFont("DejaVu-Bold", 10); cv.setFillColor(UI["title"]); cv.drawString(x, y, label)
+
+def _value_x(x, label, label_w):
+    """
+    Label & value đều căn trái. Giá trị bắt đầu tại:
+        x + max(label_w, measured(label)+gap)
+    -> tránh bị dính khi label dài.
+    """
+    return x + max(label_w, pdfmetrics.stringWidth(label, "DejaVu-Bold", 10) + 2*mm)
+
+# layout: phần tĩnh (tiêu đề, 2 card, header, label, chip, hộp hướng dẫn) giống nhau mọi phiếu
+_STATIC_FORM = "visit_ticket_static"
+_HINTS = [
+    "Vui lòng mang theo phiếu khám tới quầy/triển khai tự động.",
+    "Nếu dùng BHYT, nhớ mang thẻ và giấy tờ liên quan.",
+    "Mọi thắc mắc vui lòng liên hệ quầy hướng dẫn.",
+]
+
+def _fmt_dt(v) -> str:
+    return v.strftime("%H:%M %d/%m/%Y") if isinstance(v, datetime) else "-"
+
+# (label, cột, dòng, card, lấy giá trị, đậm, màu)
+_FIELDS = [
+    ("Họ tên:",              0, 0, 1, lambda d: d["patient_name"],                  True,  None),
+    ("Ngày sinh:",           0, 1, 1, lambda d: d.get("dob") or "-",                False, None),
+    ("SĐT:",                 0, 2, 1, lambda d: d.get("phone") or "-",              False, None),
+    ("CCCD:",                1, 0, 1, lambda d: d.get("national_id") or "-",        False, None),
+    ("Giới tính:",           1, 1, 1, lambda d: d.get("gender") or "-",             False, None),
+    ("Dịch vụ:",             0, 0, 2, lambda d: d["service_name"],                  False, None),
+    ("Bác sĩ:",              0, 1, 2, lambda d: d["doctor_name"],                   False, None),
+    ("Giá:",                 0, 2, 2, lambda d: _fmt_vnd(d["cur_price"]),           True,  "price"),
+    ("Phòng:",               1, 0, 2, lambda d: d["clinic_name"],                   False, None),
+    ("Số thứ tự:",           1, 1, 2, lambda d: str(d.get("queue_number") or "-"),  True,  None),
+    ("Thời gian khám:",      1, 2, 2, lambda d: _fmt_dt(d.get("estimated_time")),   True,  "danger"),
+    ("Thời gian thanh toán:", 1, 3, 2, lambda d: _fmt_dt(d.get("paid_at")),         False, None),
+]
+
+@lru_cache(maxsize=1)
+def _layout() -> Dict[str, Any]:
+    """Tọa độ cố định của phiếu (tính 1 lần/process, cần font đã đăng ký để đo label)"""
+    w, h = A4
+    margin, inner, row = 16*mm, 9*mm, 6*mm
+    content_w = w - 2*margin
+    col_w = (content_w - 2*inner) / 2
+    x = margin + inner
+    card1_top = h - margin - 17*mm
+    card2_top = card1_top - 42*mm - 7*mm
+    qr_top = card2_top - 58*mm - 8*mm
+    qr_size = 48*mm
+    hint_top = qr_top - qr_size - 17*mm
+    header_y = {1: card1_top - inner, 2: card2_top - inner}
+    first_row = {1: header_y[1] - 9*mm, 2: header_y[2] - 9*mm}
+    label_w = {1: 24*mm, 2: 26*mm}
+    fields = []
+    for label, col, line, card, value, bold, color in _FIELDS:
+        fx = x + col * col_w
+        fy = first_row[card] - line * row
+        fields.append((label, fx, fy, _value_x(fx, label, label_w[card]), value, bold, color))
+    return {
+        "w": w, "h": h, "margin": margin, "content_w": content_w, "x": x,
+        "card1_top": card1_top, "card2_top": card2_top, "header_y": header_y,
+        "chip": (x, first_row[2] - 3*row + 2, 36*mm, 8*mm),
+        "qr": ((w - qr_size) / 2, qr_top - qr_size, qr_size),
+        "hint_top": hint_top, "fields": fields,
+    }
+
+def _draw_static_layer(cv) -> None:
+    L = _layout()
+    w, margin, content_w = L["w"], L["margin"], L["content_w"]
+    y = L["h"] - margin
+
+    # Title
+    cv.setFont("DejaVu-Bold", 18); cv.setFillColor(UI["title"]); cv.drawCentredString(w/2, y, "Hoàn Thành Đăng Ký")
+    cv.setFont("DejaVu", 11); cv.setFillColor(UI["muted"]); cv.drawCentredString(w/2, y - 7*mm, "Kiểm tra thông tin và in phiếu khám")
+
+    # Cards + header
+    _round_rect(cv, margin, L["card1_top"], content_w, 42*mm, 8, UI["patient_bg"], UI["patient_bd"])
+    _section_header(cv, L["x"], L["header_y"][1], "Thông Tin Bệnh Nhân", UI["icon_green"])
+    _round_rect(cv, margin, L["card2_top"], content_w, 58*mm, 8, UI["exam_bg"], UI["exam_bd"])
+    _section_header(cv, L["x"], L["header_y"][2], "Thông Tin Khám", UI["icon_green"])
+    for label, fx, fy, *_ in L["fields"]:
+        _label(cv, fx, fy, label)
+
+    # chip
+    chip_x, chip_y_top, chip_w, chip_h = L["chip"]
+    _round_rect(cv, chip_x, chip_y_top, chip_w, chip_h, 3, UI["chip_bg"], UI["chip_bd"])
+    cv.setFont("DejaVu-Bold", 9); cv.setFillColor(UI["chip_txt"])
+    cv.drawCentredString(chip_x + chip_w/2, chip_y_top - chip_h/2 + 3, "ĐÃ THANH TOÁN")
+
+    # chú thích QR
+    qr_x, qr_y, qr_size = L["qr"]
+    cv.setFont("DejaVu", 9); cv.setFillColor(UI["muted"])
+    cv.drawCentredString(w/2, qr_y - 7*mm, "Mã QR dùng để check-in tại quầy")
+
+    # Hint
+    y = L["hint_top"]
+    _round_rect(cv, margin, y, content_w, 28*mm, 6, UI["hint_bg"], UI["hint_bd"])
+    cv.setFont("DejaVu-Bold", 10); cv.setFillColor(UI["title"])
+    cv.drawString(margin + 9*mm, y - 9, "Hướng dẫn:")
+    cv.setFont("DejaVu", 9)
+    for t in _HINTS:
+        y -= 5*mm
+        cv.drawString(margin + 12*mm, y, f"• {t}")
+
+def _draw_variable_layer(cv, data: Dict[str, Any]) -> None:
+    L = _layout()
+    for _, _, fy, vx, value, bold, color in L["fields"]:
+        cv.setFont("DejaVu-Bold" if bold else "DejaVu", 10)
+        cv.setFillColor(UI[color] if color else UI["title"])
+        cv.drawString(vx, fy, str(value(data)))
+
+    qr_payload = f"APPT:{data['id']}|ORDER:{data['order_code']}|PAID_AT:{_fmt_dt(data.get('paid_at'))}"
+    qr_x, qr_y, qr_size = L["qr"]
+    if TICKET_QR_MODE == "raster":
+        cv.drawImage(_qr_reader(qr_payload), qr_x, qr_y, qr_size, qr_size, preserveAspectRatio=True, mask='auto')
+    else:
+        _draw_qr_vector(cv, qr_payload, qr_x, qr_y, qr_size)
+
+def _begin_ticket_document(cv) -> None:
+    """Biên dịch phần tĩnh thành 1 form XObject cho cả tài liệu; mỗi trang chỉ tham chiếu lại"""
+    cv.beginForm(_STATIC_FORM)
+    _draw_static_layer(cv)
+    cv.endForm()
+
+def _draw_visit_ticket(cv, data: Dict[str, Any]) -> None:
+    """Vẽ 1 phiếu lên trang hiện tại rồi sang trang (cần _begin_ticket_document trước)"""
+    cv.doForm(_STATIC_FORM)
+    _draw_variable_layer(cv, data)
+    cv.showPage()
+
+
+# render
+def render_visit_ticket(data: Dict[str, Any]) -> bytes:
+    _ensure_fonts()
+    buf = BytesIO()
+    # invariant: bỏ ngày tạo/ID ngẫu nhiên -> cùng dữ liệu ra cùng bytes (ETag mạnh đúng nghĩa)
+    cv = canvas.Canvas(buf, pagesize=A4, invariant=1)
+    _begin_ticket_document(cv)
+    _draw_visit_ticket(cv, data)
+    cv.setTitle(f"PhieuKham-{data['id']}")
+    cv.save()
+    pdf_bytes = buf.getvalue(); buf.close()
+    return pdf_bytes
+
+def render_visit_tickets_to_file(rows: List[Dict[str, Any]], title: str) -> str:
+    """
+    Nhiều phiếu trong 1 canvas (font nhúng 1 lần, ảnh trùng được ReportLab gộp).
+    Ghi ra file tạm và trả đường dẫn: process gọi stream file rồi xóa.
+    """
+    _ensure_fonts()
+    fd, path = tempfile.mkstemp(prefix="phieu_kham_", suffix=".pdf")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            cv = canvas.Canvas(f, pagesize=A4, invariant=1)
+            cv.setTitle(title)
+            _begin_ticket_document(cv)
+            for data in rows:
+                _draw_visit_ticket(cv, data)
+            cv.save()
+    except Exception:
+        os.unlink(path)
+        raise
+    return path
+
+
+class TicketRenderPool:
+    """
+    Render phiếu khám trong process riêng (ReportLab/qrcode/Pillow ăn CPU, giữ GIL).
+    - Worker khởi tạo 1 lần với _ensure_fonts; API chỉ await kết quả.
+    - Giới hạn số việc đang chờ: đầy -> 503 + Retry-After thay vì xếp hàng vô hạn.
+    """
+
+    def __init__(self, workers: int = 2, max_pending: int = 16, retry_after: int = 2):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.retry_after = retry_after
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._stats = {"rendered": 0, "rejected": 0, "failed": 0, "max_pending_seen": 0}
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn: không fork process đang có thread/pool kết nối
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_ensure_fonts,
+                )
+            return self._executor
+
+    async def render(self, data: Dict[str, Any]) -> bytes:
+        return await self.run(render_visit_ticket, data)
+
+    async def render_escpos(self, data: Dict[str, Any]) -> bytes:
+        return await self.run(render_visit_ticket_escpos, data)
+
+    async def render_batch(self, rows: List[Dict[str, Any]], title: str) -> str:
+        """Cả lô là 1 việc trong hàng đợi; trả đường dẫn file PDF tạm"""
+        return await self.run(render_visit_tickets_to_file, rows, title)
+
+    async def run(self, fn: Callable, *args) -> Any:
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._stats["rejected"] += 1
+                raise HTTPException(
+                    status.HTTP_503_SERVICE_UNAVAILABLE,
+                    "Hệ thống in phiếu đang bận, vui lòng thử lại",
+                    headers={"Retry-After": str(self.retry_after)},
+                )
+            self._pending += 1
+            self._stats["max_pending_seen"] = max(self._stats["max_pending_seen"], self._pending)
+        try:
+            loop = asyncio.get_running_loop()
+            executor = self._get_executor()
+            result = await loop.run_in_executor(executor, fn, *args)
+        except BrokenProcessPool:
+            # worker chết (OOM/kill) -> bỏ pool hỏng, lần sau tạo lại
+            with self._lock:
+                self._stats["failed"] += 1
+                if self._executor is executor:
+                    self._executor = None
+            raise
+        except Exception:
+            with self._lock:
+                self._stats["failed"] += 1
+            raise
+        finally:
+            with self._lock:
+                self._pending -= 1
+        with self._lock:
+            self._stats["rendered"] += 1
+        return result
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self._stats)
+            data.update(workers=self.workers, max_pending=self.max_pending,
+                        pending=self._pending, started=self._executor is not None)
+        return data
+
+
+render_pool = TicketRenderPool(
+    workers=int(os.getenv("TICKET_RENDER_WORKERS", "2")),
+    max_pending=int(os.getenv("TICKET_RENDER_MAX_PENDING", "16")),
+)
@@ -1,6 +1,7 @@
 from datetime import datetime, timedelta
 from typing import Annotated, Optional
-from backend.database.connector import DatabaseConnector
+from backend.database.async_connector import AsyncDatabaseConnector
+from backend.auth.providers.principal_cache import get_principal, set_principal
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
@@ -95,43 +96,53 @@ class AuthProvider:
             raise CREDENTIALS_EXCEPTION
 
     async def get_current_admin_user(self, token: Annotated[str, Depends(OAUTH2_SCHEME_ADMIN)]) -> dict:
-        db = DatabaseConnector()
+        db = AsyncDatabaseConnector()
         try:
             payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
             user_id = int(payload.get("sub"))
             role = payload.get("role")
             if not user_id or role not in ("admin", "receptionist"):
                 raise CREDENTIALS_EXCEPTION
-            user = self.get_admin_user_by_id(user_id, db)
-            return {
+            cached = get_principal("admin", user_id)
+            if cached is not None:
+                return cached
+            user = await self.get_admin_user_by_id(user_id, db)
+            principal = {
                 "id": user["id"],
                 "username": user["username"],
                 "full_name": user["full_name"],
                 "role": user["role"],
             }
+            set_principal("admin", user_id, principal)
+            return principal
         except JWTError:
             raise CREDENTIALS_EXCEPTION
 
     async def get_current_doctor_user(self, token: Annotated[str, Depends(OAUTH2_SCHEME_DOCTOR)]) -> dict:
-        db = DatabaseConnector()
+        db = AsyncDatabaseConnector()
         try:
             payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
             user_id = int(payload.get("sub"))
             role = payload.get("role")
             if not user_id or role != "doctor":
                 raise CREDENTIALS_EXCEPTION
-            user = self.get_doctor_user_by_id(user_id, db)
-            return {
+            cached = get_principal("doctor", user_id)
+            if cached is not None:
+                return cached
+            user = await self.get_doctor_user_by_id(user_id, db)
+            principal = {
                 "id": user["id"],
                 "username": user["username"],
                 "full_name": user["full_name"],
                 "role": user["role"],
             }
+            set_principal("doctor", user_id, principal)
+            return principal
         except JWTError:
             raise CREDENTIALS_EXCEPTION
 
-    def get_admin_user_by_id(self, user_id: int, db: DatabaseConnector) -> dict:
-        user = db.query_get(
+    async def get_admin_user_by_id(self, user_id: int, db: AsyncDatabaseConnector) -> dict:
+        user = await db.query_get(
             "SELECT id, username, full_name, role FROM users WHERE id = %s",
             (user_id,),
         )
@@ -139,8 +150,8 @@ class AuthProvider:
             raise USER_NOT_FOUND_EXCEPTION
         return user[0]
 
-    def get_doctor_user_by_id(self, user_id: int, db: DatabaseConnector) -> dict:
-        user = db.query_get(
+    async def get_doctor_user_by_id(self, user_id: int, db: AsyncDatabaseConnector) -> dict:
+        user = await db.query_get(
             "SELECT id, username, full_name, role FROM users WHERE id = %s AND role = 'doctor'",
             (user_id,),
         )
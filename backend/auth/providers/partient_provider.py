@@ -1,6 +1,9 @@
 from datetime import datetime, timedelta
 from typing import Annotated, Optional
 from backend.database.connector import DatabaseConnector
+from backend.database.async_connector import AsyncDatabaseConnector
+from backend.database.unit_of_work import UnitOfWork, get_unit_of_work
+from backend.auth.providers.principal_cache import get_principal, set_principal
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
@@ -75,25 +78,58 @@ class PatientProvider:
         except JWTError:
             raise CREDENTIALS_EXCEPTION
 
-    async def get_current_patient_user(self, token: Annotated[str, Depends(OAUTH2_SCHEME_PATIENT)]) -> dict:
-        db = DatabaseConnector()
+    def _decode_patient_id(self, token: str) -> int:
         try:
             payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
-            user_id = int(payload.get("sub"))
-            role = payload.get("role")
-            if not user_id or role != "patient":
-                raise CREDENTIALS_EXCEPTION
-            user = self.get_user_by_id(user_id, db)
-            return {
-                "id": user["id"],
-                "national_id": user["national_id"],
-                "full_name": user["full_name"],
-            }
         except JWTError:
             raise CREDENTIALS_EXCEPTION
+        user_id = int(payload.get("sub"))
+        role = payload.get("role")
+        if not user_id or role != "patient":
+            raise CREDENTIALS_EXCEPTION
+        return user_id
 
-    def get_user_by_id(self, user_id: int, db_connector: DatabaseConnector) -> dict:
-        user = db_connector.query_get(
+    async def get_current_patient_user(self, token: Annotated[str, Depends(OAUTH2_SCHEME_PATIENT)]) -> dict:
+        user_id = self._decode_patient_id(token)
+        cached = get_principal("patient", user_id)
+        if cached is not None:
+            return cached
+        db = AsyncDatabaseConnector()
+        user = await self.get_user_by_id(user_id, db)
+        principal = {
+            "id": user["id"],
+            "national_id": user["national_id"],
+            "full_name": user["full_name"],
+        }
+        set_principal("patient", user_id, principal)
+        return principal
+
+    def get_current_patient_user_scoped(
+        self,
+        token: Annotated[str, Depends(OAUTH2_SCHEME_PATIENT)],
+        uow: Annotated[UnitOfWork, Depends(get_unit_of_work)],
+    ) -> dict:
+        """Như get_current_patient_user nhưng dùng connection của request (UnitOfWork)"""
+        user_id = self._decode_patient_id(token)
+        cached = get_principal("patient", user_id)
+        if cached is not None:
+            return cached
+        user = uow.query_one(
+            "SELECT id, national_id, full_name FROM patients WHERE id = %s",
+            (user_id,),
+        )
+        if not user:
+            raise USER_NOT_FOUND_EXCEPTION
+        principal = {
+            "id": user["id"],
+            "national_id": user["national_id"],
+            "full_name": user["full_name"],
+        }
+        set_principal("patient", user_id, principal)
+        return principal
+
+    async def get_user_by_id(self, user_id: int, db_connector: AsyncDatabaseConnector) -> dict:
+        user = await db_connector.query_get(
             "SELECT id, national_id, full_name FROM patients WHERE id = %s",
             (user_id,),
         )
@@ -0,0 +1,32 @@
+import os
+from typing import Optional
+from backend.database.cache import TTLCache
+
+# Cache user/bệnh nhân đã xác thực, key = (role, id)
+# - "admin"  : users (admin/receptionist)
+# - "doctor" : users role='doctor'
+# - "patient": patients
+principal_cache = TTLCache(
+    maxsize=int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("PRINCIPAL_CACHE_TTL", "60")),
+)
+
+
+def get_principal(role: str, subject_id: int) -> Optional[dict]:
+    cached = principal_cache.get((role, int(subject_id)))
+    return dict(cached) if cached is not None else None
+
+
+def set_principal(role: str, subject_id: int, principal: dict) -> None:
+    principal_cache.set((role, int(subject_id)), dict(principal))
+
+
+def invalidate_user(user_id: int) -> None:
+    """Gọi khi users bị sửa/xóa (admin, receptionist, doctor dùng chung bảng users)"""
+    principal_cache.pop(("admin", int(user_id)))
+    principal_cache.pop(("doctor", int(user_id)))
+
+
+def invalidate_patient(patient_id: int) -> None:
+    """Gọi khi patients bị sửa/xóa"""
+    principal_cache.pop(("patient", int(patient_id)))
@@ -1,5 +1,6 @@
 from typing import List, Optional
 from backend.database.connector import DatabaseConnector
+from backend.database.reference_cache import reference_cache, tags_of
 from backend.clinics.models import (
     ClinicCreateModel,
     ClinicUpdateModel,
@@ -11,13 +12,19 @@ db = DatabaseConnector()
 # Lấy tất cả clinics
 # -------------------------------
 def get_all_clinics() -> List[ClinicResponseModel]:
-    rows = db.call_procedure("sp_get_all_clinics")
+    rows = reference_cache.get_or_load(
+        "clinics", "all", lambda: db.call_procedure("sp_get_all_clinics"),
+        lambda rows: tags_of(rows, "clinic") | {"clinic:list"},
+    )
     return [ClinicResponseModel(**row) for row in rows]
 # -------------------------------
 # Lấy clinic theo ID
 # -------------------------------
 def get_clinic_by_id(clinic_id: int) -> Optional[ClinicResponseModel]:
-    rows = db.call_procedure("sp_get_clinic_by_id", [clinic_id])
+    rows = reference_cache.get_or_load(
+        "clinics", ("id", clinic_id), lambda: db.call_procedure("sp_get_clinic_by_id", [clinic_id]),
+        lambda rows: {f"clinic:{clinic_id}"},
+    )
     if not rows:
         return None
     return ClinicResponseModel(**rows[0])
@@ -25,7 +32,10 @@ def get_clinic_by_id(clinic_id: int) -> Optional[ClinicResponseModel]:
 # Lấy clinics theo user (doctor)
 # -------------------------------
 def get_my_clinics_by_user(user_id: int) -> List[ClinicResponseModel]:
-    rows = db.call_procedure("sp_get_my_clinics_by_user", [user_id])
+    rows = reference_cache.get_or_load(
+        "clinics", ("user", user_id), lambda: db.call_procedure("sp_get_my_clinics_by_user", [user_id]),
+        lambda rows: tags_of(rows, "clinic") | {"clinic:list", "assignments", f"user:{user_id}"},
+    )
     return [ClinicResponseModel(**row) for row in rows]
 # -------------------------------
 # Tạo clinic
@@ -35,6 +45,8 @@ def create_clinic(data: ClinicCreateModel) -> ClinicResponseModel:
         "sp_create_clinic",
         [data.name, data.location, data.status]
     )
+    # get_clinic_by_id có thể đã cache kết quả rỗng cho id này
+    reference_cache.invalidate("clinic:list", f"clinic:{rows[0]['id']}")
     return ClinicResponseModel(**rows[0])
 # -------------------------------
 # Update clinic
@@ -44,16 +56,22 @@ def update_clinic(clinic_id: int, data: ClinicUpdateModel) -> ClinicResponseMode
         "sp_update_clinic",
         [clinic_id, data.name, data.location, data.status]
     )
+    reference_cache.invalidate(f"clinic:{clinic_id}")
     return ClinicResponseModel(**rows[0])
 # -------------------------------
 # Delete clinic
 # -------------------------------
 def delete_clinic(clinic_id: int) -> None:
     db.call_procedure("sp_delete_clinic", [clinic_id])
+    reference_cache.invalidate(f"clinic:{clinic_id}")
 # -------------------------------
 # Lấy clinics theo service
 # -------------------------------
 def get_clinics_by_service(service_id: int) -> list[dict]:
-    rows = db.call_procedure("sp_get_clinics_by_service", [service_id])
     # SP này trả cả clinic + doctor + schedule => tạm giữ dạng dict
-    return rows
+    # phần ca làm việc chỉ dựa vào TTL ngắn của namespace; clinic/doctor/service đổi thì bỏ ngay theo tag
+    return reference_cache.get_or_load(
+        "clinics_by_service", service_id, lambda: db.call_procedure("sp_get_clinics_by_service", [service_id]),
+        lambda rows: tags_of(rows, "clinic", "clinic_id") | tags_of(rows, "doctor", "doctor_id")
+                     | {f"service:{service_id}", "clinic:list", "assignments"},
+    )
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from typing import List
 from backend.auth.providers.auth_providers import AuthProvider, AdminUser, DoctorUser
 from backend.clinics.models import (
@@ -15,6 +15,8 @@ from backend.clinics.controllers import (
     get_clinics_by_service,
     get_my_clinics_by_user,
 )
+from backend.database.reference_cache import reference_cache
+from backend.database.versions import versions, ttl_bucket, not_modified, json_with_etag
 
 auth_handler = AuthProvider()
 router = APIRouter(prefix="/clinics", tags=["Clinics"])
@@ -24,8 +26,10 @@ router = APIRouter(prefix="/clinics", tags=["Clinics"])
 # GET: Lấy tất cả clinics
 
 @router.get("/", response_model=List[ClinicResponseModel])
-def list_clinics():
-    return get_all_clinics()
+def list_clinics(request: Request):
+    # ETag từ phiên bản dữ liệu phòng khám: 304 không chạm DB, không dựng body
+    etag = versions.etag("clinics", *versions.get("clinic"), ttl_bucket(reference_cache.ttl("clinics")))
+    return not_modified(request, etag) or json_with_etag(get_all_clinics(), etag)
 
 
 
@@ -84,5 +88,11 @@ def remove_clinic(
 # GET: Lấy clinics theo service
 
 @router.get("/by-service/{service_id}")
-def api_clinics_by_service(service_id: int):
-    return get_clinics_by_service(service_id)
+def api_clinics_by_service(request: Request, service_id: int):
+    # ca làm việc trong kết quả không có hook -> bucket theo TTL ngắn của namespace
+    etag = versions.etag(
+        "clinics_by_service", service_id,
+        *versions.get(f"service:{service_id}", "clinic", "doctor", "assignments"),
+        ttl_bucket(reference_cache.ttl("clinics_by_service")),
+    )
+    return not_modified(request, etag) or json_with_etag(get_clinics_by_service(service_id), etag)
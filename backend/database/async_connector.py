@@ -0,0 +1,179 @@
+from fastapi import HTTPException, status
+import asyncio
+import os
+from contextlib import asynccontextmanager
+import aiomysql
+from pymysql import converters, FIELD_TYPE
+
+
+class AsyncDatabaseConnector:
+    """
+    Bản async của DatabaseConnector (aiomysql) cho các handler `async def`.
+    Cùng bề mặt: query_get / query_one / query_put / execute_returning_id / call_procedure,
+    nhưng phải `await`. Pool riêng, dùng chung cho mọi instance trong cùng event loop.
+    Pool chạy autocommit: lượt đọc trả connection về pool sạch (aiomysql đóng connection còn
+    dở transaction khi release). Nhiều câu trong 1 transaction -> get_connection() + `await conn.begin()`.
+    """
+
+    _pools: dict = {}
+    _pools_lock = None
+
+    def __init__(self):
+        self.host = os.getenv("DATABASE_HOST")
+        self.user = os.getenv("DATABASE_USERNAME")
+        self.password = os.getenv("DATABASE_PASSWORD")
+        self.database = os.getenv("DATABASE")
+        self.port = int(os.getenv("DATABASE_PORT", "3306"))
+        self.pool_size = int(os.getenv("DB_ASYNC_POOL_SIZE", "10"))
+        self.pool_recycle = int(os.getenv("DB_POOL_RECYCLE", "3600"))
+
+        # Convert BIT -> bool
+        self.conversions = converters.conversions.copy()
+        self.conversions[FIELD_TYPE.BIT] = (
+            lambda x: False if x == b"\x00" else True
+        )
+
+        # Validate env
+        for key, value in {
+            "DATABASE_HOST": self.host,
+            "DATABASE_USERNAME": self.user,
+            "DATABASE_PASSWORD": self.password,
+            "DATABASE": self.database,
+        }.items():
+            if not value:
+                raise EnvironmentError(f"{key} environment variable not found")
+
+    async def _get_pool(self) -> aiomysql.Pool:
+        # aiomysql pool gắn với event loop -> key theo loop
+        key = (id(asyncio.get_running_loop()), self.host, self.port, self.user, self.database)
+        pool = AsyncDatabaseConnector._pools.get(key)
+        if pool is not None:
+            return pool
+
+        if AsyncDatabaseConnector._pools_lock is None:
+            AsyncDatabaseConnector._pools_lock = asyncio.Lock()
+        async with AsyncDatabaseConnector._pools_lock:
+            pool = AsyncDatabaseConnector._pools.get(key)
+            if pool is None:
+                try:
+                    pool = await aiomysql.create_pool(
+                        minsize=0,
+                        maxsize=self.pool_size,
+                        pool_recycle=self.pool_recycle,
+                        host=self.host,
+                        port=self.port,
+                        user=self.user,
+                        password=self.password,
+                        db=self.database,
+                        cursorclass=aiomysql.DictCursor,
+                        conv=self.conversions,
+                        init_command="SET time_zone = '+07:00'",
+                        autocommit=True,
+                    )
+                except Exception as e:
+                    raise HTTPException(
+                        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                        detail=f"Database connection error: {str(e)}",
+                    )
+                AsyncDatabaseConnector._pools[key] = pool
+        return pool
+
+    @classmethod
+    async def close_all(cls) -> None:
+        """Đóng toàn bộ pool (gọi khi shutdown app)"""
+        pools, cls._pools = cls._pools, {}
+        for pool in pools.values():
+            pool.close()
+            await pool.wait_closed()
+
+    async def query_get(self, sql: str, param=()):
+        """Trả về nhiều rows"""
+        pool = await self._get_pool()
+        try:
+            async with pool.acquire() as connection:
+                async with connection.cursor() as cursor:
+                    await cursor.execute(sql, param)
+                    return await cursor.fetchall()
+        except Exception as e:
+            raise HTTPException(
+                status_code=500, detail=f"Database error: {str(e)}"
+            )
+
+    async def query_one(self, sql: str, param=()):
+        """Trả về 1 row"""
+        pool = await self._get_pool()
+        try:
+            async with pool.acquire() as connection:
+                async with connection.cursor() as cursor:
+                    await cursor.execute(sql, param)
+                    return await cursor.fetchone()
+        except Exception as e:
+            raise HTTPException(
+                status_code=500, detail=f"Database error: {str(e)}"
+            )
+
+    async def query_put(self, sql: str, param=()):
+        """Update/Delete"""
+        pool = await self._get_pool()
+        try:
+            async with pool.acquire() as connection:
+                async with connection.cursor() as cursor:
+                    await cursor.execute(sql, param)
+                    await connection.commit()
+                    return cursor.rowcount
+        except Exception as e:
+            raise HTTPException(
+                status_code=500, detail=f"Database error: {str(e)}"
+            )
+
+    async def execute_returning_id(self, sql: str, param=()):
+        """Insert + trả về ID"""
+        pool = await self._get_pool()
+        try:
+            async with pool.acquire() as connection:
+                async with connection.cursor() as cursor:
+                    await cursor.execute(sql, param)
+                    last_id = cursor.lastrowid
+                    await connection.commit()
+                    return last_id
+        except Exception as e:
+            raise HTTPException(
+                status_code=500, detail=f"Database error: {str(e)}"
+            )
+
+    async def call_procedure(self, proc_name: str, params=()):
+        """Gọi Stored Procedure và trả về kết quả"""
+        pool = await self._get_pool()
+        try:
+            async with pool.acquire() as connection:
+                async with connection.cursor() as cursor:
+                    await cursor.callproc(proc_name, params)
+
+                    # Lấy luôn kết quả SELECT trong SP
+                    results = await cursor.fetchall()
+
+                    await connection.commit()  # cần commit nếu SP có insert/update
+                    return results
+        except Exception as e:
+            raise HTTPException(
+                status_code=500, detail=f"Stored procedure error: {str(e)}"
+            )
+
+    @asynccontextmanager
+    async def get_connection(self):
+        """
+        Mượn 1 connection từ pool để tự quản lý transaction:
+            async with adb.get_connection() as conn:
+                await conn.begin()
+                ...
+                await conn.commit()
+        Lỗi giữa chừng -> rollback trước khi trả connection về pool.
+        """
+        pool = await self._get_pool()
+        async with pool.acquire() as connection:
+            try:
+                yield connection
+            except BaseException:
+                try: await connection.rollback()
+                except Exception: pass
+                raise
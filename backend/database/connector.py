@@ -1,10 +1,16 @@
 from fastapi import HTTPException, status
 import os
+import threading
 import pymysql.cursors
 from pymysql import converters, FIELD_TYPE
+from backend.database.pool import ConnectionPool, PoolTimeoutError, pool_settings_from_env
 
 
 class DatabaseConnector:
+    # Pool dùng chung cho mọi instance (các controller đều tạo DatabaseConnector() ở module level)
+    _pools: dict = {}
+    _pools_lock = threading.Lock()
+
     def __init__(self):
         self.host = os.getenv("DATABASE_HOST")
         self.user = os.getenv("DATABASE_USERNAME")
@@ -28,21 +34,43 @@ class DatabaseConnector:
             if not value:
                 raise EnvironmentError(f"{key} environment variable not found")
 
+    def _get_pool(self) -> ConnectionPool:
+        key = (self.host, self.port, self.user, self.database)
+        pool = DatabaseConnector._pools.get(key)
+        if pool is None:
+            with DatabaseConnector._pools_lock:
+                pool = DatabaseConnector._pools.get(key)
+                if pool is None:
+                    pool = ConnectionPool(
+                        dict(
+                            host=self.host,
+                            port=self.port,
+                            user=self.user,
+                            password=self.password,
+                            database=self.database,
+                            cursorclass=pymysql.cursors.DictCursor,
+                            conv=self.conversions,
+                            # set timezone 1 lần cho mỗi connection vật lý
+                            init_command="SET time_zone = '+07:00'",
+                        ),
+                        **pool_settings_from_env(),
+                    )
+                    DatabaseConnector._pools[key] = pool
+        return pool
+
+    def pool_stats(self) -> dict:
+        """Số liệu pool: size, idle, in_use, checkouts, thời gian chờ..."""
+        return self._get_pool().stats()
+
     def get_connection(self):
-        """Tạo connection MySQL và set timezone"""
+        """Lấy connection MySQL từ pool (timezone đã set sẵn). `with conn:` sẽ trả về pool."""
         try:
-            connection = pymysql.connect(
-                host=self.host,
-                port=self.port,
-                user=self.user,
-                password=self.password,
-                database=self.database,
-                cursorclass=pymysql.cursors.DictCursor,
-                conv=self.conversions,
+            return self._get_pool().acquire()
+        except PoolTimeoutError as e:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=f"Database busy: {str(e)}",
             )
-            with connection.cursor() as cursor:
-                cursor.execute("SET time_zone = '+07:00';")
-            return connection
         except Exception as e:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -56,6 +84,8 @@ class DatabaseConnector:
                 with connection.cursor() as cursor:
                     cursor.execute(sql, param)
                     return cursor.fetchall()
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(
                 status_code=500, detail=f"Database error: {str(e)}"
@@ -68,6 +98,8 @@ class DatabaseConnector:
                 with connection.cursor() as cursor:
                     cursor.execute(sql, param)
                     return cursor.fetchone()
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(
                 status_code=500, detail=f"Database error: {str(e)}"
@@ -81,6 +113,8 @@ class DatabaseConnector:
                     cursor.execute(sql, param)
                     connection.commit()
                     return cursor.rowcount
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(
                 status_code=500, detail=f"Database error: {str(e)}"
@@ -95,10 +129,13 @@ class DatabaseConnector:
                     last_id = cursor.lastrowid
                     connection.commit()
                     return last_id
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(
                 status_code=500, detail=f"Database error: {str(e)}"
             )
+
     def call_procedure(self, proc_name: str, params=()):
         """Gọi Stored Procedure và trả về kết quả"""
         try:
@@ -111,6 +148,8 @@ class DatabaseConnector:
 
                     connection.commit()  # cần commit nếu SP có insert/update
                     return results
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(
                 status_code=500, detail=f"Stored procedure error: {str(e)}"
@@ -0,0 +1,45 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, status
+
+
+def encode_cursor(sort_value: datetime, row_id: int) -> str:
+    """Token trang tiếp theo: base64url của (khóa sắp xếp, id) - client chỉ gửi lại, không cần hiểu"""
+    raw = json.dumps({"s": sort_value.isoformat(), "i": int(row_id)}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        data = json.loads(raw)
+        return datetime.fromisoformat(data["s"]), int(data["i"])
+    except Exception:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "cursor không hợp lệ")
+
+
+def keyset_predicate(sort_col: str, id_col: str, token: str, *, descending: bool = True) -> Tuple[str, list]:
+    """
+    Điều kiện "sau cursor" cho ORDER BY sort_col, id_col (DESC mặc định, ASC khi descending=False).
+    Viết dạng OR mở rộng (thay vì so sánh tuple) để MySQL dùng được range trên index (sort_col, id_col).
+    """
+    sort_value, row_id = decode_cursor(token)
+    op = "<" if descending else ">"
+    return (
+        f"({sort_col} {op} %s OR ({sort_col} = %s AND {id_col} {op} %s))",
+        [sort_value, sort_value, row_id],
+    )
+
+
+def keyset_page(rows: List[Dict[str, Any]], limit: int, *, id_key: str,
+                sort_key: str = "sort_at") -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """rows lấy LIMIT limit+1: có dòng dư -> còn trang sau. Bỏ cột sort_key khỏi kết quả trả về."""
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_cursor(rows[-1][sort_key], rows[-1][id_key]) if has_more and rows else None
+    for r in rows:
+        r.pop(sort_key, None)
+    return rows, next_cursor
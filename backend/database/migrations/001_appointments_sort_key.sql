@@ -0,0 +1,10 @@
+-- Khóa sắp xếp lưu sẵn cho danh sách lịch hẹn (keyset pagination)
+-- Trước: ORDER BY COALESCE(a.estimated_time, a.created_at) DESC, a.id DESC LIMIT .. OFFSET ..
+--        -> không dùng được index, trang sâu phải quét & bỏ hàng chục nghìn dòng.
+-- Sau:   ORDER BY a.sort_at DESC, a.id DESC + điều kiện (sort_at, id) < cursor -> đi thẳng theo index.
+
+ALTER TABLE appointments
+    ADD COLUMN sort_at DATETIME
+        GENERATED ALWAYS AS (COALESCE(estimated_time, created_at)) STORED,
+    ADD INDEX idx_appointments_patient_sort (patient_id, sort_at, id),
+    ADD INDEX idx_appointments_sort (sort_at, id);
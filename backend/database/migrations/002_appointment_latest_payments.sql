@@ -0,0 +1,34 @@
+-- Projection "đơn thanh toán mới nhất của mỗi lịch hẹn"
+-- Trước: mỗi lần đọc đều JOIN (SELECT appointment_id, MAX(id) FROM payment_orders GROUP BY appointment_id)
+--        -> quét toàn bộ lịch sử payment_orders.
+-- Sau:   payments/controllers.py đồng bộ bảng này trong cùng transaction khi tạo đơn / đổi trạng thái;
+--        các truy vấn danh sách / in phiếu chỉ JOIN theo khóa chính appointment_id.
+
+CREATE TABLE IF NOT EXISTS appointment_latest_payments (
+    appointment_id   BIGINT       NOT NULL,
+    payment_order_id BIGINT       NOT NULL,
+    order_code       VARCHAR(64)  NOT NULL,
+    status           VARCHAR(20)  NOT NULL,
+    paid_at          DATETIME     NULL,
+    qr_code_url      VARCHAR(512) NULL,
+    updated_at       TIMESTAMP    NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (appointment_id),
+    KEY idx_latest_payments_status (status, appointment_id)
+);
+
+-- Backfill từ dữ liệu hiện có (chạy lại nhiều lần vẫn an toàn)
+INSERT INTO appointment_latest_payments
+    (appointment_id, payment_order_id, order_code, status, paid_at, qr_code_url)
+SELECT t.appointment_id, t.id, t.order_code, t.status, t.paid_at, t.qr_code_url
+FROM payment_orders t
+JOIN (
+    SELECT appointment_id, MAX(id) AS max_id
+    FROM payment_orders
+    GROUP BY appointment_id
+) z ON z.max_id = t.id
+ON DUPLICATE KEY UPDATE
+    order_code       = VALUES(order_code),
+    status           = VALUES(status),
+    paid_at          = VALUES(paid_at),
+    qr_code_url      = VALUES(qr_code_url),
+    payment_order_id = VALUES(payment_order_id);
@@ -0,0 +1,13 @@
+-- Index cho các truy vấn lọc theo khoảng ngày (điều kiện nửa mở, không bọc cột trong hàm)
+--   appointments(patient_id, estimated_time)   : get_my_appointments (from_date/to_date)
+--   appointments(doctor_id, created_at)        : danh sách lịch hẹn của bác sĩ
+--   doctor_schedules(clinic_id, doctor_id, work_date, start_time)
+--                                              : _pick_schedule_for_offline, calendar/day-shifts
+-- Kiểm tra lại bằng: python -m backend.scripts.explain_check
+
+ALTER TABLE appointments
+    ADD INDEX idx_appointments_patient_estimated (patient_id, estimated_time),
+    ADD INDEX idx_appointments_doctor_created (doctor_id, created_at);
+
+ALTER TABLE doctor_schedules
+    ADD INDEX idx_schedules_clinic_doctor_date (clinic_id, doctor_id, work_date, start_time);
@@ -0,0 +1,8 @@
+-- Feed lịch hẹn của bác sĩ (/appointments/doctor/me)
+--   appointments(doctor_id, updated_at) : chế độ since (updated_at >= mốc, ORDER BY updated_at, id)
+--                                         + probe COUNT(*)/MAX(updated_at) làm ETag, chỉ đọc index
+-- InnoDB tự nối khóa chính vào index phụ nên (doctor_id, updated_at) đã đủ cho cursor (updated_at, id).
+-- Chế độ mặc định (created_at DESC, id DESC) dùng idx_appointments_doctor_created ở 003.
+
+ALTER TABLE appointments
+    ADD INDEX idx_appointments_doctor_updated (doctor_id, updated_at);
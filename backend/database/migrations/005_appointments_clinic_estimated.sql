@@ -0,0 +1,6 @@
+-- appointments(clinic_id, estimated_time)
+--   in phiếu khám theo lô (/appointments/admin/print-tickets) và nạp bảng gọi số theo phòng khám:
+--   cả hai lọc clinic_id + khoảng estimated_time nửa mở.
+
+ALTER TABLE appointments
+    ADD INDEX idx_appointments_clinic_estimated (clinic_id, estimated_time);
@@ -0,0 +1,7 @@
+-- Probe ETag của feed bác sĩ (doctor_feed_probe): COUNT/MAX(updated_at) + SUM(CRC32(id, status, updated_at))
+--   thêm status vào index (doctor_id, updated_at) để probe vẫn chỉ đọc index;
+--   chế độ since (ORDER BY updated_at, id) dùng index mới như cũ.
+
+ALTER TABLE appointments
+    DROP INDEX idx_appointments_doctor_updated,
+    ADD INDEX idx_appointments_doctor_updated (doctor_id, updated_at, status);
@@ -0,0 +1,6 @@
+-- Phiên bản chỗ của ca: tăng 1 ở mọi câu UPDATE đổi booked_patients/max_patients (đặt lịch, hủy, sửa ca),
+--   trong cùng transaction đang khóa dòng -> thứ tự tăng đúng thứ tự commit, kể cả giữa nhiều worker.
+--   Cache lịch khám và sự kiện SSE "capacity" dùng giá trị này để bỏ cập nhật đến trễ (cũ hơn).
+
+ALTER TABLE doctor_schedules
+    ADD COLUMN capacity_version BIGINT UNSIGNED NOT NULL DEFAULT 0;
@@ -0,0 +1,31 @@
+-- Feed bác sĩ (/appointments/doctor/me) hiển thị cả cột của ca, bệnh nhân, phòng khám,
+-- nhưng probe ETag và chế độ since chỉ nhìn appointments.updated_at.
+-- Sửa các cột đó (kể cả qua stored procedure) -> chạm updated_at của các lịch hẹn liên quan,
+-- trong cùng câu lệnh: ETag đổi và client since nhận lại các dòng này.
+--   doctor_schedules: work_date/start_time/end_time (update_day_shifts_for_doctor)
+--   patients        : full_name/phone (sp_update_patient)
+--   clinics         : name (sp_update_clinic)
+-- Chỉ chạy khi cột hiển thị thực sự đổi: đặt lịch/hủy (booked_patients) không kích hoạt.
+
+CREATE TRIGGER trg_doctor_schedules_touch_appointments
+AFTER UPDATE ON doctor_schedules
+FOR EACH ROW
+    UPDATE appointments SET updated_at = NOW()
+    WHERE schedule_id = NEW.id
+      AND (NOT (OLD.work_date <=> NEW.work_date)
+           OR NOT (OLD.start_time <=> NEW.start_time)
+           OR NOT (OLD.end_time <=> NEW.end_time));
+
+CREATE TRIGGER trg_patients_touch_appointments
+AFTER UPDATE ON patients
+FOR EACH ROW
+    UPDATE appointments SET updated_at = NOW()
+    WHERE patient_id = NEW.id
+      AND (NOT (OLD.full_name <=> NEW.full_name) OR NOT (OLD.phone <=> NEW.phone));
+
+CREATE TRIGGER trg_clinics_touch_appointments
+AFTER UPDATE ON clinics
+FOR EACH ROW
+    UPDATE appointments SET updated_at = NOW()
+    WHERE clinic_id = NEW.id
+      AND NOT (OLD.name <=> NEW.name);
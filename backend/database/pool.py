@@ -0,0 +1,242 @@
+import os
+import threading
+import time
+from collections import deque
+
+import pymysql
+from pymysql.constants import SERVER_STATUS
+
+
+class PoolTimeoutError(Exception):
+    """Hết thời gian chờ lấy connection từ pool"""
+
+
+class _PoolEntry:
+    __slots__ = ("raw", "created_at", "last_used_at")
+
+    def __init__(self, raw):
+        now = time.monotonic()
+        self.raw = raw
+        self.created_at = now
+        self.last_used_at = now
+
+
+class PooledConnection:
+    """
+    Bọc connection PyMySQL lấy từ pool.
+    - Dùng giống connection thường (cursor/commit/rollback/...).
+    - `with conn:` / `conn.close()` -> trả connection về pool thay vì đóng socket.
+    """
+
+    def __init__(self, pool: "ConnectionPool", entry: _PoolEntry):
+        self._pool = pool
+        self._entry = entry
+        self._broken = False
+
+    def __getattr__(self, name):
+        entry = self.__dict__.get("_entry")
+        if entry is None:
+            raise AttributeError(f"Connection đã trả về pool: {name}")
+        return getattr(entry.raw, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and isinstance(exc, (pymysql.err.OperationalError, pymysql.err.InterfaceError)):
+            self._broken = True
+        self.close()
+
+    def mark_broken(self) -> None:
+        self._broken = True
+
+    def close(self) -> None:
+        entry, self._entry = self._entry, None
+        if entry is not None:
+            self._pool.release(entry, broken=self._broken)
+
+
+class ConnectionPool:
+    """
+    Pool connection MySQL có giới hạn (thread-safe).
+    - time_zone được set 1 lần khi mở connection (init_command).
+    - Kiểm tra sống (ping) khi connection nằm idle quá `ping_interval`.
+    - Recycle connection quá `recycle` giây hoặc bị lỗi.
+    - Thread nền dọn connection idle quá `idle_timeout`.
+    """
+
+    def __init__(
+        self,
+        connect_kwargs: dict,
+        *,
+        max_size: int = 10,
+        timeout: float = 10.0,
+        recycle: float = 3600.0,
+        idle_timeout: float = 300.0,
+        ping_interval: float = 30.0,
+        reap_interval: float = 30.0,
+    ):
+        self._connect_kwargs = connect_kwargs
+        self.max_size = max_size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.idle_timeout = idle_timeout
+        self.ping_interval = ping_interval
+        self.reap_interval = reap_interval
+
+        self._idle = deque()
+        self._size = 0  # tổng số connection đang mở (idle + đang dùng)
+        self._cond = threading.Condition()
+
+        self._stats = {
+            "checkouts": 0,
+            "timeouts": 0,
+            "created": 0,
+            "recycled": 0,
+            "reaped": 0,
+            "broken": 0,
+            "wait_total_ms": 0.0,
+            "wait_max_ms": 0.0,
+        }
+
+        self._reaper = threading.Thread(target=self._reap_loop, name="db-pool-reaper", daemon=True)
+        self._reaper.start()
+
+    # ---------- checkout / checkin ----------
+
+    def acquire(self) -> PooledConnection:
+        started = time.monotonic()
+        deadline = started + self.timeout
+        while True:
+            entry = None
+            create = False
+            with self._cond:
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeoutError(
+                            f"Không lấy được connection sau {self.timeout}s (max_size={self.max_size})"
+                        )
+                    self._cond.wait(remaining)
+                if self._idle:
+                    entry = self._idle.pop()  # LIFO: ưu tiên connection "nóng"
+                else:
+                    self._size += 1
+                    create = True
+
+            if create:
+                try:
+                    entry = self._open()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            elif not self._is_healthy(entry):
+                self._discard(entry, "recycled")
+                continue
+
+            waited_ms = (time.monotonic() - started) * 1000
+            with self._cond:
+                self._stats["checkouts"] += 1
+                self._stats["wait_total_ms"] += waited_ms
+                self._stats["wait_max_ms"] = max(self._stats["wait_max_ms"], waited_ms)
+            return PooledConnection(self, entry)
+
+    def release(self, entry: _PoolEntry, *, broken: bool = False) -> None:
+        if not broken:
+            try:
+                # Còn transaction dở (lỗi giữa chừng / quên commit) -> rollback trước khi trả về pool
+                if entry.raw.server_status & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+                    entry.raw.rollback()
+            except Exception:
+                broken = True
+
+        if broken or not entry.raw.open:
+            self._discard(entry, "broken")
+            return
+
+        entry.last_used_at = time.monotonic()
+        with self._cond:
+            self._idle.append(entry)
+            self._cond.notify()
+
+    # ---------- helpers ----------
+
+    def _open(self) -> _PoolEntry:
+        raw = pymysql.connect(**self._connect_kwargs)
+        with self._cond:
+            self._stats["created"] += 1
+        return _PoolEntry(raw)
+
+    def _is_healthy(self, entry: _PoolEntry) -> bool:
+        now = time.monotonic()
+        if now - entry.created_at > self.recycle:
+            return False
+        if now - entry.last_used_at > self.ping_interval:
+            try:
+                entry.raw.ping(reconnect=False)
+            except Exception:
+                return False
+        return True
+
+    def _discard(self, entry: _PoolEntry, reason: str) -> None:
+        try:
+            entry.raw.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._stats[reason] += 1
+            self._cond.notify()
+
+    def _reap_loop(self) -> None:
+        while True:
+            time.sleep(self.reap_interval)
+            try:
+                self.reap_idle()
+            except Exception:
+                pass
+
+    def reap_idle(self) -> int:
+        """Đóng các connection idle quá idle_timeout. Trả về số connection đã đóng."""
+        now = time.monotonic()
+        expired = []
+        with self._cond:
+            keep = deque()
+            for entry in self._idle:
+                if now - entry.last_used_at > self.idle_timeout:
+                    expired.append(entry)
+                else:
+                    keep.append(entry)
+            self._idle = keep
+        for entry in expired:
+            self._discard(entry, "reaped")
+        return len(expired)
+
+    def stats(self) -> dict:
+        with self._cond:
+            idle = len(self._idle)
+            data = dict(self._stats)
+            data.update({
+                "max_size": self.max_size,
+                "size": self._size,
+                "idle": idle,
+                "in_use": self._size - idle,
+            })
+        checkouts = data["checkouts"]
+        data["wait_avg_ms"] = round(data["wait_total_ms"] / checkouts, 3) if checkouts else 0.0
+        data["wait_total_ms"] = round(data["wait_total_ms"], 3)
+        data["wait_max_ms"] = round(data["wait_max_ms"], 3)
+        return data
+
+
+def pool_settings_from_env() -> dict:
+    return {
+        "max_size": int(os.getenv("DB_POOL_SIZE", "10")),
+        "timeout": float(os.getenv("DB_POOL_TIMEOUT", "10")),
+        "recycle": float(os.getenv("DB_POOL_RECYCLE", "3600")),
+        "idle_timeout": float(os.getenv("DB_POOL_IDLE_TIMEOUT", "300")),
+        "ping_interval": float(os.getenv("DB_POOL_PING_INTERVAL", "30")),
+    }
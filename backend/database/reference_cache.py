@@ -0,0 +1,131 @@
+import copy
+import os
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, Set, Tuple
+
+from backend.database.cache import TTLCache
+from backend.database.versions import versions
+
+EntryKey = Tuple[str, Hashable]  # (namespace, key)
+
+_MISSING = object()
+
+
+class ReferenceCache:
+    """
+    Cache read-through cho dữ liệu danh mục (dịch vụ, phòng khám, bác sĩ).
+    - Mỗi namespace 1 TTLCache riêng (giới hạn số phần tử + TTL) -> hit ratio theo namespace.
+    - Mỗi entry gắn tag thực thể ("service:3", "clinic:5", "doctor:7", "service:list"...).
+      create/update/delete gọi invalidate(tag...) -> chỉ bỏ đúng các entry liên quan.
+    - Trả bản sao: caller sửa kết quả (vd. giảm giá BHYT) không làm bẩn cache.
+    - Lượt nạp chạy song song với 1 lần invalidate thì không được lưu (tránh ghi đè dữ liệu cũ).
+    - invalidate tăng phiên bản theo tag và theo loại ("clinic:5" -> "clinic:5", "clinic") cho ETag.
+    - Chỉ mục tag được tỉa theo các entry còn trong cache (LRU đẩy ra/hết TTL) khi vượt ngưỡng.
+    """
+
+    def __init__(self, namespaces: Dict[str, Tuple[int, float]]):
+        self._caches = {name: TTLCache(maxsize=size, ttl=ttl) for name, (size, ttl) in namespaces.items()}
+        self._tags: Dict[str, Set[EntryKey]] = {}
+        self._entry_tags: Dict[EntryKey, Set[str]] = {}
+        self._index_limit = 1024
+        self._invalidations = 0
+        self._lock = threading.Lock()
+        self._stats = {"invalidated_tags": 0, "invalidated_entries": 0, "discarded_loads": 0, "pruned_entries": 0}
+
+    # ---------- đọc ----------
+
+    def get_or_load(self, namespace: str, key: Hashable, loader: Callable[[], Any],
+                    tags: Callable[[Any], Iterable[str]]) -> Any:
+        value = self._caches[namespace].get(key, _MISSING)
+        if value is _MISSING:
+            with self._lock:
+                before = self._invalidations
+            value = loader()
+            self._store(namespace, key, value, tags(value), before)
+        return copy.deepcopy(value)
+
+    async def get_or_load_async(self, namespace: str, key: Hashable, loader: Callable[[], Awaitable[Any]],
+                                tags: Callable[[Any], Iterable[str]]) -> Any:
+        value = self._caches[namespace].get(key, _MISSING)
+        if value is _MISSING:
+            with self._lock:
+                before = self._invalidations
+            value = await loader()
+            self._store(namespace, key, value, tags(value), before)
+        return copy.deepcopy(value)
+
+    def _store(self, namespace: str, key: Hashable, value: Any, tags: Iterable[str], before: int) -> None:
+        entry = (namespace, key)
+        tags = set(tags)
+        with self._lock:
+            if self._invalidations != before:
+                self._stats["discarded_loads"] += 1
+                return
+            self._unlink(entry)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(entry)
+            self._entry_tags[entry] = tags
+            self._caches[namespace].set(key, copy.deepcopy(value))
+            if len(self._entry_tags) > self._index_limit:
+                self._prune_index()
+
+    def _unlink(self, entry: EntryKey) -> None:
+        for tag in self._entry_tags.pop(entry, ()):
+            entries = self._tags.get(tag)
+            if entries is not None:
+                entries.discard(entry)
+                if not entries:
+                    del self._tags[tag]
+
+    def _prune_index(self) -> None:
+        """Bỏ tag của các entry đã hết TTL/bị LRU đẩy ra (gọi khi giữ self._lock, chi phí chia đều)"""
+        dead = [e for e in self._entry_tags if self._caches[e[0]].peek(e[1], _MISSING) is _MISSING]
+        for entry in dead:
+            self._unlink(entry)
+        self._stats["pruned_entries"] += len(dead)
+        self._index_limit = max(1024, 2 * len(self._entry_tags))
+
+    # ---------- invalidate ----------
+
+    def invalidate(self, *tags: str) -> None:
+        with self._lock:
+            self._invalidations += 1
+            entries: Set[EntryKey] = set()
+            for tag in tags:
+                entries |= self._tags.get(tag, set())
+                self._stats["invalidated_tags"] += 1
+            for entry in entries:
+                self._unlink(entry)
+                self._caches[entry[0]].pop(entry[1])
+            self._stats["invalidated_entries"] += len(entries)
+        versions.bump(*{k for tag in tags for k in (tag, tag.split(":")[0])})
+
+    def ttl(self, namespace: str) -> float:
+        return self._caches[namespace].ttl
+
+    def stats(self) -> dict:
+        data = {name: cache.stats() for name, cache in self._caches.items()}
+        with self._lock:
+            data.update(self._stats)
+            data["tags"] = len(self._tags)
+            data["indexed_entries"] = len(self._entry_tags)
+        return data
+
+
+def _ns(prefix: str, size: str, ttl: str) -> Tuple[int, float]:
+    return (int(os.getenv(f"REFERENCE_CACHE_{prefix}_SIZE", size)),
+            float(os.getenv(f"REFERENCE_CACHE_{prefix}_TTL", ttl)))
+
+
+reference_cache = ReferenceCache({
+    "services": _ns("SERVICES", "1000", "600"),
+    "clinics": _ns("CLINICS", "1000", "600"),
+    "doctors": _ns("DOCTORS", "1000", "600"),
+    # by-service có cả ca làm việc (thay đổi theo ngày/đặt lịch) -> TTL ngắn
+    "clinics_by_service": _ns("BY_SERVICE", "500", "30"),
+})
+
+
+def tags_of(rows: Iterable[dict], prefix: str, field: str = "id") -> Set[str]:
+    """Tag thực thể cho các dòng kết quả, vd. tags_of(rows, "clinic", "clinic_id")"""
+    return {f"{prefix}:{r[field]}" for r in rows if r.get(field) is not None}
@@ -0,0 +1,156 @@
+import logging
+
+from fastapi import HTTPException
+from pymysql.constants import SERVER_STATUS
+from backend.database.connector import DatabaseConnector
+
+logger = logging.getLogger(__name__)
+
+
+def after_commit(hook, *args) -> None:
+    """
+    Hook sau commit (cache, bảng gọi số, SSE...): lỗi chỉ ghi log.
+    Transaction đã commit -> kết quả HTTP không được phụ thuộc vào hook.
+    """
+    try:
+        hook(*args)
+    except Exception:
+        logger.exception("Hook sau commit lỗi: %s", getattr(hook, "__name__", hook))
+
+
+class _LentConnection:
+    """
+    Connection cho mượn trong phạm vi request.
+    `with conn:` / `conn.close()` KHÔNG trả về pool — UnitOfWork sẽ trả khi request kết thúc.
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            try:
+                self._conn.rollback()
+            except Exception:
+                self._conn.mark_broken()
+
+    def close(self) -> None:
+        pass
+
+
+class UnitOfWork:
+    """
+    1 connection dùng chung cho cả request (auth, controller, helper).
+    Cùng bề mặt với DatabaseConnector nên có thể truyền thay cho `db`.
+    Connection chỉ được lấy khi cần và trả về pool khi request kết thúc.
+    """
+
+    def __init__(self, db: DatabaseConnector):
+        self._db = db
+        self._conn = None
+
+    @property
+    def connection(self):
+        if self._conn is None:
+            self._conn = self._db.get_connection()
+        return self._conn
+
+    def get_connection(self) -> _LentConnection:
+        """Connection để controller tự mở transaction (đã kết thúc snapshot đọc trước đó)"""
+        conn = self.connection
+        if conn.server_status & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+            conn.commit()
+        return _LentConnection(conn)
+
+    def query_get(self, sql: str, param=()):
+        """Trả về nhiều rows"""
+        try:
+            with self.connection.cursor() as cursor:
+                cursor.execute(sql, param)
+                return cursor.fetchall()
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(
+                status_code=500, detail=f"Database error: {str(e)}"
+            )
+
+    def query_one(self, sql: str, param=()):
+        """Trả về 1 row"""
+        try:
+            with self.connection.cursor() as cursor:
+                cursor.execute(sql, param)
+                return cursor.fetchone()
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(
+                status_code=500, detail=f"Database error: {str(e)}"
+            )
+
+    def query_put(self, sql: str, param=()):
+        """Update/Delete"""
+        try:
+            with self.connection.cursor() as cursor:
+                cursor.execute(sql, param)
+                self.connection.commit()
+                return cursor.rowcount
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(
+                status_code=500, detail=f"Database error: {str(e)}"
+            )
+
+    def execute_returning_id(self, sql: str, param=()):
+        """Insert + trả về ID"""
+        try:
+            with self.connection.cursor() as cursor:
+                cursor.execute(sql, param)
+                last_id = cursor.lastrowid
+                self.connection.commit()
+                return last_id
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(
+                status_code=500, detail=f"Database error: {str(e)}"
+            )
+
+    def call_procedure(self, proc_name: str, params=()):
+        """Gọi Stored Procedure và trả về kết quả"""
+        try:
+            with self.connection.cursor() as cursor:
+                cursor.callproc(proc_name, params)
+                results = cursor.fetchall()
+                self.connection.commit()
+                return results
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(
+                status_code=500, detail=f"Stored procedure error: {str(e)}"
+            )
+
+    def close(self) -> None:
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            conn.close()  # rollback phần dở dang + trả về pool
+
+
+def get_unit_of_work():
+    """
+    FastAPI dependency: mỗi request 1 UnitOfWork.
+    FastAPI cache dependency theo request -> auth và route nhận cùng 1 instance.
+    """
+    uow = UnitOfWork(DatabaseConnector())
+    try:
+        yield uow
+    finally:
+        uow.close()
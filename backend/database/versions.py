@@ -0,0 +1,66 @@
+import hashlib
+import secrets
+import threading
+import time
+from typing import Dict, Hashable, Optional
+
+from fastapi import Request, Response, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+
+class VersionCounters:
+    """
+    Bộ đếm phiên bản trong process cho HTTP validator (ETag) của các endpoint đọc.
+    - Các hook invalidate (reference_cache, availability_cache) gọi bump() sau khi ghi DB.
+    - ETag = hash(boot id + phiên bản + tham số + bucket thời gian) -> tính không cần DB, không dựng body.
+    - boot id khác nhau mỗi process: ETag của worker này không bao giờ khớp nhầm ở worker khác.
+    - bucket = TTL của cache tương ứng: thay đổi từ worker khác (không thấy hook) cũng chỉ cũ tối đa 1 TTL,
+      đúng bằng độ cũ của chính cache phục vụ body.
+    """
+
+    def __init__(self):
+        self.boot = secrets.token_hex(4)
+        self._counts: Dict[Hashable, int] = {}
+        self._lock = threading.Lock()
+
+    def bump(self, *keys: Hashable) -> None:
+        with self._lock:
+            for key in keys:
+                self._counts[key] = self._counts.get(key, 0) + 1
+
+    def get(self, *keys: Hashable) -> tuple:
+        with self._lock:
+            return tuple(self._counts.get(key, 0) for key in keys)
+
+    def etag(self, *parts) -> str:
+        raw = "|".join(str(p) for p in (self.boot,) + parts)
+        return '"' + hashlib.sha1(raw.encode()).hexdigest() + '"'
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"boot": self.boot, "keys": len(self._counts)}
+
+
+versions = VersionCounters()
+
+
+def ttl_bucket(ttl: float) -> int:
+    return int(time.time() // ttl) if ttl > 0 else 0
+
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """304 nếu If-None-Match khớp ETag (chấp nhận danh sách và '*'), ngược lại None"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return None
+    tags = {t.strip().removeprefix("W/") for t in header.split(",")}
+    if etag in tags or "*" in tags:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    return None
+
+
+def json_with_etag(data, etag: str) -> JSONResponse:
+    # no-cache: trình duyệt/proxy được lưu nhưng phải hỏi lại (If-None-Match) trước khi dùng
+    return JSONResponse(status_code=status.HTTP_200_OK, content=jsonable_encoder(data),
+                        headers={"ETag": etag, "Cache-Control": "no-cache"})
@@ -1,26 +1,37 @@
 from fastapi import HTTPException, status
-from backend.database.connector import DatabaseConnector
+from backend.database.async_connector import AsyncDatabaseConnector
+from backend.database.reference_cache import reference_cache, tags_of
 from backend.doctors.models import DoctorUpdateRequestModel
 
-database = DatabaseConnector()
+database = AsyncDatabaseConnector()
 
-def create_doctor(user_id: int, full_name: str, specialty: str, phone: str, email: str) -> int:
-    result = database.call_procedure("sp_create_doctor", (user_id, full_name, specialty, phone, email))
+async def create_doctor(user_id: int, full_name: str, specialty: str, phone: str, email: str) -> int:
+    result = await database.call_procedure("sp_create_doctor", (user_id, full_name, specialty, phone, email))
+    reference_cache.invalidate("doctor:list")
     return result[0]["doctor_id"]
 
-def get_all_doctors(limit: int = 100, offset: int = 0) -> list[dict]:
-    return database.call_procedure("sp_get_all_doctors", (limit, offset))
+async def get_all_doctors(limit: int = 100, offset: int = 0) -> list[dict]:
+    return await reference_cache.get_or_load_async(
+        "doctors", ("page", limit, offset), lambda: database.call_procedure("sp_get_all_doctors", (limit, offset)),
+        lambda rows: tags_of(rows, "doctor") | {"doctor:list"},
+    )
 
-def get_doctor_by_id(id: int) -> dict:
-    result = database.call_procedure("sp_get_doctor_by_id", (id,))
+async def get_doctor_by_id(id: int) -> dict:
+    result = await reference_cache.get_or_load_async(
+        "doctors", ("id", id), lambda: database.call_procedure("sp_get_doctor_by_id", (id,)),
+        lambda rows: {f"doctor:{id}"},
+    )
     if not result:
         raise HTTPException(status_code=404, detail="Không tìm thấy bác sĩ")
     return result[0]
 
-def update_doctor(id: int, full_name: str = None, specialty: str = None, phone: str = None, email: str = None) -> int:
-    result = database.call_procedure("sp_update_doctor", (id, full_name, specialty, phone, email))
+async def update_doctor(id: int, full_name: str = None, specialty: str = None, phone: str = None, email: str = None) -> int:
+    result = await database.call_procedure("sp_update_doctor", (id, full_name, specialty, phone, email))
+    reference_cache.invalidate(f"doctor:{id}")
     return result[0]["affected_rows"]
 
-def delete_doctor(id: int) -> str:
-    result = database.call_procedure("sp_delete_doctor", (id,))
+async def delete_doctor(id: int) -> str:
+    result = await database.call_procedure("sp_delete_doctor", (id,))
+    # xóa bác sĩ làm lệch phân trang danh sách -> bỏ cả các trang
+    reference_cache.invalidate(f"doctor:{id}", "doctor:list")
     return result[0]["message"]
@@ -28,7 +28,7 @@ router = APIRouter(prefix="/doctors", tags=["Doctors"])
 async def get_all_doctors_api(
     current_user: DoctorUser = Depends(auth_handler.get_current_admin_user)
 ):
-    doctors = get_all_doctors()
+    doctors = await get_all_doctors()
     return JSONResponse(
         status_code=status.HTTP_200_OK,
         content=jsonable_encoder(doctors)
@@ -41,7 +41,7 @@ async def get_my_doctor_profile(
     current_user: dict = Depends(auth_handler.get_current_doctor_user)
 ):
     doctor_id = current_user["id"]
-    doctor = get_doctor_by_id(doctor_id)
+    doctor = await get_doctor_by_id(doctor_id)
 
     if not doctor:
         raise HTTPException(status_code=404, detail="Không tìm thấy bác sĩ")
@@ -65,7 +65,7 @@ async def update_my_doctor_profile(
         )
 
     # Truyền đúng từng field thay vì truyền nguyên object
-    update_doctor(
+    await update_doctor(
         id=update_data.id,
         full_name=update_data.full_name,
         specialty=update_data.specialty,
@@ -73,7 +73,7 @@ async def update_my_doctor_profile(
         email=update_data.email
     )
 
-    updated = get_doctor_by_id(doctor_id)
+    updated = await get_doctor_by_id(doctor_id)
     return updated
 
 
@@ -83,13 +83,13 @@ async def get_doctor_api(
     doctor_id: int,
     current_user: dict = Depends(auth_handler.get_current_admin_user),
 ):
-    doctor = get_doctor_by_id(doctor_id)
+    doctor = await get_doctor_by_id(doctor_id)
     return JSONResponse(status_code=status.HTTP_200_OK, content=jsonable_encoder(doctor))
 
 
 # API: Cập nhật thông tin 1 bác sĩ theo ID (chỉ admin)
 @router.put("/{doctor_id}", response_model=DoctorResponseModel)
-def update_doctor_api(
+async def update_doctor_api(
     doctor_id: int,
     doctor_details: DoctorUpdateRequestModel,
     current_user: DoctorUser = Depends(auth_handler.get_current_admin_user),
@@ -101,7 +101,7 @@ def update_doctor_api(
         )
 
     # ✅ Truyền đúng từng field
-    update_doctor(
+    await update_doctor(
         id=doctor_details.id,
         full_name=doctor_details.full_name,
         specialty=doctor_details.specialty,
@@ -109,15 +109,15 @@ def update_doctor_api(
         email=doctor_details.email
     )
 
-    updated = get_doctor_by_id(doctor_id)
+    updated = await get_doctor_by_id(doctor_id)
     return JSONResponse(status_code=status.HTTP_200_OK, content=jsonable_encoder(updated))
 
 
 # API: Xóa 1 bác sĩ theo ID (chỉ admin)
 @router.delete("/{doctor_id}", status_code=status.HTTP_200_OK)
-def delete_doctor_api(
+async def delete_doctor_api(
     doctor_id: int,
     current_user: DoctorUser = Depends(auth_handler.get_current_admin_user),
 ):
-    delete_doctor(doctor_id)
+    await delete_doctor(doctor_id)
     return {"message": "Xóa bác sĩ thành công"}
@@ -14,6 +14,9 @@ from backend.clinic_doctor_asignments.routers import router as clinic_doctor_asi
 from backend.users.routers import router as users_router
 from backend.schedule_doctors.routers import router as schedule_doctors_router
 from backend.payments.routers import router as payments_router
+from backend.monitoring.routers import router as monitoring_router
+from backend.database.async_connector import AsyncDatabaseConnector
+from backend.appointments.tickets import render_pool
 from dotenv import load_dotenv
 import os
 
@@ -44,6 +47,16 @@ class TimezoneMiddleware(BaseHTTPMiddleware):
 # Đăng ký middleware
 app.add_middleware(TimezoneMiddleware)
 
+# Đóng pool async khi tắt app
+@app.on_event("shutdown")
+async def close_async_db_pools():
+    await AsyncDatabaseConnector.close_all()
+
+# Dừng các process render phiếu khám
+@app.on_event("shutdown")
+def stop_ticket_render_pool():
+    render_pool.shutdown()
+
 @app.get("/")
 def root():
     return {"message": "Cay KIOS API is running!"}
@@ -67,6 +80,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "X-Sync-Watermark"],
 )
 
 # Auth APIs
@@ -83,3 +97,4 @@ app.include_router(clinic_doctor_asignments_router)
 app.include_router(schedule_doctors_router)
 app.include_router(users_router)
 app.include_router(payments_router)
+app.include_router(monitoring_router)
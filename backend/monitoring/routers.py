@@ -0,0 +1,43 @@
+from fastapi import APIRouter, Depends, status
+from fastapi.responses import JSONResponse
+from backend.auth.providers.auth_providers import AuthProvider, AdminUser
+from backend.database.connector import DatabaseConnector
+from backend.auth.providers.principal_cache import principal_cache
+from backend.appointments.seat_reservations import seat_engine
+from backend.appointments.controllers import booking_queue
+from backend.appointments.sequence_allocator import sequence_allocator
+from backend.schedule_doctors.availability_cache import availability_cache
+from backend.realtime.broker import broker
+from backend.appointments.queue_board import queue_board
+from backend.appointments.ticket_cache import ticket_cache
+from backend.appointments.tickets import render_pool
+from backend.database.reference_cache import reference_cache
+from backend.database.versions import versions
+
+router = APIRouter(prefix="/monitoring", tags=["Monitoring"])
+auth_handler = AuthProvider()
+db = DatabaseConnector()
+
+
+# API: Số liệu connection pool MySQL (chỉ admin)
+@router.get("/db-pool")
+def api_db_pool_stats(current_user: AdminUser = Depends(auth_handler.get_current_admin_user)):
+    return JSONResponse(status_code=status.HTTP_200_OK, content=db.pool_stats())
+
+
+# API: Số liệu hit/miss của các cache trong process (chỉ admin)
+@router.get("/caches")
+def api_cache_stats(current_user: AdminUser = Depends(auth_handler.get_current_admin_user)):
+    return JSONResponse(status_code=status.HTTP_200_OK, content={
+        "principals": principal_cache.stats(),
+        "seat_reservations": seat_engine.stats(),
+        "booking_group_commit": booking_queue.stats(),
+        "sequence_allocator": sequence_allocator.stats(),
+        "availability": availability_cache.stats(),
+        "realtime_broker": broker.stats(),
+        "queue_board": queue_board.stats(),
+        "visit_tickets": ticket_cache.stats(),
+        "ticket_render_pool": render_pool.stats(),
+        "reference_data": reference_cache.stats(),
+        "etag_versions": versions.stats(),
+    })
@@ -2,6 +2,8 @@ from typing import Optional
 from fastapi import HTTPException, status
 from backend.database.connector import DatabaseConnector
 from backend.auth.providers.partient_provider import PatientProvider, AuthUser
+from backend.auth.providers.principal_cache import invalidate_patient
+from backend.appointments.ticket_cache import ticket_cache
 from backend.patients.models import PatientUpdateRequestModel
 
 auth_handler = PatientProvider()
@@ -47,6 +49,8 @@ def update_patient(patient_id: int, patient_model: PatientUpdateRequestModel) ->
     )
 
     call_procedure("sp_update_patient", params)
+    invalidate_patient(patient_id)
+    ticket_cache.forget_patient(patient_id)
     return 1  # Có thể đổi thành rowcount nếu procedure trả về
 
 
@@ -106,3 +110,5 @@ def get_patient_by_id(patient_id: int) -> dict:
 # Xóa bệnh nhân theo ID
 def delete_patient_by_id(patient_id: int) -> None:
     call_procedure("sp_delete_patient", (patient_id,))
+    invalidate_patient(patient_id)
+    ticket_cache.forget_patient(patient_id)
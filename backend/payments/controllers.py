@@ -1,7 +1,10 @@
-import os, time, secrets, json, httpx
+import os, time, secrets, json, httpx, asyncio
 from typing import Optional, Dict, Any
 from fastapi import HTTPException, status
 from backend.database.connector import DatabaseConnector
+from backend.database.async_connector import AsyncDatabaseConnector
+from backend.appointments.controllers import prerender_visit_ticket
+from backend.appointments.ticket_cache import ticket_cache
 from .models import Bank_informayion
 import re
 
@@ -11,6 +14,46 @@ SEPAY_TOKEN = os.getenv("SEPAY_TOKEN")
 SEPAY_WEBHOOK_SECRET = os.getenv("SEPAY_WEBHOOK_SECRET")
 
 db = DatabaseConnector()
+adb = AsyncDatabaseConnector()
+
+# Đồng bộ appointment_latest_payments từ 1 dòng payment_orders (chạy trong transaction của caller).
+# Chỉ ghi đè khi đơn này mới bằng/hơn đơn đang lưu -> thứ tự gọi không quan trọng.
+# payment_order_id phải gán cuối cùng vì MySQL tính các phép gán từ trái sang phải.
+_SYNC_LATEST_PAYMENT_SQL = """
+    INSERT INTO appointment_latest_payments
+        (appointment_id, payment_order_id, order_code, status, paid_at, qr_code_url)
+    SELECT appointment_id, id, order_code, status, paid_at, qr_code_url
+    FROM payment_orders WHERE id=%s
+    ON DUPLICATE KEY UPDATE
+        order_code       = IF(VALUES(payment_order_id) >= payment_order_id, VALUES(order_code),  order_code),
+        status           = IF(VALUES(payment_order_id) >= payment_order_id, VALUES(status),      status),
+        paid_at          = IF(VALUES(payment_order_id) >= payment_order_id, VALUES(paid_at),     paid_at),
+        qr_code_url      = IF(VALUES(payment_order_id) >= payment_order_id, VALUES(qr_code_url), qr_code_url),
+        payment_order_id = GREATEST(payment_order_id, VALUES(payment_order_id))
+"""
+
+async def _update_order(po_id: int, sql: str, params: tuple) -> int:
+    """UPDATE payment_orders + đồng bộ projection đơn mới nhất trong 1 transaction"""
+    try:
+        async with adb.get_connection() as conn:
+            await conn.begin()
+            async with conn.cursor() as cur:
+                await cur.execute(sql, params)
+                affected = cur.rowcount
+                await cur.execute(_SYNC_LATEST_PAYMENT_SQL, (po_id,))
+            await conn.commit()
+            return affected
+    except Exception as e:
+        raise HTTPException(500, f"DB error: {e}")
+
+_background_tasks: set = set()
+
+async def _prerender_ticket(appointment_id: int) -> None:
+    # chạy nền: lỗi/pool render đầy thì bỏ qua, lần in đầu tiên sẽ tự render
+    try:
+        await prerender_visit_ticket(appointment_id)
+    except Exception:
+        pass
 
 def _gen_order_code(appointment_id: int) -> str:
     # ví dụ: APPT-123-250812-AB12
@@ -25,7 +68,7 @@ async def create_payment_order(
     Tạo 1 đơn thanh toán (VA theo đơn hàng) + gọi SePay trả VA/QR.
     """
     # 1) Lấy appointment + check tồn tại
-    appt = db.query_get("""
+    appt = await adb.query_get("""
         SELECT a.id, a.cur_price, a.patient_id, a.clinic_id, a.service_id
         FROM appointments a WHERE a.id=%s
     """, (appointment_id,))
@@ -38,7 +81,7 @@ async def create_payment_order(
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Appointment not found")
 
     # 2) Không cho tạo nếu đã có đơn chưa thanh toán
-    exists = db.query_get("""
+    exists = await adb.query_get("""
         SELECT id FROM payment_orders
         WHERE appointment_id=%s AND status IN ('PENDING','AWAITING') LIMIT 1
     """, (appointment_id,))
@@ -50,10 +93,10 @@ async def create_payment_order(
 
     # 3) INSERT payment_orders (PENDING) và lấy id
     try:
-        conn = db.get_connection()
-        with conn:
-            with conn.cursor() as cur:
-                cur.execute("""
+        async with adb.get_connection() as conn:
+            await conn.begin()
+            async with conn.cursor() as cur:
+                await cur.execute("""
                     INSERT INTO payment_orders
                       (appointment_id, patient_id, clinic_id, service_id,
                        order_code, amount_vnd, status, method, provider)
@@ -61,11 +104,14 @@ async def create_payment_order(
                 """, (appointment_id, appt["patient_id"], appt["clinic_id"],
                       appt["service_id"], order_code, amount))
                 po_id = cur.lastrowid
-            conn.commit()
+                await cur.execute(_SYNC_LATEST_PAYMENT_SQL, (po_id,))
+            await conn.commit()
     except Exception as e:
         raise HTTPException(500, f"DB error: {e}")
+    # đơn mới thành đơn mới nhất -> phiếu đã cache (nếu có) không còn đúng trạng thái thanh toán
+    ticket_cache.forget([appointment_id])
 
-    bank_if = db.query_get("""
+    bank_if = await adb.query_get("""
         SELECT a.account_number, a.bank_name, a.va
         FROM bank_information a
     """, ())
@@ -81,7 +127,7 @@ async def create_payment_order(
 
 
     # 5) Cập nhật đơn sang AWAITING + lưu VA/QR
-    db.query_put("""
+    await _update_order(po_id, """
         UPDATE payment_orders
         SET status='AWAITING', sepay_order_id=%s, va_number=%s, qr_code_url=%s
         WHERE id=%s
@@ -150,7 +196,7 @@ def extract_order_code_from_content(content: str) -> Optional[str]:
         return match.group(0)
     return None
 
-def handle_sepay_webhook(payload: Dict[str, Any]) -> Dict[str, Any]:
+async def handle_sepay_webhook(payload: Dict[str, Any]) -> Dict[str, Any]:
     """
     Xử lý webhook biến động/VA: idempotent + map về payment_orders bằng code.
     """
@@ -159,7 +205,7 @@ def handle_sepay_webhook(payload: Dict[str, Any]) -> Dict[str, Any]:
         raise HTTPException(400, "Missing id")
 
     # 1) Idempotent
-    existed = db.query_get("SELECT id FROM payment_events WHERE sepay_tx_id=%s", (tx_id,))
+    existed = await adb.query_get("SELECT id FROM payment_events WHERE sepay_tx_id=%s", (tx_id,))
     if existed:
         return {"success": "da thanh toan"}
 
@@ -171,7 +217,7 @@ def handle_sepay_webhook(payload: Dict[str, Any]) -> Dict[str, Any]:
     order_code = extract_order_code_from_content(content)
 
     # 2) Lưu event trước (audit)
-    db.query_put("""
+    await adb.query_put("""
         INSERT INTO payment_events (sepay_tx_id, code, reference_code,
                 transfer_amount, transfer_type, content, raw_payload)
         VALUES (%s, %s, %s, %s, %s, %s, CAST(%s AS JSON))
@@ -180,27 +226,31 @@ def handle_sepay_webhook(payload: Dict[str, Any]) -> Dict[str, Any]:
     # 3) Map về payment_orders và cập nhật trạng thái
     if ttype == "in":
         # Lock nhẹ bằng update có điều kiện trạng thái
-        rows = db.query_get("""
-            SELECT id, amount_vnd, status FROM payment_orders WHERE order_code=%s
+        rows = await adb.query_get("""
+            SELECT id, appointment_id, amount_vnd, status FROM payment_orders WHERE order_code=%s
         """, (order_code,))
         if rows:
             po = rows[0]
             if po["status"] in ("PENDING", "AWAITING"):
                 if amount >= po["amount_vnd"]:
-                    db.query_put("""
+                    await _update_order(po["id"], """
                         UPDATE payment_orders
                         SET status='PAID', paid_at=NOW()
                         WHERE id=%s
                     """, (po["id"],))
+                    # render sẵn phiếu khám để kiosk in ngay (không chặn phản hồi webhook)
+                    task = asyncio.create_task(_prerender_ticket(po["appointment_id"]))
+                    _background_tasks.add(task)
+                    task.add_done_callback(_background_tasks.discard)
                 elif 0 < amount < po["amount_vnd"]:
-                    db.query_put("UPDATE payment_orders SET status='PARTIALLY' WHERE id=%s", (po["id"],))
+                    await _update_order(po["id"], "UPDATE payment_orders SET status='PARTIALLY' WHERE id=%s", (po["id"],))
     else:
         return {"success": "khong co code"}
 
     return {"success": True}
 
-def update_bank_account(bank_account : Bank_informayion ):
-    result = db.query_put("""
+async def update_bank_account(bank_account : Bank_informayion ):
+    result = await adb.query_put("""
         UPDATE bank_information
         SET bank_name = %s, va = %s, account_number = %s
         WHERE id = 1;
@@ -209,8 +259,8 @@ def update_bank_account(bank_account : Bank_informayion ):
         return "erorr"
     return "update_sucess"
 
-def get_bank_information():
-    result = db.query_get("""
+async def get_bank_information():
+    result = await adb.query_get("""
         SELECT account_number, bank_name, va
         FROM bank_information
         WHERE id = 1;
@@ -48,18 +48,18 @@ def get_order(
 async def sepay_webhook(request: Request, Authorization: str = Header(None)):
     verify_webhook_auth(Authorization)
     payload = await request.json()
-    return handle_sepay_webhook(payload)
+    return await handle_sepay_webhook(payload)
 
 @router.put("/bank_information")
 async def update_bank(
     bank_if : Bank_informayion,
     current_user: AdminUser = Depends(auth_user_handler.get_current_admin_user)
     ):
-    return update_bank_account(bank_if)
+    return await update_bank_account(bank_if)
 
 @router.get("/bank_information", response_model=Bank_informayion)
 async def get_bank(
     current_user: AdminUser = Depends(auth_user_handler.get_current_admin_user)
     ):
-    bank = get_bank_information()
+    bank = await get_bank_information()
     return JSONResponse(status_code=status.HTTP_200_OK, content=jsonable_encoder(bank))
\ No newline at end of file
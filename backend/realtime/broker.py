@@ -0,0 +1,106 @@
+import asyncio
+import json
+import threading
+from typing import AsyncIterator, Awaitable, Callable, Dict, Hashable, Iterable, Optional, Set
+
+
+class Subscription:
+    """1 kết nối đang nghe 1 topic; hàng đợi nằm trên event loop của kết nối đó"""
+
+    def __init__(self, broker: "Broker", topic: Hashable, loop: asyncio.AbstractEventLoop, maxsize: int):
+        self.broker = broker
+        self.topic = topic
+        self.loop = loop
+        self.queue: "asyncio.Queue[dict]" = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def _put(self, event: dict) -> None:
+        # chạy trên event loop; client chậm -> bỏ event cũ nhất, giữ event mới
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+    def close(self) -> None:
+        self.broker.unsubscribe(self)
+
+
+class Broker:
+    """
+    Pub/sub trong process cho các màn hình realtime (kiosk, bảng gọi số).
+    - publish() gọi được từ thread bất kỳ (controller sync chạy trong threadpool).
+    - Mỗi subscriber là 1 asyncio.Queue; event được đẩy sang loop bằng call_soon_threadsafe.
+    Chỉ phát trong 1 process: chạy nhiều worker thì mỗi worker phát event của chính nó.
+    """
+
+    def __init__(self, queue_size: int = 100):
+        self.queue_size = queue_size
+        self._subs: Dict[Hashable, Set[Subscription]] = {}
+        self._lock = threading.Lock()
+        self._stats = {"published": 0, "delivered": 0}
+
+    def subscribe(self, topic: Hashable) -> Subscription:
+        sub = Subscription(self, topic, asyncio.get_running_loop(), self.queue_size)
+        with self._lock:
+            self._subs.setdefault(topic, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        with self._lock:
+            subs = self._subs.get(sub.topic)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subs[sub.topic]
+
+    def publish(self, topic: Hashable, event: dict) -> int:
+        with self._lock:
+            subs = list(self._subs.get(topic, ()))
+            self._stats["published"] += 1
+            self._stats["delivered"] += len(subs)
+        for sub in subs:
+            try:
+                sub.loop.call_soon_threadsafe(sub._put, event)
+            except RuntimeError:
+                # loop đã đóng (kết nối chết khi tắt app)
+                self.unsubscribe(sub)
+        return len(subs)
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self._stats)
+            data["topics"] = len(self._subs)
+            data["subscribers"] = sum(len(s) for s in self._subs.values())
+            data["dropped"] = sum(sub.dropped for s in self._subs.values() for sub in s)
+        return data
+
+
+def _sse(event: dict) -> str:
+    return f"event: {event.get('type', 'message')}\ndata: {json.dumps(event, ensure_ascii=False, default=str)}\n\n"
+
+
+async def sse_stream(
+    sub: Subscription,
+    *,
+    initial: Iterable[dict] = (),
+    is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+    heartbeat: float = 15.0,
+) -> AsyncIterator[str]:
+    """Text/event-stream: gửi snapshot ban đầu, sau đó event của topic + heartbeat để giữ kết nối"""
+    try:
+        for event in initial:
+            yield _sse(event)
+        while True:
+            try:
+                event = await asyncio.wait_for(sub.queue.get(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                if is_disconnected is not None and await is_disconnected():
+                    break
+                yield ": ping\n\n"
+                continue
+            yield _sse(event)
+    finally:
+        sub.close()
+
+
+broker = Broker()
@@ -0,0 +1,238 @@
+import os
+import threading
+import time
+from datetime import date, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from backend.database.cache import TTLCache
+from backend.database.connector import DatabaseConnector
+from backend.database.versions import versions
+
+db = DatabaseConnector()
+
+MonthKey = Tuple[int, int, str]  # (doctor_id, clinic_id, "YYYY-MM")
+
+
+def _month_key(doctor_id: int, clinic_id: int, work_date: date) -> MonthKey:
+    return (int(doctor_id), int(clinic_id), work_date.strftime("%Y-%m"))
+
+
+def availability_topic(doctor_id: int, clinic_id: int, work_date: date) -> tuple:
+    """Topic broker cho màn hình chỗ trống của 1 (bác sĩ, phòng khám, ngày)"""
+    return ("availability", int(doctor_id), int(clinic_id), str(work_date))
+
+
+def availability_version(doctor_id: int, clinic_id: int, month: str) -> int:
+    """Phiên bản dữ liệu ca của 1 tháng ("YYYY-MM") trong process này, dùng cho ETag"""
+    return versions.get(("availability", int(doctor_id), int(clinic_id), month))[0]
+
+
+def _time_str(v: Any) -> str:
+    """TIME (timedelta/time/str) -> 'HH:MM:SS' như CAST(... AS CHAR(8))"""
+    if isinstance(v, timedelta):
+        secs = int(v.total_seconds())
+        return f"{secs // 3600:02d}:{secs % 3600 // 60:02d}:{secs % 60:02d}"
+    if hasattr(v, "strftime"):
+        return v.strftime("%H:%M:%S")
+    return str(v)
+
+
+class _MonthEntry:
+    __slots__ = ("shifts", "loaded_at", "updates")
+
+    def __init__(self, shifts: Dict[int, dict]):
+        self.shifts = shifts          # schedule_id -> row
+        self.loaded_at = time.monotonic()
+        self.updates = 0              # số lần cập nhật tại chỗ từ lúc nạp
+
+
+class _LoadTicket:
+    __slots__ = ("dirty",)
+
+    def __init__(self):
+        self.dirty = False            # có ghi vào tháng này trong lúc đang nạp
+
+
+class AvailabilityCache:
+    """
+    Cache ca làm việc theo (doctor_id, clinic_id, tháng) cho lịch/khung giờ của bệnh nhân.
+    - Miss -> nạp cả tháng bằng 1 query; đọc calendar/day-shifts từ bộ nhớ.
+    - Đặt lịch/hủy/đổi trạng thái: ghi đè booked/max bằng giá trị đọc trong transaction (tuyệt đối, không cộng dồn).
+    - Sửa ca: cập nhật tại chỗ; tạo/xóa ca: bỏ tháng liên quan.
+    - Hook sau commit có thể đến lệch thứ tự: chỉ áp dụng khi capacity_version mới hơn dòng đang có.
+    - TTL chỉ là lưới an toàn. Lượt nạp chạy song song với 1 lần ghi vào cùng tháng thì không được lưu.
+    - Chỉ mục schedule_id -> tháng được tỉa theo các tháng còn trong cache; cờ ghi chen chỉ tồn tại khi đang nạp.
+    - Mọi lần ghi tăng phiên bản ("availability", doctor_id, clinic_id, tháng) cho ETag calendar/day-shifts.
+    """
+
+    def __init__(self, maxsize: int = 5000, ttl: float = 300.0):
+        self.ttl = ttl
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._index: Dict[int, MonthKey] = {}          # schedule_id -> key tháng (tỉa theo tháng còn trong cache)
+        self._index_limit = 1024
+        self._loading: Dict[MonthKey, List[_LoadTicket]] = {}  # chỉ các lượt nạp đang chạy
+        self._lock = threading.Lock()
+        self._stats = {"loads": 0, "discarded_loads": 0, "incremental_updates": 0, "stale_updates": 0,
+                       "served": 0, "served_age_total": 0.0, "max_served_age_seconds": 0.0}
+
+    # ---------- đọc ----------
+
+    def get_month(self, doctor_id: int, clinic_id: int, month_start: date) -> List[dict]:
+        key = _month_key(doctor_id, clinic_id, month_start)
+        entry: Optional[_MonthEntry] = self._cache.get(key)
+        if entry is None:
+            entry = self._load(key, month_start)
+        with self._lock:
+            # độ "cũ" của dữ liệu trả ra (tính từ lúc nạp từ DB)
+            age = time.monotonic() - entry.loaded_at
+            self._stats["served"] += 1
+            self._stats["served_age_total"] += age
+            self._stats["max_served_age_seconds"] = max(self._stats["max_served_age_seconds"], round(age, 3))
+            return [dict(r) for r in entry.shifts.values()]
+
+    def _load(self, key: MonthKey, month_start: date) -> _MonthEntry:
+        doctor_id, clinic_id, _ = key
+        first = month_start.replace(day=1)
+        nxt = date(first.year + (first.month == 12), 1 if first.month == 12 else first.month + 1, 1)
+        ticket = _LoadTicket()
+        with self._lock:
+            self._loading.setdefault(key, []).append(ticket)
+        try:
+            rows = db.query_get(
+                """
+                SELECT id, work_date,
+                       CAST(start_time AS CHAR(8)) AS start_time,
+                       CAST(end_time   AS CHAR(8)) AS end_time,
+                       avg_minutes_per_patient, max_patients, booked_patients, capacity_version, status, note
+                FROM doctor_schedules
+                WHERE doctor_id=%s AND clinic_id=%s
+                  AND work_date >= %s AND work_date < %s
+                """,
+                (doctor_id, clinic_id, first, nxt),
+            )
+        except BaseException:
+            with self._lock:
+                self._end_load(key, ticket)
+            raise
+        entry = _MonthEntry({int(r["id"]): r for r in rows})
+        with self._lock:
+            self._end_load(key, ticket)
+            self._stats["loads"] += 1
+            if ticket.dirty:
+                # có ghi chen giữa: dùng cho lần đọc này nhưng không lưu
+                self._stats["discarded_loads"] += 1
+                return entry
+            for sid in entry.shifts:
+                self._index[sid] = key
+            self._cache.set(key, entry)
+            if len(self._index) > self._index_limit:
+                self._prune_index()
+        return entry
+
+    def _end_load(self, key: MonthKey, ticket: _LoadTicket) -> None:
+        tickets = self._loading[key]
+        tickets.remove(ticket)
+        if not tickets:
+            del self._loading[key]
+
+    def _prune_index(self) -> None:
+        """Bỏ chỉ mục của các tháng đã hết TTL/bị LRU đẩy ra (gọi khi giữ self._lock, chi phí chia đều)"""
+        live = {k for k in set(self._index.values()) if self._cache.peek(k) is not None}
+        self._index = {sid: k for sid, k in self._index.items() if k in live}
+        self._index_limit = max(1024, 2 * len(self._index))
+
+    def _mark_written(self, key: MonthKey) -> None:
+        """Gọi khi giữ self._lock: lượt nạp đang chạy của tháng này không được lưu"""
+        for ticket in self._loading.get(key, ()):
+            ticket.dirty = True
+        versions.bump(("availability",) + key)
+
+    # ---------- cập nhật ----------
+
+    def capacity_changed(self, schedule_id: int, doctor_id: int, clinic_id: int, work_date: date,
+                         *, booked_patients: int, max_patients: int, version: int) -> None:
+        """Giá trị tuyệt đối + capacity_version đọc trong transaction đặt lịch/hủy/đổi trạng thái"""
+        key = _month_key(doctor_id, clinic_id, work_date)
+        with self._lock:
+            self._mark_written(key)
+            entry: Optional[_MonthEntry] = self._cache.peek(key)
+            row = entry.shifts.get(int(schedule_id)) if entry else None
+            if row is None:
+                return
+            if int(version) <= int(row.get("capacity_version") or 0):
+                self._stats["stale_updates"] += 1  # transaction sau đã được áp dụng (hoặc đã có khi nạp)
+                return
+            row["booked_patients"] = int(booked_patients)
+            row["max_patients"] = int(max_patients)
+            row["capacity_version"] = int(version)
+            entry.updates += 1
+            self._stats["incremental_updates"] += 1
+
+    def shifts_edited(self, doctor_id: int, clinic_id: int, work_date: date, rows: Iterable[dict]) -> None:
+        """
+        Sửa ca trong ngày: rows là trạng thái sau khi gộp (có id, capacity_version mới + các cột đã sửa).
+        Đến sau 1 cập nhật mới hơn thì giờ/ghi chú của lần sửa không có trong dòng cache -> bỏ cả tháng.
+        """
+        key = _month_key(doctor_id, clinic_id, work_date)
+        with self._lock:
+            entry: Optional[_MonthEntry] = self._cache.peek(key)
+            if entry is None:
+                self._mark_written(key)
+                return
+            edits = [(entry.shifts[int(r["id"])], r) for r in rows if int(r["id"]) in entry.shifts]
+            if any(int(r["capacity_version"]) <= int(row.get("capacity_version") or 0) for row, r in edits):
+                self._stats["stale_updates"] += 1
+                self._drop_locked(key)
+                return
+            self._mark_written(key)
+            for row, r in edits:
+                row["capacity_version"] = int(r["capacity_version"])
+                for f in ("avg_minutes_per_patient", "max_patients", "status", "note"):
+                    if f in r:
+                        row[f] = r[f]
+                for f in ("start_time", "end_time"):
+                    if f in r:
+                        row[f] = _time_str(r[f])
+                entry.updates += 1
+                self._stats["incremental_updates"] += 1
+
+    def invalidate_range(self, doctor_id: int, clinic_id: int, start: date, end: date) -> None:
+        """Tạo ca mới (bulk/rollout) -> bỏ các tháng trong khoảng [start, end]"""
+        cur = start.replace(day=1)
+        while cur <= end:
+            self._drop(_month_key(doctor_id, clinic_id, cur))
+            cur = date(cur.year + (cur.month == 12), 1 if cur.month == 12 else cur.month + 1, 1)
+
+    def invalidate_schedules(self, schedule_ids: Iterable[int]) -> None:
+        """Xóa ca -> bỏ tháng chứa ca đó"""
+        with self._lock:
+            keys = {self._index.pop(int(sid), None) for sid in schedule_ids}
+        for key in keys - {None}:
+            self._drop(key)
+
+    def _drop(self, key: MonthKey) -> None:
+        with self._lock:
+            self._drop_locked(key)
+
+    def _drop_locked(self, key: MonthKey) -> None:
+        self._mark_written(key)
+        entry: Optional[_MonthEntry] = self._cache.peek(key)
+        if entry is not None:
+            for sid in entry.shifts:
+                self._index.pop(sid, None)
+        self._cache.pop(key)
+
+    def stats(self) -> dict:
+        data = self._cache.stats()
+        with self._lock:
+            data.update(self._stats)
+            served_age_total = data.pop("served_age_total")
+            data["avg_served_age_seconds"] = round(served_age_total / data["served"], 3) if data["served"] else 0.0
+            data["indexed_schedules"] = len(self._index)
+        return data
+
+
+availability_cache = AvailabilityCache(
+    maxsize=int(os.getenv("AVAILABILITY_CACHE_SIZE", "5000")),
+    ttl=float(os.getenv("AVAILABILITY_CACHE_TTL", "300")),
+)
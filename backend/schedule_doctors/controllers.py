@@ -1,12 +1,17 @@
 from __future__ import annotations
+import json
+import os
 import pymysql
 from collections import defaultdict
 from datetime import datetime, timedelta, date
-from typing import List, Dict, Any, Set
+from typing import List, Dict, Any, Set, Iterator, Callable
 from datetime import datetime, timedelta, date, time, timezone
 from fastapi import HTTPException, status
 
 from backend.database.connector import DatabaseConnector
+from backend.database.unit_of_work import after_commit
+from backend.appointments.seat_reservations import seat_engine
+from backend.schedule_doctors.availability_cache import availability_cache
 from backend.schedule_doctors.models import (
     ShiftCreateRequestModel,
     MultiShiftBulkCreateRequestModel,
@@ -14,6 +19,8 @@ from backend.schedule_doctors.models import (
     CalendarDayDTO,
     DayShiftDTO,
     DayUpsertRequest,
+    RosterEntry,
+    DepartmentRolloutRequestModel,
 )
 
 db = DatabaseConnector()
@@ -73,23 +80,63 @@ def _payload_self_conflicts(shifts: List[ShiftTimeConfig]) -> List[str]:
         cnt[str(s.start_time)] += 1
     return [t for t, n in cnt.items() if n > 1]
 
+def _ensure_doctor_can_work_at(doctor_id: int, clinic_id: int) -> None:
+    """Gộp 2 kiểm tra (bác sĩ tồn tại + đã gán phòng khám) vào 1 query"""
+    row = db.query_one(
+        """
+        SELECT d.id,
+               EXISTS(SELECT 1 FROM clinic_doctor_assignments a
+                      WHERE a.doctor_id = d.id AND a.clinic_id = %s) AS assigned
+        FROM doctors d
+        WHERE d.id = %s
+        """,
+        (clinic_id, doctor_id),
+    )
+    if not row:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Không tìm thấy bác sĩ")
+    if not row["assigned"]:
+        raise HTTPException(status.HTTP_409_CONFLICT, "Bác sĩ chưa được gán vào phòng khám này")
+
 def _fetch_existing_shifts(doctor_id: int, clinic_id: int, target_dates: List[date]) -> Dict[str, Set[str]]:
     if not target_dates:
         return {}
-    placeholders = ",".join(["%s"] * len(target_dates))
-    sql = f"""
+    # Quét theo khoảng ngày (dùng index) thay vì IN hàng trăm ngày, lọc lại trong bộ nhớ
+    sql = """
         SELECT work_date, CAST(start_time AS CHAR(8)) AS start_time
         FROM doctor_schedules
         WHERE doctor_id=%s AND clinic_id=%s
-          AND work_date IN ({placeholders})
+          AND work_date >= %s AND work_date < %s
     """
-    rows = db.query_get(sql, (doctor_id, clinic_id, *target_dates))
+    rows = db.query_get(sql, (doctor_id, clinic_id, min(target_dates), max(target_dates) + timedelta(days=1)))
+    wanted = {str(d) for d in target_dates}
     result: Dict[str, Set[str]] = defaultdict(set)
     for r in rows:
         d = str(r["work_date"])
-        result[d].add(r["start_time"])
+        if d in wanted:
+            result[d].add(r["start_time"])
     return result
 
+SCHEDULE_INSERT_BATCH = int(os.getenv("SCHEDULE_INSERT_BATCH", "500"))
+
+_INSERT_SCHEDULE_SQL = """
+    INSERT INTO doctor_schedules
+        (doctor_id, clinic_id, work_date, start_time, end_time,
+         avg_minutes_per_patient, max_patients, status, note)
+    VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s)
+"""
+
+def _insert_schedule_rows(cur, rows: List[tuple], batch_size: int = SCHEDULE_INSERT_BATCH) -> int:
+    """
+    INSERT nhiều ca theo lô multi-row (executemany gộp VALUES khi toàn placeholder).
+    Chạy trên cursor của transaction bên ngoài -> commit/rollback do caller quyết định.
+    """
+    inserted = 0
+    for i in range(0, len(rows), batch_size):
+        chunk = rows[i:i + batch_size]
+        cur.executemany(_INSERT_SCHEDULE_SQL, chunk)
+        inserted += len(chunk)
+    return inserted
+
 # ============================================================
 # Create single shift
 # ============================================================
@@ -133,7 +180,6 @@ def create_shift(payload: ShiftCreateRequestModel) -> Dict[str, Any]:
         )
         if not row:
             raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, "Không đọc được ca vừa tạo")
-        return row
 
     except pymysql.err.IntegrityError as ie:
         code = ie.args[0] if ie.args else None
@@ -152,6 +198,10 @@ def create_shift(payload: ShiftCreateRequestModel) -> Dict[str, Any]:
             raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="doctor_id/clinic_id không hợp lệ")
         raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Lỗi cơ sở dữ liệu")
 
+    after_commit(availability_cache.invalidate_range, payload.doctor_id, payload.clinic_id,
+                 payload.work_date, payload.work_date)
+    return row
+
 def create_shift_for_doctor(doctor_id: int, payload: ShiftCreateRequestModel) -> Dict[str, Any]:
     _ensure_doctor_exists(doctor_id)
     _ensure_doctor_assigned_to_clinic(doctor_id, payload.clinic_id)
@@ -171,8 +221,7 @@ def bulk_create_shifts(payload: MultiShiftBulkCreateRequestModel) -> Dict[str, i
     if payload.start_date > payload.end_date:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, "start_date phải <= end_date")
 
-    _ensure_doctor_exists(payload.doctor_id)
-    _ensure_doctor_assigned_to_clinic(payload.doctor_id, payload.clinic_id)
+    _ensure_doctor_can_work_at(payload.doctor_id, payload.clinic_id)
 
     dup_in_payload = _payload_self_conflicts(payload.shifts)
     if dup_in_payload:
@@ -186,55 +235,191 @@ def bulk_create_shifts(payload: MultiShiftBulkCreateRequestModel) -> Dict[str, i
     if not target_dates:
         return {"created": 0, "skipped_duplicates": 0}
 
-    existed = _fetch_existing_shifts(payload.doctor_id, payload.clinic_id, target_dates)
+    conflicts = _bulk_conflicts(payload.doctor_id, payload.clinic_id, target_dates, payload.shifts)
+    if conflicts:
+        raise HTTPException(status.HTTP_409_CONFLICT, detail={"message": "Ca đã tồn tại", "conflicts": conflicts})
+
+    # Dựng toàn bộ dòng trong bộ nhớ, ghi 1 transaction (all-or-nothing)
+    rows = [
+        (
+            payload.doctor_id, payload.clinic_id, d,
+            s.start_time, s.end_time, s.avg_minutes_per_patient, s.max_patients, s.status, s.note,
+        )
+        for d in target_dates
+        for s in payload.shifts
+    ]
 
+    conn = db.get_connection()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                created = _insert_schedule_rows(cur, rows)
+            conn.commit()
+    except HTTPException:
+        raise
+    except pymysql.err.IntegrityError as ie:
+        try: conn.rollback()
+        except Exception: pass
+        code = ie.args[0] if ie.args else None
+        if code == 1062:   # có ca được tạo chen giữa lúc kiểm tra và lúc ghi
+            conflicts = _bulk_conflicts(payload.doctor_id, payload.clinic_id, target_dates, payload.shifts)
+            raise HTTPException(status.HTTP_409_CONFLICT, detail={"message": "Ca đã tồn tại", "conflicts": conflicts})
+        if code == 1452:
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="doctor_id/clinic_id không hợp lệ")
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Lỗi ràng buộc CSDL")
+    except Exception as e:
+        try: conn.rollback()
+        except Exception: pass
+        raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Database error: {repr(e)}")
+
+    after_commit(availability_cache.invalidate_range, payload.doctor_id, payload.clinic_id,
+                 payload.start_date, payload.end_date)
+    return {"created": created, "skipped_duplicates": 0}
+
+def _bulk_conflicts(doctor_id: int, clinic_id: int, target_dates: List[date],
+                    shifts: List[ShiftTimeConfig]) -> List[Dict[str, str]]:
+    existed = _fetch_existing_shifts(doctor_id, clinic_id, target_dates)
     conflicts: List[Dict[str, str]] = []
     for d in target_dates:
         d_str = str(d)
         existed_times = existed.get(d_str, set())
-        for s in payload.shifts:
+        for s in shifts:
             if str(s.start_time) in existed_times:
                 conflicts.append({"work_date": d_str, "start_time": str(s.start_time)})
+    return conflicts
+
+# ============================================================
+# Rollout cấp khoa (nhiều bác sĩ / phòng khám, 1 transaction)
+# ============================================================
+
+def _ensure_roster_valid(roster: List[RosterEntry]) -> None:
+    """Kiểm tra bác sĩ + phân công phòng khám cho cả roster: mỗi loại 1 query"""
+    doctor_ids = sorted({e.doctor_id for e in roster})
+    ph = ",".join(["%s"] * len(doctor_ids))
+    found = {int(r["id"]) for r in db.query_get(f"SELECT id FROM doctors WHERE id IN ({ph})", tuple(doctor_ids))}
+    missing = [d for d in doctor_ids if d not in found]
+    if missing:
+        raise HTTPException(status.HTTP_404_NOT_FOUND,
+                            detail={"message": "Không tìm thấy bác sĩ", "doctor_ids": missing})
+
+    assigned = {
+        (int(r["doctor_id"]), int(r["clinic_id"]))
+        for r in db.query_get(
+            f"SELECT doctor_id, clinic_id FROM clinic_doctor_assignments WHERE doctor_id IN ({ph})",
+            tuple(doctor_ids),
+        )
+    }
+    unassigned = sorted({(e.doctor_id, e.clinic_id) for e in roster} - assigned)
+    if unassigned:
+        raise HTTPException(
+            status.HTTP_409_CONFLICT,
+            detail={"message": "Bác sĩ chưa được gán vào phòng khám này",
+                    "pairs": [{"doctor_id": d, "clinic_id": c} for d, c in unassigned]},
+        )
+
+def _plan_rollout_rows(payload: DepartmentRolloutRequestModel) -> List[tuple]:
+    """Dựng toàn bộ ca trong bộ nhớ; trùng trong payload/với DB -> 409 kèm danh sách"""
+    rows: List[tuple] = []
+    planned: Set[tuple] = set()
+    conflicts: List[Dict[str, Any]] = []
+    for e in payload.roster:
+        for d in _expand_target_dates(payload.start_date, payload.end_date, e.weekdays):
+            for s in e.shifts:
+                key = (e.doctor_id, e.clinic_id, str(d), str(s.start_time))
+                if key in planned:
+                    conflicts.append({"doctor_id": e.doctor_id, "clinic_id": e.clinic_id, "work_date": str(d),
+                                      "start_time": str(s.start_time), "reason": "multiple_in_payload"})
+                    continue
+                planned.add(key)
+                rows.append((e.doctor_id, e.clinic_id, d, s.start_time, s.end_time,
+                             s.avg_minutes_per_patient, s.max_patients, s.status, s.note))
+
+    # Ca đã có: 1 query theo (doctor_id IN ..., khoảng ngày)
+    if rows:
+        doctor_ids = sorted({e.doctor_id for e in payload.roster})
+        ph = ",".join(["%s"] * len(doctor_ids))
+        existing = db.query_get(
+            f"""
+            SELECT doctor_id, clinic_id, work_date, CAST(start_time AS CHAR(8)) AS start_time
+            FROM doctor_schedules
+            WHERE doctor_id IN ({ph})
+              AND work_date >= %s AND work_date < %s
+            """,
+            (*doctor_ids, payload.start_date, payload.end_date + timedelta(days=1)),
+        )
+        for r in existing:
+            key = (int(r["doctor_id"]), int(r["clinic_id"]), str(r["work_date"]), r["start_time"])
+            if key in planned:
+                conflicts.append({"doctor_id": key[0], "clinic_id": key[1], "work_date": key[2],
+                                  "start_time": key[3], "reason": "exists"})
 
     if conflicts:
         raise HTTPException(status.HTTP_409_CONFLICT, detail={"message": "Ca đã tồn tại", "conflicts": conflicts})
+    return rows
 
-    created = 0
-    cur_date = payload.start_date
-    while cur_date <= payload.end_date:
-        if cur_date.weekday() in payload.weekdays:
-            for s in payload.shifts:
-                create_shift(
-                    ShiftCreateRequestModel(
-                        doctor_id=payload.doctor_id,
-                        clinic_id=payload.clinic_id,
-                        work_date=cur_date,
-                        start_time=s.start_time,
-                        end_time=s.end_time,
-                        avg_minutes_per_patient=s.avg_minutes_per_patient,
-                        max_patients=s.max_patients,
-                        status=s.status,
-                        note=s.note,
-                    )
-                )
-                created += 1
-        cur_date += timedelta(days=1)
-
-    return {"created": created, "skipped_duplicates": 0}
+def _stream_rollout_inserts(rows: List[tuple], batch_size: int,
+                            on_commit: Callable[[], None] = lambda: None) -> Iterator[str]:
+    """
+    Ghi theo lô trong 1 transaction, mỗi lô xong trả 1 dòng NDJSON tiến độ.
+    Lỗi giữa chừng -> rollback toàn bộ, dòng cuối là event "error".
+    """
+    total = len(rows)
+    yield json.dumps({"event": "start", "total": total}) + "\n"
+    conn = db.get_connection()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                inserted = 0
+                for i in range(0, total, batch_size):
+                    inserted += _insert_schedule_rows(cur, rows[i:i + batch_size], batch_size)
+                    yield json.dumps({"event": "progress", "inserted": inserted, "total": total}) + "\n"
+            conn.commit()
+    except Exception as e:
+        try: conn.rollback()
+        except Exception: pass
+        code = e.args[0] if isinstance(e, pymysql.err.IntegrityError) and e.args else None
+        message = "Ca đã tồn tại" if code == 1062 else f"Database error: {repr(e)}"
+        yield json.dumps({"event": "error", "message": message, "created": 0}) + "\n"
+        return
+    after_commit(on_commit)
+    yield json.dumps({"event": "done", "created": total}) + "\n"
+
+def rollout_department_schedules(payload: DepartmentRolloutRequestModel) -> Iterator[str]:
+    """Validate toàn bộ trước (lỗi -> HTTP status chuẩn), sau đó mới bắt đầu stream ghi"""
+    _ensure_roster_valid(payload.roster)
+    rows = _plan_rollout_rows(payload)
+
+    def _invalidate_availability() -> None:
+        for e in payload.roster:
+            availability_cache.invalidate_range(e.doctor_id, e.clinic_id, payload.start_date, payload.end_date)
+
+    return _stream_rollout_inserts(rows, SCHEDULE_INSERT_BATCH, on_commit=_invalidate_availability)
 
 # ============================================================
 # Calendar & day shifts (read-only)
 # ============================================================
 
+def parse_month(month: str) -> date:
+    """'YYYY-MM' (chấp nhận cả '2025-1') -> ngày đầu tháng"""
+    try:
+        return datetime.strptime(month + "-01", "%Y-%m-%d").date()
+    except ValueError:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "month phải dạng YYYY-MM")
+
+
+def parse_work_date(work_date: str) -> date:
+    try:
+        return datetime.strptime(work_date, "%Y-%m-%d").date()
+    except ValueError:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "work_date phải dạng YYYY-MM-DD")
+
+
 def get_calendar_days(doctor_id: int, clinic_id: int, month: str) -> List[CalendarDayDTO]:
     """
     Trả về các ngày trong tháng có ca và còn chỗ (status=1),
     chỉ tính từ HÔM NAY trở đi theo múi giờ VN (+7).
     """
-    try:
-        start = datetime.strptime(month + "-01", "%Y-%m-%d").date()
-    except ValueError:
-        raise HTTPException(status.HTTP_400_BAD_REQUEST, "month phải dạng YYYY-MM")
+    start = parse_month(month)
 
     # ngày cuối tháng
     end = (date(start.year + (start.month == 12),
@@ -243,26 +428,18 @@ def get_calendar_days(doctor_id: int, clinic_id: int, month: str) -> List[Calend
     # Ngày hiện tại theo VN
     vn_today = datetime.now(VN_TZ).date()
 
-    rows = db.query_get(
-        """
-        SELECT ds.work_date,
-               COUNT(ds.id) AS shifts_count,
-               SUM(ds.max_patients) AS total_capacity,
-               SUM(ds.booked_patients) AS total_booked,
-               SUM(GREATEST(ds.max_patients - ds.booked_patients, 0)) AS total_remaining
-        FROM doctor_schedules ds
-        WHERE ds.doctor_id = %s
-          AND ds.clinic_id = %s
-          AND ds.work_date BETWEEN %s AND %s
-          AND ds.work_date >= %s           -- loại các ngày đã qua theo VN
-          AND ds.status = 1
-        GROUP BY ds.work_date
-        HAVING total_remaining > 0
-        ORDER BY ds.work_date
-        """,
-        (doctor_id, clinic_id, start, end, vn_today),
-    )
-    return [CalendarDayDTO(**r) for r in rows]
+    # Gộp theo ngày từ cache tháng (thay cho GROUP BY trên doctor_schedules)
+    days: Dict[date, Dict[str, int]] = {}
+    for r in availability_cache.get_month(doctor_id, clinic_id, start):
+        d = r["work_date"]
+        if d < vn_today or d > end or int(r["status"]) != 1:
+            continue
+        agg = days.setdefault(d, {"shifts_count": 0, "total_capacity": 0, "total_booked": 0, "total_remaining": 0})
+        agg["shifts_count"] += 1
+        agg["total_capacity"] += int(r["max_patients"])
+        agg["total_booked"] += int(r["booked_patients"])
+        agg["total_remaining"] += max(int(r["max_patients"]) - int(r["booked_patients"]), 0)
+    return [CalendarDayDTO(work_date=d, **agg) for d, agg in sorted(days.items()) if agg["total_remaining"] > 0]
 
 
 def get_day_shifts(doctor_id: int, clinic_id: int, work_date: date) -> List[DayShiftDTO]:
@@ -275,10 +452,7 @@ def get_day_shifts(doctor_id: int, clinic_id: int, work_date: date) -> List[DayS
     """
     # Ép kiểu khi router truyền chuỗi
     if isinstance(work_date, str):
-        try:
-            work_date = datetime.strptime(work_date, "%Y-%m-%d").date()
-        except ValueError:
-            raise HTTPException(status.HTTP_400_BAD_REQUEST, "work_date phải dạng YYYY-MM-DD")
+        work_date = parse_work_date(work_date)
 
     vn_now = datetime.now(VN_TZ)
     vn_today = vn_now.date()
@@ -288,45 +462,26 @@ def get_day_shifts(doctor_id: int, clinic_id: int, work_date: date) -> List[DayS
     if work_date < vn_today:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Không có ca khả dụng cho ngày này")
 
-    # Hôm nay -> lọc ca chưa kết thúc
-    if work_date == vn_today:
-        rows = db.query_get(
-            """
-            SELECT id AS schedule_id,
-                   CAST(start_time AS CHAR(8)) AS start_time,
-                   CAST(end_time   AS CHAR(8)) AS end_time,
-                   avg_minutes_per_patient, max_patients, booked_patients,
-                   (max_patients - booked_patients) AS remaining,
-                   status, note
-            FROM doctor_schedules
-            WHERE doctor_id = %s
-              AND clinic_id = %s
-              AND work_date = %s
-              AND status = 1
-              AND end_time > %s
-            ORDER BY start_time
-            """,
-            (doctor_id, clinic_id, work_date, vn_time_now),
-        )
-    else:
-        # Ngày tương lai -> không cần lọc theo giờ
-        rows = db.query_get(
-            """
-            SELECT id AS schedule_id,
-                   CAST(start_time AS CHAR(8)) AS start_time,
-                   CAST(end_time   AS CHAR(8)) AS end_time,
-                   avg_minutes_per_patient, max_patients, booked_patients,
-                   (max_patients - booked_patients) AS remaining,
-                   status, note
-            FROM doctor_schedules
-            WHERE doctor_id = %s
-              AND clinic_id = %s
-              AND work_date = %s
-              AND status = 1
-            ORDER BY start_time
-            """,
-            (doctor_id, clinic_id, work_date),
-        )
+    # Hôm nay -> chỉ lấy ca chưa kết thúc; ngày tương lai -> toàn bộ ca status=1
+    now_str = vn_time_now.strftime("%H:%M:%S")
+    rows = [
+        {
+            "schedule_id": r["id"],
+            "start_time": r["start_time"],
+            "end_time": r["end_time"],
+            "avg_minutes_per_patient": r["avg_minutes_per_patient"],
+            "max_patients": r["max_patients"],
+            "booked_patients": r["booked_patients"],
+            "remaining": int(r["max_patients"]) - int(r["booked_patients"]),
+            "status": r["status"],
+            "note": r["note"],
+            "capacity_version": r["capacity_version"],
+        }
+        for r in availability_cache.get_month(doctor_id, clinic_id, work_date)
+        if r["work_date"] == work_date and int(r["status"]) == 1
+        and (work_date != vn_today or r["end_time"] > now_str)
+    ]
+    rows.sort(key=lambda r: r["start_time"])
 
     if not rows:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Không có ca khả dụng cho ngày này")
@@ -337,73 +492,136 @@ def get_day_shifts(doctor_id: int, clinic_id: int, work_date: date) -> List[DayS
 # UPDATE/DELETE THEO schedule_id
 # ============================================================
 
+_DAY_EDIT_FIELDS = ("start_time", "end_time", "avg_minutes_per_patient", "max_patients", "status", "note")
+
+def _as_timedelta(v: Any) -> timedelta:
+    """TIME từ DB là timedelta, từ payload là datetime.time -> quy về timedelta để so sánh"""
+    if isinstance(v, timedelta):
+        return v
+    return timedelta(hours=v.hour, minutes=v.minute, seconds=v.second)
+
 def update_day_shifts_for_doctor(doctor_id: int, payload: DayUpsertRequest) -> Dict[str, Any]:
     """
-    UPDATE nhiều ca trong 1 ngày theo schedule_id.
-    - Giới hạn trong (doctor_id, clinic_id, work_date).
+    UPDATE nhiều ca trong 1 ngày theo schedule_id, trong 1 transaction.
+    - Giới hạn trong (doctor_id, clinic_id, work_date); khóa các ca của ngày (FOR UPDATE).
     - Chỉ cập nhật các field có gửi; set updated_at = NOW().
-    - Nếu đổi start_time đụng UNIQUE -> 409.
+    - Gộp thay đổi trong bộ nhớ, kiểm tra end > start và trùng start_time trước khi ghi -> 409.
+    - Ghi bằng 1 câu UPDATE ... CASE id (thêm 1 câu đổi tạm start_time nếu các ca đổi giờ cho nhau).
     """
-    _ensure_doctor_exists(doctor_id)
-    _ensure_doctor_assigned_to_clinic(doctor_id, payload.clinic_id)
-
-    updated = 0
-    missing: List[int] = []
-
-    for s in payload.shifts:
-        set_clauses: List[str] = []
-        values: List[Any] = []
-
-        if s.start_time is not None:
-            set_clauses.append("start_time = %s")
-            values.append(s.start_time)
-        if s.end_time is not None:
-            set_clauses.append("end_time = %s")
-            values.append(s.end_time)
-        if s.avg_minutes_per_patient is not None:
-            set_clauses.append("avg_minutes_per_patient = %s")
-            values.append(s.avg_minutes_per_patient)
-        if s.max_patients is not None:
-            set_clauses.append("max_patients = %s")
-            values.append(s.max_patients)
-        if s.status is not None:
-            set_clauses.append("status = %s")
-            values.append(s.status)
-        if s.note is not None:
-            set_clauses.append("note = %s")
-            values.append(s.note)
-
-        if not set_clauses:
-            continue
+    _ensure_doctor_can_work_at(doctor_id, payload.clinic_id)
 
-        set_clauses.append("updated_at = NOW()")
-        sql = f"""
-            UPDATE doctor_schedules
-               SET {", ".join(set_clauses)}
-             WHERE id = %s
-               AND doctor_id = %s
-               AND clinic_id = %s
-               AND work_date = %s
-        """
-        values.extend([s.schedule_id, doctor_id, payload.clinic_id, payload.work_date])
-
-        try:
-            rowcount = db.query_put(sql, tuple(values))
-            if rowcount and rowcount > 0:
-                updated += rowcount
-            else:
-                missing.append(s.schedule_id)
-        except pymysql.err.IntegrityError as ie:
-            if ie.args and ie.args[0] == 1062:
+    conn = db.get_connection()
+    try:
+        with conn:
+            cur = conn.cursor()
+            cur.execute(
+                """
+                SELECT id, start_time, end_time, avg_minutes_per_patient, max_patients, status, note,
+                       capacity_version
+                FROM doctor_schedules
+                WHERE doctor_id=%s AND clinic_id=%s AND work_date=%s
+                FOR UPDATE
+                """,
+                (doctor_id, payload.clinic_id, payload.work_date),
+            )
+            current = {int(r["id"]): r for r in cur.fetchall()}
+            merged = {sid: dict(r) for sid, r in current.items()}
+
+            results: Dict[int, str] = {}
+            changed: List[int] = []
+            for s in payload.shifts:
+                sid = int(s.schedule_id)
+                if sid not in merged:
+                    results[sid] = "missing"
+                    continue
+                fields = {f: getattr(s, f) for f in _DAY_EDIT_FIELDS if getattr(s, f) is not None}
+                if not fields:
+                    results.setdefault(sid, "unchanged")
+                    continue
+                merged[sid].update(fields)
+                results[sid] = "updated"
+                if sid not in changed:
+                    changed.append(sid)
+
+            # Kiểm tra trạng thái sau khi gộp (toàn bộ ca trong ngày)
+            bad_range = [sid for sid in changed
+                         if _as_timedelta(merged[sid]["end_time"]) <= _as_timedelta(merged[sid]["start_time"])]
+            if bad_range:
+                raise HTTPException(
+                    status.HTTP_400_BAD_REQUEST,
+                    detail={"message": "end_time phải lớn hơn start_time", "schedule_ids": bad_range},
+                )
+            by_start: Dict[timedelta, List[int]] = defaultdict(list)
+            for sid, r in merged.items():
+                by_start[_as_timedelta(r["start_time"])].append(sid)
+            dup = [{"start_time": str(t), "schedule_ids": ids} for t, ids in by_start.items() if len(ids) > 1]
+            if dup:
                 raise HTTPException(
                     status.HTTP_409_CONFLICT,
-                    detail=f"Trùng ca: start_time mới đã tồn tại trong ngày {payload.work_date}.",
+                    detail={"message": f"Trùng ca: start_time mới đã tồn tại trong ngày {payload.work_date}.",
+                            "conflicts": dup},
                 )
-            raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=f"DB integrity error: {repr(ie)}")
-        except Exception as e:
-            raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Database error: {repr(e)}")
 
-    return {"message": "Cập nhật ca trong ngày thành công", "updated": updated, "missing_schedule_ids": missing}
+            if changed:
+                # Ca đổi giờ sang start_time đang thuộc ca khác (đổi chỗ cho nhau): UNIQUE được kiểm tra
+                # theo từng dòng -> chuyển tạm sang giá trị âm rồi mới ghi giá trị thật.
+                # Giá trị tạm -1s, -2s, ... theo thứ tự trong lô: giờ thật luôn >= 0 và các ca trong ngày
+                # đang bị khóa nên không trùng, luôn nằm trong miền TIME (khác SEC_TO_TIME(-id) bị cắt ở -838:59:59)
+                moving = [sid for sid in changed
+                          if _as_timedelta(merged[sid]["start_time"]) != _as_timedelta(current[sid]["start_time"])]
+                old_starts = {_as_timedelta(current[sid]["start_time"]): sid for sid in current}
+                if any(old_starts.get(_as_timedelta(merged[sid]["start_time"]), sid) != sid for sid in moving):
+                    ph = ",".join(["%s"] * len(moving))
+                    scratch = " ".join(["WHEN %s THEN SEC_TO_TIME(%s)"] * len(moving))
+                    cur.execute(
+                        f"UPDATE doctor_schedules SET start_time = CASE id {scratch} END WHERE id IN ({ph})",
+                        (*[v for i, sid in enumerate(moving) for v in (sid, -(i + 1))], *moving),
+                    )
+
+                set_parts: List[str] = []
+                values: List[Any] = []
+                for f in _DAY_EDIT_FIELDS:
+                    set_parts.append(f"{f} = CASE id " + " ".join(["WHEN %s THEN %s"] * len(changed)) + " END")
+                    for sid in changed:
+                        values.extend([sid, merged[sid][f]])
+                ph = ",".join(["%s"] * len(changed))
+                cur.execute(
+                    f"""
+                    UPDATE doctor_schedules
+                       SET {", ".join(set_parts)}, updated_at = NOW(), capacity_version = capacity_version + 1
+                     WHERE id IN ({ph})
+                       AND doctor_id = %s
+                       AND clinic_id = %s
+                       AND work_date = %s
+                    """,
+                    (*values, *changed, doctor_id, payload.clinic_id, payload.work_date),
+                )
+                for sid in changed:
+                    merged[sid]["capacity_version"] = int(current[sid]["capacity_version"]) + 1
+            conn.commit()
+
+    except HTTPException:
+        raise
+    except pymysql.err.IntegrityError as ie:
+        if ie.args and ie.args[0] == 1062:
+            raise HTTPException(
+                status.HTTP_409_CONFLICT,
+                detail=f"Trùng ca: start_time mới đã tồn tại trong ngày {payload.work_date}.",
+            )
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=f"DB integrity error: {repr(ie)}")
+    except Exception as e:
+        raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Database error: {repr(e)}")
+
+    # max_patients/status có thể đổi -> bộ đếm chỗ đọc lại từ DB
+    after_commit(seat_engine.invalidate, changed)
+    after_commit(availability_cache.shifts_edited, doctor_id, payload.clinic_id, payload.work_date,
+                 [merged[sid] for sid in changed])
+    return {
+        "message": "Cập nhật ca trong ngày thành công",
+        "updated": len(changed),
+        "missing_schedule_ids": [sid for sid, r in results.items() if r == "missing"],
+        "results": results,
+    }
 
 def update_day_shifts_for_user(current_user: Any, payload: DayUpsertRequest) -> Dict[str, Any]:
     user_id = _extract_user_id(current_user)
@@ -423,9 +641,11 @@ def delete_shifts_by_ids_for_doctor(doctor_id: int, clinic_id: int, schedule_ids
     """
     try:
         affected = db.query_put(sql, (doctor_id, clinic_id, *schedule_ids))
-        return {"deleted": affected or 0}
     except Exception as e:
         raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Database error: {repr(e)}")
+    after_commit(seat_engine.invalidate, schedule_ids)
+    after_commit(availability_cache.invalidate_schedules, schedule_ids)
+    return {"deleted": affected or 0}
 
 def delete_shifts_by_ids_for_user(current_user: Any, clinic_id: int, schedule_ids: List[int]) -> Dict[str, int]:
     user_id = _extract_user_id(current_user)
@@ -437,7 +657,6 @@ def delete_shifts_by_ids_for_user(current_user: Any, clinic_id: int, schedule_id
 # ============================================================
 
 def bulk_create_shifts_for_doctor(doctor_id: int, payload: MultiShiftBulkCreateRequestModel) -> Dict[str, int]:
-    _ensure_doctor_exists(doctor_id)
-    _ensure_doctor_assigned_to_clinic(doctor_id, payload.clinic_id)
+    # bulk_create_shifts tự kiểm tra bác sĩ/phòng khám 1 lần
     fixed = payload.copy(update={"doctor_id": doctor_id})
     return bulk_create_shifts(fixed)
@@ -68,6 +68,37 @@ class MultiShiftBulkCreateRequestModel(BaseModel):
         return v
 
 
+# ---- ROLLOUT nhiều bác sĩ / nhiều phòng khám ----
+class RosterEntry(BaseModel):
+    doctor_id: int
+    clinic_id: int
+    weekdays: List[int] = Field(..., description="0=Mon .. 6=Sun")
+    shifts: List[ShiftTimeConfig] = Field(..., min_length=1)
+
+    @field_validator("weekdays")
+    @classmethod
+    def _check_weekdays(cls, v: List[int]):
+        if not v:
+            raise ValueError("weekdays không được rỗng")
+        if any(d < 0 or d > 6 for d in v):
+            raise ValueError("weekdays chỉ trong khoảng 0..6")
+        return v
+
+
+class DepartmentRolloutRequestModel(BaseModel):
+    start_date: date
+    end_date: date
+    roster: List[RosterEntry] = Field(..., min_length=1)
+
+    @field_validator("end_date")
+    @classmethod
+    def _check_range(cls, v: date, info):
+        start = info.data.get("start_date")
+        if start and v < start:
+            raise ValueError("end_date phải >= start_date")
+        return v
+
+
 # ---- UPDATE THEO schedule_id ----
 class ShiftEditItem(BaseModel):
     schedule_id: int
@@ -129,3 +160,4 @@ class DayShiftDTO(BaseModel):
     remaining: int
     status: int
     note: Optional[str] = None
+    capacity_version: int = 0  # so với "version" của event SSE "capacity"
@@ -1,15 +1,20 @@
 from typing import List
-from datetime import date as date_type
-from fastapi import APIRouter, Depends, HTTPException, Query, status
-from fastapi.responses import JSONResponse
+from datetime import date as date_type, datetime
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.encoders import jsonable_encoder
 
 from backend.auth.providers.partient_provider import PatientProvider, AuthUser
 from backend.auth.providers.auth_providers import AuthProvider, DoctorUser, AdminUser
+from backend.realtime.broker import broker, sse_stream
+from backend.schedule_doctors.availability_cache import availability_cache, availability_topic, availability_version
+from backend.database.versions import versions, ttl_bucket, not_modified, json_with_etag
 from backend.schedule_doctors.models import (
     CalendarDayDTO,
     DayShiftDTO,
     MultiShiftBulkCreateRequestModel,
+    DepartmentRolloutRequestModel,
     DayUpsertRequest,
     ShiftCreateRequestModel,
     ShiftResponseModel,
@@ -21,10 +26,14 @@ from backend.schedule_doctors.controllers import (
     create_shift_for_doctor,
     bulk_create_shifts,
     bulk_create_shifts_for_doctor,
+    rollout_department_schedules,
     update_day_shifts_for_user,
     update_day_shifts_for_doctor,
     delete_shifts_by_ids_for_user,
     delete_shifts_by_ids_for_doctor,
+    parse_month,
+    parse_work_date,
+    VN_TZ,
 )
 
 router = APIRouter(prefix="/schedule-doctors", tags=["Schedule Doctors"])
@@ -35,14 +44,52 @@ patient_handler = PatientProvider()
 # VIEW cho bệnh nhân
 # =======================
 @router.get("/calendar", response_model=List[CalendarDayDTO])
-def api_calendar(doctor_id: int, clinic_id: int, month: str):
-    data = get_calendar_days(doctor_id, clinic_id, month)
-    return JSONResponse(status_code=status.HTTP_200_OK, content=jsonable_encoder(data))
+def api_calendar(request: Request, doctor_id: int, clinic_id: int, month: str):
+    # chuẩn hóa trước ('2025-1' -> '2025-01'): key phiên bản phải trùng key tháng mà cache tăng
+    month = parse_month(month).strftime("%Y-%m")
+    # ETag lấy trước khi đọc dữ liệu: ghi chen giữa thì lần sau client vẫn nhận bản mới
+    # ngày VN: kết quả bỏ các ngày đã qua; bucket TTL: ghi từ worker khác không có hook ở đây
+    etag = versions.etag(
+        "calendar", doctor_id, clinic_id, month, availability_version(doctor_id, clinic_id, month),
+        datetime.now(VN_TZ).date(), ttl_bucket(availability_cache.ttl),
+    )
+    return not_modified(request, etag) or json_with_etag(get_calendar_days(doctor_id, clinic_id, month), etag)
 
 @router.get("/day-shifts", response_model=List[DayShiftDTO])
-def api_day_shifts(doctor_id: int, clinic_id: int, work_date: str):
-    data = get_day_shifts(doctor_id, clinic_id, work_date)
-    return JSONResponse(status_code=status.HTTP_200_OK, content=jsonable_encoder(data))
+def api_day_shifts(request: Request, doctor_id: int, clinic_id: int, work_date: str):
+    day = parse_work_date(work_date)  # chuẩn hóa '2025-1-5' như controller
+    # hôm nay: ca đã kết thúc bị lọc theo giờ VN -> thêm phút hiện tại vào ETag
+    vn_now = datetime.now(VN_TZ)
+    clock = vn_now.strftime("%H:%M") if day == vn_now.date() else ""
+    etag = versions.etag(
+        "day-shifts", doctor_id, clinic_id, day, availability_version(doctor_id, clinic_id, day.strftime("%Y-%m")),
+        vn_now.date(), clock, ttl_bucket(availability_cache.ttl),
+    )
+    return not_modified(request, etag) or json_with_etag(get_day_shifts(doctor_id, clinic_id, day), etag)
+
+# Stream chỗ trống realtime (SSE) cho 1 (bác sĩ, phòng khám, ngày): snapshot + event "capacity"
+# Event được publish sau commit nên có thể đến lệch thứ tự (và event xếp hàng trước snapshot đến sau nó):
+# client giữ capacity_version của từng ca từ snapshot, bỏ event có version <= giá trị đang giữ.
+@router.get("/stream")
+async def api_availability_stream(request: Request, doctor_id: int, clinic_id: int, work_date: date_type):
+    # subscribe trước khi lấy snapshot để không lỡ event xảy ra ở giữa
+    sub = broker.subscribe(availability_topic(doctor_id, clinic_id, work_date))
+    try:
+        shifts = await run_in_threadpool(get_day_shifts, doctor_id, clinic_id, work_date)
+    except HTTPException as e:
+        if e.status_code != status.HTTP_404_NOT_FOUND:
+            sub.close()
+            raise
+        shifts = []
+    except Exception:
+        sub.close()
+        raise
+    snapshot = {"type": "snapshot", "work_date": str(work_date), "shifts": jsonable_encoder(shifts)}
+    return StreamingResponse(
+        sse_stream(sub, initial=[snapshot], is_disconnected=request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 # =======================
 # TẠO 1 CA (single)
@@ -84,6 +131,17 @@ def api_bulk_create_shifts_for_doctor_route(
     data = bulk_create_shifts_for_doctor(doctor_id, payload)
     return JSONResponse(status_code=status.HTTP_200_OK, content=jsonable_encoder(data))
 
+# =======================
+# ROLLOUT CẤP KHOA (nhiều bác sĩ/phòng khám) - stream tiến độ NDJSON
+# =======================
+@router.post("/rollout")
+def api_rollout_department(
+    payload: DepartmentRolloutRequestModel,
+    current_user: AdminUser = Depends(auth_handler.get_current_admin_user),
+):
+    stream = rollout_department_schedules(payload)
+    return StreamingResponse(stream, status_code=status.HTTP_200_OK, media_type="application/x-ndjson")
+
 # =======================
 # UPDATE THEO NGÀY (schedule_id)
 # =======================
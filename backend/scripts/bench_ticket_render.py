@@ -0,0 +1,85 @@
+"""
+Đo thời gian render và kích thước PDF phiếu khám (không cần DB):
+
+    python -m backend.scripts.bench_ticket_render [số_phiếu_mỗi_lô] [số_lần]
+
+So sánh:
+  inline : vẽ lại toàn bộ phần tĩnh trên mỗi trang (cách cũ)
+  form   : phần tĩnh biên dịch 1 lần thành form XObject, mỗi trang chỉ doForm + giá trị + QR
+  raster/vector : QR qua PNG + ImageReader hoặc vẽ thẳng ma trận thành path (TICKET_QR_MODE)
+  vector (in lại): ma trận QR đã có trong cache theo payload
+"""
+import sys
+import time
+from datetime import datetime, timedelta
+from io import BytesIO
+from typing import Any, Callable, Dict, List
+
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+from backend.appointments import tickets
+
+
+def _sample_rows(n: int) -> List[Dict[str, Any]]:
+    base = datetime(2025, 1, 6, 7, 30)
+    return [{
+        "id": 1000 + i, "patient_id": 500 + i, "queue_number": i + 1,
+        "estimated_time": base + timedelta(minutes=10 * i), "paid_at": base - timedelta(days=1, minutes=i),
+        "cur_price": 150000, "patient_name": f"Nguyễn Văn Bệnh Nhân {i}", "dob": "1990-05-17",
+        "phone": "0909123456", "national_id": f"0792000{i:05d}", "gender": "Nam",
+        "service_name": "Khám nội tổng quát", "doctor_name": "BS. Trần Thị Minh", "clinic_name": "Phòng 101",
+        "order_code": f"APPT{1000 + i}250105AB12",
+    } for i in range(n)]
+
+
+def _render(rows: List[Dict[str, Any]], use_form: bool) -> bytes:
+    buf = BytesIO()
+    cv = canvas.Canvas(buf, pagesize=A4, invariant=1)
+    if use_form:
+        tickets._begin_ticket_document(cv)
+    for data in rows:
+        if use_form:
+            cv.doForm(tickets._STATIC_FORM)
+        else:
+            tickets._draw_static_layer(cv)
+        tickets._draw_variable_layer(cv, data)
+        cv.showPage()
+    cv.save()
+    return buf.getvalue()
+
+
+def _bench(label: str, fn: Callable[[], bytes], tickets_per_call: int, repeat: int) -> None:
+    fn()  # warm-up: font, layout
+    started = time.perf_counter()
+    for _ in range(repeat):
+        size = len(fn())
+    per_ticket_ms = (time.perf_counter() - started) * 1000 / (repeat * tickets_per_call)
+    print(f"{label:<34} {per_ticket_ms:8.2f} ms/phiếu {size / tickets_per_call / 1024:9.1f} KB/phiếu")
+
+
+def main() -> int:
+    batch = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    tickets._ensure_fonts()
+    single, rows = _sample_rows(1), _sample_rows(batch)
+
+    def cold(rows_, use_form):
+        # bỏ cache ma trận QR: đo cả bước encode
+        def run():
+            tickets._qr_runs.cache_clear()
+            return _render(rows_, use_form)
+        return run
+
+    for mode in ("raster", "vector"):
+        tickets.TICKET_QR_MODE = mode
+        _bench(f"1 phiếu / inline / {mode}", cold(single, False), 1, repeat * 10)
+        _bench(f"1 phiếu / form / {mode}", cold(single, True), 1, repeat * 10)
+        _bench(f"lô {batch} / inline / {mode}", cold(rows, False), batch, repeat)
+        _bench(f"lô {batch} / form / {mode}", cold(rows, True), batch, repeat)
+    _bench("1 phiếu / form / vector (in lại)", lambda: _render(single, True), 1, repeat * 10)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
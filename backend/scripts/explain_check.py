@@ -0,0 +1,99 @@
+"""
+Kiểm tra hồi quy bằng EXPLAIN: các truy vấn lọc theo ngày phải đi theo index (không full scan).
+Chạy trên DB đã áp dụng backend/database/migrations:
+
+    python -m backend.scripts.explain_check
+
+SQL được lấy từ chính các hàm dựng truy vấn trong controllers (ghi lại thay vì thực thi),
+sau đó EXPLAIN trên DB thật. Có truy vấn full scan bảng được kiểm tra -> exit code 1.
+"""
+import os
+import sys
+from datetime import date, datetime, time
+from typing import Any, Dict, List, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), "..", ".env"))
+
+from backend.database.connector import DatabaseConnector  # noqa: E402
+import backend.appointments.controllers as appt  # noqa: E402
+from backend.appointments.models import (  # noqa: E402
+    AppointmentFilterModel, AppointmentPaymentFilterModel, DoctorAppointmentFeedFilterModel,
+)
+
+
+class _Recorder:
+    """Thay cho db/uow/cursor: ghi lại (sql, params), trả về rỗng"""
+
+    def __init__(self):
+        self.queries: List[Tuple[str, tuple]] = []
+
+    def query_get(self, sql: str, params=()):
+        self.queries.append((sql, tuple(params)))
+        return []
+
+    def execute(self, sql: str, params=()):
+        self.queries.append((sql, tuple(params)))
+
+    def fetchone(self):
+        return None
+
+
+# (tên, hàm chạy builder với recorder, bảng phải dùng index)
+def _cases() -> List[Tuple[str, Any, str]]:
+    day_from, day_to = date(2025, 1, 1), date(2025, 1, 31)
+
+    def my_appointments(rec):
+        appt.get_my_appointments(1, AppointmentFilterModel(from_date=day_from, to_date=day_to), rec)
+
+    def patient_payments(rec):
+        appt.list_patient_appointments_by_payment(1, AppointmentPaymentFilterModel(from_date=day_from, to_date=day_to), rec)
+
+    def admin_payments(rec):
+        original, appt.db = appt.db, rec
+        try:
+            appt.list_all_appointments_by_payment_admin(AppointmentPaymentFilterModel(from_date=day_from, to_date=day_to))
+        finally:
+            appt.db = original
+
+    def doctor_feed(rec):
+        original, appt.db = appt.db, rec
+        try:
+            appt.get_doctor_appointment_feed(1, DoctorAppointmentFeedFilterModel(from_date=day_from, to_date=day_to))
+            appt.get_doctor_appointment_feed(1, DoctorAppointmentFeedFilterModel(since=datetime(2025, 1, 1)))
+        finally:
+            appt.db = original
+
+    def pick_offline(rec):
+        appt._pick_schedule_for_offline(rec, 1, 1, today=day_from, now_time=time(9, 0))
+
+    return [
+        ("get_my_appointments", my_appointments, "a"),
+        ("list_patient_appointments_by_payment", patient_payments, "a"),
+        ("list_all_appointments_by_payment_admin", admin_payments, "a"),
+        ("get_doctor_appointment_feed", doctor_feed, "a"),
+        ("_pick_schedule_for_offline", pick_offline, "doctor_schedules"),
+    ]
+
+
+def main() -> int:
+    db = DatabaseConnector()
+    failed = 0
+    for name, build, table in _cases():
+        rec = _Recorder()
+        build(rec)
+        for sql, params in rec.queries:
+            plan: List[Dict[str, Any]] = db.query_get("EXPLAIN " + sql, params)
+            rows = [r for r in plan if r.get("table") == table]
+            bad = [r for r in rows if r.get("type") == "ALL" or not r.get("key")]
+            status = "FAIL" if (bad or not rows) else "ok"
+            keys = ", ".join(f"{r.get('type')}:{r.get('key')}" for r in rows) or "-"
+            print(f"[{status}] {name}: {table} -> {keys}")
+            failed += status == "FAIL"
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
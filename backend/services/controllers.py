@@ -2,18 +2,26 @@ from fastapi import HTTPException, status
 from typing import List, Dict, Any
 from backend.database.connector import DatabaseConnector
 from backend.services.models import ServiceCreateModel, ServiceUpdateModel
+from backend.database.reference_cache import reference_cache, tags_of
 
 db = DatabaseConnector()
 
-def get_all_services(has_insurances: bool = False) -> List[Dict[str, Any]]:
+def _load_all_services() -> List[Dict[str, Any]]:
     try:
-        services = db.call_procedure("sp_get_all_services", ())
+        return db.call_procedure("sp_get_all_services", ())
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Stored procedure error: {e}"
         )
 
+
+def get_all_services(has_insurances: bool = False) -> List[Dict[str, Any]]:
+    # bản sao từ cache -> giảm giá BHYT tại chỗ không ảnh hưởng lần đọc sau
+    services = reference_cache.get_or_load(
+        "services", "all", _load_all_services,
+        lambda rows: tags_of(rows, "service") | {"service:list"},
+    )
     if has_insurances:
         for s in services:
             if s.get("price") is not None:
@@ -21,30 +29,45 @@ def get_all_services(has_insurances: bool = False) -> List[Dict[str, Any]]:
     return services
 
 
-def get_service_by_id(service_id: int) -> Dict[str, Any]:
+def _load_service(service_id: int) -> List[Dict[str, Any]]:
     try:
-        result = db.call_procedure("sp_get_service_by_id", (service_id,))
+        return db.call_procedure("sp_get_service_by_id", (service_id,))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Stored procedure error: {e}")
 
+
+def get_service_by_id(service_id: int) -> Dict[str, Any]:
+    result = reference_cache.get_or_load(
+        "services", ("id", service_id), lambda: _load_service(service_id),
+        lambda rows: {f"service:{service_id}"},
+    )
+
     if not result:
         raise HTTPException(status_code=404, detail="Dịch vụ không tồn tại")
     return result[0]
 
 
-def get_my_services_by_user(user_id: int) -> List[Dict[str, Any]]:
+def _load_my_services(user_id: int) -> List[Dict[str, Any]]:
     try:
         return db.call_procedure("sp_get_my_services_by_user", (user_id,))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Stored procedure error: {e}")
 
 
+def get_my_services_by_user(user_id: int) -> List[Dict[str, Any]]:
+    return reference_cache.get_or_load(
+        "services", ("user", user_id), lambda: _load_my_services(user_id),
+        lambda rows: tags_of(rows, "service") | {"service:list", "assignments", f"user:{user_id}"},
+    )
+
+
 def create_service(data: ServiceCreateModel) -> Dict[str, Any]:
     try:
         result = db.call_procedure(
             "sp_create_service",
             (data.name, data.description, data.price)
         )
+        reference_cache.invalidate("service:list")
         return result[0] if result else {}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Stored procedure error: {e}")
@@ -56,6 +79,7 @@ def update_service(data: ServiceUpdateModel) -> Dict[str, Any]:
             "sp_update_service",
             (data.id, data.name, data.description, data.price)
         )
+        reference_cache.invalidate(f"service:{data.id}")
         if not result:
             raise HTTPException(status_code=404, detail="Dịch vụ không tồn tại")
         return result[0]
@@ -66,5 +90,6 @@ def update_service(data: ServiceUpdateModel) -> Dict[str, Any]:
 def delete_service(service_id: int) -> None:
     try:
         db.call_procedure("sp_delete_service", (service_id,))
+        reference_cache.invalidate(f"service:{service_id}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Stored procedure error: {e}")
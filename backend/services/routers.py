@@ -1,9 +1,11 @@
-from fastapi import APIRouter, HTTPException, Depends, status, Query
+from fastapi import APIRouter, HTTPException, Depends, Request, status, Query
 from fastapi.responses import JSONResponse
 from typing import List
 from fastapi.encoders import jsonable_encoder
 from typing import Annotated
 from backend.auth.providers.auth_providers import AuthProvider, AdminUser
+from backend.database.reference_cache import reference_cache
+from backend.database.versions import versions, ttl_bucket, not_modified, json_with_etag
 
 from backend.services.controllers import (
     get_all_services, get_service_by_id,
@@ -22,9 +24,12 @@ router = APIRouter(prefix="/services", tags=["Services"])
 # API: Lấy danh sách dịch vụ (có thể filter theo bảo hiểm)
 @router.get("/")
 def list_services(
+    request: Request,
     has_insurances: Annotated[bool, Query(description="Có sử dụng bảo hiểm hay không")] = False
 ):
-    return get_all_services(has_insurances)
+    etag = versions.etag("services", has_insurances, *versions.get("service"),
+                         ttl_bucket(reference_cache.ttl("services")))
+    return not_modified(request, etag) or json_with_etag(get_all_services(has_insurances), etag)
 
 
 # API: Lấy chi tiết 1 dịch vụ theo ID
@@ -1,6 +1,8 @@
 from fastapi import HTTPException
 from backend.database.connector import DatabaseConnector
 from backend.auth.providers.auth_providers import AuthProvider
+from backend.auth.providers.principal_cache import invalidate_user
+from backend.database.reference_cache import reference_cache
 from backend.users.models import UserCreateModel, UserUpdateModel
 
 auth_handler = AuthProvider()
@@ -43,6 +45,7 @@ def update_user(user_id: int, update_data: UserUpdateModel):
         update_data.phone,
         update_data.role
     ))
+    invalidate_user(user_id)
     if not result:
         raise HTTPException(status_code=404, detail="User not found")
     return result[0]
@@ -50,4 +53,6 @@ def update_user(user_id: int, update_data: UserUpdateModel):
 def delete_user(user_id: int):
     db = DatabaseConnector()
     result = db.call_procedure("sp_delete_user", (user_id,))
+    invalidate_user(user_id)
+    reference_cache.invalidate(f"user:{user_id}")
     return result[0]